@@ -0,0 +1,133 @@
+"""
+POST の冪等キー（ダブルクリック・リトライで同じ処理を2回しない）
+
+クライアントは Idempotency-Key ヘッダーか、フォームの hidden の idempotency_key でキーを送る
+（フォームには画面を出すたびに new_key() で作ったキーを入れておく）。
+
+- 初めてのキー: ビューを呼び、結果（リダイレクト先か JSON）を TTL つきで保存する
+- 処理済みのキー: ビューは呼ばずに、保存した結果をそのまま返す
+- 処理中のキー（ダブルクリックでほぼ同時に来た2回目）: 1回目が終わるまで少し待って同じ結果を返す
+- 同じキーで違う内容: 422
+
+フォームのエラー（200 の HTML）やエラーのレスポンスは状態を変えていないので保存せず、
+キーを消して同じキーでやり直せるようにする。
+"""
+import hashlib
+import time
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+TTL = timedelta(hours=24)
+
+# 処理中のキーの結果を待つ時間
+WAIT_SECONDS = 5
+WAIT_INTERVAL = 0.1
+
+# 内容の比較に使わないフィールド
+IGNORED_FIELDS = {'csrfmiddlewaretoken', FIELD}
+
+
+def new_key():
+    """フォームの hidden に入れるキー"""
+    return uuid.uuid4().hex
+
+
+def get_key(request):
+    return (request.headers.get(HEADER) or request.POST.get(FIELD) or '').strip()[:64]
+
+
+def fingerprint(request):
+    """パスと送られてきた内容のハッシュ"""
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode())
+    if request.content_type == 'application/json':
+        digest.update(b'\0' + request.body)
+    for name in sorted(request.POST):
+        if name in IGNORED_FIELDS:
+            continue
+        for value in request.POST.getlist(name):
+            digest.update(f'\0{name}={value}'.encode())
+    return digest.hexdigest()
+
+
+def _store(record, response):
+    """保存できる結果（リダイレクトか JSON）なら保存して True"""
+    status = response.status_code
+    if 300 <= status < 400 and response.has_header('Location'):
+        record.location = response['Location']
+    elif 200 <= status < 300 and response.get('Content-Type', '').startswith('application/json'):
+        record.content_type = response['Content-Type']
+        record.body = response.content.decode(response.charset)
+    else:
+        return False
+    record.status_code = status
+    record.save(update_fields=['status_code', 'location', 'content_type', 'body'])
+    return True
+
+
+def _replay(record):
+    response = HttpResponse(record.body, status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for(user, key):
+    """処理中なら終わるまで待つ。消えていれば（1回目が保存しなかった）None"""
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None or record.status_code is not None or time.monotonic() >= deadline:
+            return record
+        time.sleep(WAIT_INTERVAL)
+
+
+def idempotent(view_func):
+    """
+    ログイン中のユーザーの、キーつきの POST だけを冪等にするデコレーター。
+    キーがなければふつうにビューを呼ぶ（これまでのクライアントもそのまま動く）。
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = get_key(request) if request.method == 'POST' else ''
+        if not key or not request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+
+        now = timezone.now()
+        digest = fingerprint(request)
+        IdempotencyKey.objects.filter(user=request.user, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=digest, expires_at=now + TTL,
+                )
+        except IntegrityError:
+            record = _wait_for(request.user, key)
+            if record is None:
+                return view_func(request, *args, **kwargs)
+            if record.fingerprint != digest:
+                return HttpResponse('同じキーで別の内容が送られました。', status=422)
+            if record.status_code is None:
+                return HttpResponse('前のリクエストを処理中です。しばらくしてからお試しください。', status=409)
+            return _replay(record)
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if not _store(record, response):
+            record.delete()
+        return response
+
+    return wrapper
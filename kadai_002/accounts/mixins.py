@@ -1,7 +1,6 @@
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.urls import reverse_lazy
 
 
 class PaidMemberRequiredMixin(UserPassesTestMixin):
@@ -21,3 +20,15 @@ class PaidMemberRequiredMixin(UserPassesTestMixin):
                 'この機能は有料プラン会員限定です。有料プランに登録してご利用ください。'
             )
             return redirect('accounts:payment_method')
+
+
+class OwnerRequiredMixin(UserPassesTestMixin):
+    """オーナー会員用のMixin"""
+
+    def test_func(self):
+        user = self.request.user
+        return user.is_authenticated and getattr(user, "is_owner_member", False)
+
+    def handle_no_permission(self):
+        from django.contrib.auth.views import redirect_to_login
+        return redirect_to_login(self.request.get_full_path())
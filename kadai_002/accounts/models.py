@@ -61,4 +61,34 @@ class User(AbstractUser):
     objects = CustomUserManager()
 
     def __str__(self):
-        return self.email
\ No newline at end of file
+        return self.email
+
+class IdempotencyKey(models.Model):
+    """
+    POST の二重送信・リトライ対策（idempotency.py）
+    ユーザーごとに同じキーで送られてきた POST は、最初の結果（リダイレクト先か JSON）をそのまま返す。
+    """
+    user = models.ForeignKey(
+        'accounts.User',
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+    )
+    key = models.CharField(max_length=64)
+    # 送られてきた内容のハッシュ。同じキーで別の内容が来たらエラーにする
+    fingerprint = models.CharField(max_length=64)
+    # 最初の結果（処理中は status_code が None）
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.key}"
@@ -1,3 +1,63 @@
+from datetime import date, time, timedelta
+
 from django.test import TestCase
+from django.urls import reverse
+
+from reservations.models import Reservation
+from restaurants.models import Category, Company, Favorite, Restaurant, Table
+from .models import IdempotencyKey, User
+
+
+class IdempotencyTests(TestCase):
+    """同じキーの POST は1回しか処理されず、2回目は最初の結果が返る"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner@example.com', None, name='owner', is_owner_member=True)
+        company = Company.objects.create(
+            owner=owner, name='テスト', representative='r', zipcode='1', address='a', business='b',
+        )
+        category = Category.objects.create(company=company, name='和食')
+        self.restaurant = Restaurant.objects.create(
+            company=company, category=category, name='店舗', price_min=1000, price_max=2000,
+            open_time=time(11), close_time=time(22), zipcode='1', address='a', tel='1',
+        )
+        Table.objects.create(restaurant=self.restaurant, capacity=4)
+        Table.objects.create(restaurant=self.restaurant, capacity=4)
+        self.user = User.objects.create_user('user@example.com', None, name='user', is_paid_member=True)
+        self.client.force_login(self.user)
+
+    def test_retried_reservation_is_created_once(self):
+        url = reverse('reservations:reservation_create', args=[self.restaurant.pk])
+        data = {
+            'reservation_date': (date.today() + timedelta(days=7)).isoformat(),
+            'reservation_time': '19:00', 'party_size': 2, 'idempotency_key': 'abc',
+        }
+        first = self.client.post(url, data)
+        second = self.client.post(url, data)
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second.status_code, 302)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reservation.objects.count(), 1)
+
+        # 同じキーで別の内容は受け付けない
+        data['party_size'] = 3
+        self.assertEqual(self.client.post(url, data).status_code, 422)
+
+    def test_form_error_does_not_use_up_key(self):
+        url = reverse('reservations:reservation_create', args=[self.restaurant.pk])
+        data = {'reservation_date': '2000-01-01', 'reservation_time': '19:00', 'party_size': 2, 'idempotency_key': 'k'}
+        self.assertEqual(self.client.post(url, data).status_code, 200)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_retried_favorite_toggle_does_not_flip_back(self):
+        url = reverse('restaurants:favorite_toggle', args=[self.restaurant.pk])
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'fav-1', 'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        first = self.client.post(url, **headers)
+        second = self.client.post(url, **headers)
+        self.assertEqual(first.json(), second.json())
+        self.assertTrue(Favorite.objects.filter(user=self.user, restaurant=self.restaurant).exists())
 
-# Create your tests here.
+        # 新しいキーなら解除される
+        self.client.post(url, HTTP_IDEMPOTENCY_KEY='fav-2', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertFalse(Favorite.objects.filter(user=self.user, restaurant=self.restaurant).exists())
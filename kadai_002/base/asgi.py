@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
 
 application = get_asgi_application()
+
+# 検索ボックスの入力候補のインデックスを、最初のリクエストの前に作っておく
+from restaurants import suggest_index  # noqa: E402
+
+suggest_index.warm_up()
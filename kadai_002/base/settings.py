@@ -85,11 +85,35 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 予約が同時に来ても "database is locked" にならないよう、
+        # 書き込みのロックはトランザクションの開始時に取って順番待ちさせる
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        # 同時予約のテスト（reservations/tests.py）はスレッドごとに接続するのでファイルの DB にする
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
 
+# Cache
+# 店舗検索結果のキャッシュ（restaurants/search_cache.py）で使用
+# 本番で複数プロセスにする場合は Redis / Memcached に切り替える
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nagoyameshi',
+    }
+}
+
+# 都道府県 → 市区町村の JSON（export_city_index コマンドでデプロイ時に書き出す）
+# ファイルがあれば /api/cities/ は起動時に DB ではなくこれを読む（書き出した後に店舗が変わっていれば使わない）
+CITY_INDEX_FILE = BASE_DIR / 'data' / 'cities.json'
+
+# 利用済み・キャンセルの予約を ArchivedReservation に移すまでの日数（archive_reservations コマンド）
+RESERVATION_ARCHIVE_DAYS = 365
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,3 +1,62 @@
+from django import forms
 from django.contrib import admin
 
-# Register your models here.
+from .availability import ACTIVE_STATUSES
+from .models import ArchivedReservation, Reservation
+
+
+class ReservationAdminForm(forms.ModelForm):
+    """
+    管理画面で変えられるのはステータスとメモだけ。
+    日時・テーブル・人数を変えると SlotClaim と埋まり具合のビット列が合わなくなるので読み取り専用にし、
+    キャンセル・利用済みなどから有効な予約に戻すこともできないようにする（手放した枠を取り直さないため）。
+    有効でなくすのは、保存したときに signals.py の sync_claims で枠を手放すので問題ない。
+    """
+
+    class Meta:
+        model = Reservation
+        fields = ['status', 'notes']
+
+    def clean_status(self):
+        status = self.cleaned_data['status']
+        if (self.instance.pk and status in ACTIVE_STATUSES
+                and self.instance.status not in ACTIVE_STATUSES):
+            raise forms.ValidationError('キャンセル・利用済みの予約を有効な予約に戻すことはできません。')
+        return status
+
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    form = ReservationAdminForm
+    list_display = ('id', 'restaurant', 'reservation_date', 'reservation_time', 'party_size', 'status', 'user', 'created_at')
+    list_filter = ('status', 'reservation_date')
+    search_fields = ('restaurant__name', 'user__name', 'user__email')
+    date_hierarchy = 'reservation_date'
+    list_select_related = ('restaurant', 'user')
+    list_editable = ('status',)  # 無断キャンセル・利用済みをここから付けられるように
+    # 枠の確保（allocation.assign_table）を通らない変更はさせない（ReservationAdminForm を参照）
+    readonly_fields = (
+        'user', 'restaurant', 'reservation_date', 'reservation_time', 'party_size', 'table', 'joined_tables',
+        'starts_at', 'ends_at', 'created_at', 'updated_at',
+    )
+    # 件数の多い一覧で COUNT(*) を2回しない
+    show_full_result_count = False
+
+    def get_changelist_form(self, request, **kwargs):
+        # 一覧でのステータスの変更にも同じチェックをかける
+        kwargs.setdefault('form', ReservationAdminForm)
+        return super().get_changelist_form(request, **kwargs)
+
+    def has_add_permission(self, request):
+        # 予約はサイトの予約フォームから作る（枠を確保するため）
+        return False
+
+
+@admin.register(ArchivedReservation)
+class ArchivedReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'restaurant', 'reservation_date', 'reservation_time', 'party_size', 'status', 'user', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('restaurant__name', 'user__name', 'user__email')
+    list_select_related = ('restaurant', 'user')
+    raw_id_fields = ('user', 'restaurant')
+    show_full_result_count = False
@@ -0,0 +1,151 @@
+"""
+テーブルの割り当て（二重予約の防止）
+
+フォームの空席チェックから保存までの間に、別のリクエストが同じテーブルを取ることがある。
+ロックはかけずに、予約が使う15分枠を SlotClaim に insert して確保する。
+(テーブル, 日付, 枠) のユニーク制約にぶつかったら、そのテーブルは先に取られたので
+次の候補テーブルで試す。違うテーブル・違う店舗の予約はお互いを待たない。
+確保・解放と同じトランザクションで、埋まり具合のビット列（occupancy.py）も更新する。
+仮押さえ（holds.py）も同じように SlotClaim で枠を取り、予約を保存するときに枠ごと付け替える。
+"""
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from restaurants.models import Table
+from . import holds, occupancy
+from .availability import ACTIVE_STATUSES, DaySchedule, seating_slots
+from .models import SlotClaim, SlotHold
+
+
+class NoTableAvailable(Exception):
+    """候補のテーブルがすべて先に取られていた"""
+
+
+def release_claims(claims):
+    """claims（SlotClaim のクエリセット）の枠を手放す。埋まり具合のビット列も空ける"""
+    with transaction.atomic():
+        by_day = {}
+        for table_id, date, slot in claims.values_list('table_id', 'date', 'slot'):
+            by_day.setdefault((table_id, date), []).append(slot)
+        if not by_day:
+            return
+        for (table_id, date), slots in by_day.items():
+            occupancy.unmark(table_id, date, slots)
+        claims.delete()
+
+
+def release_slots(reservation):
+    """予約が確保している枠をすべて手放す（キャンセル・日時変更時）"""
+    release_claims(SlotClaim.objects.filter(reservation=reservation))
+
+
+def claim_tables(tables, starts_at, ends_at, exclude_reservation=None, **owner):
+    """
+    [starts_at, ends_at) の間 tables（くっつけて使うときは全部）の枠を確保できれば True。
+    1卓でも取られていれば False（確保しかけた分は戻す）。owner は reservation= か hold=
+    exclude_reservation の予約がもう持っている枠は取らない（編集中の予約の仮押さえ。
+    予約に付け替えるときに take_over_hold が足りない枠を取る）
+    """
+    owned = set()
+    if exclude_reservation is not None and exclude_reservation.pk:
+        owned = set(SlotClaim.objects.filter(reservation=exclude_reservation, table__in=tables)
+                    .values_list('table_id', 'date', 'slot'))
+    # 日をまたぐ予約は翌日の枠も確保する
+    wanted = {
+        (table, date): [slot for slot in day_slots if (table.pk, date, slot) not in owned]
+        for table in tables
+        for date, day_slots in seating_slots(starts_at, ends_at).items()
+    }
+    try:
+        with transaction.atomic():
+            SlotClaim.objects.bulk_create([
+                SlotClaim(table=table, date=date, slot=slot, **owner)
+                for (table, date), day_slots in wanted.items()
+                for slot in day_slots
+            ])
+            for (table, date), day_slots in wanted.items():
+                if day_slots:
+                    occupancy.mark(table.pk, date, day_slots)
+    except IntegrityError:
+        return False
+    return True
+
+
+def try_claim(reservation, tables):
+    """予約の枠を tables で確保できれば True"""
+    return claim_tables(tables, reservation.starts_at, reservation.ends_at, reservation=reservation)
+
+
+def _set_tables(reservation, tables):
+    reservation.table = tables[0]
+    reservation.save(update_fields=['table'])
+    reservation.joined_tables.set(tables[1:])
+
+
+def take_over_hold(reservation, hold):
+    """
+    仮押さえ（holds.py）の枠をそのまま予約に付け替える。付け替えた席（先頭のテーブル）を返す。
+    期限切れ・日時や人数が合わないときは仮押さえを手放して None（ふつうの割り当てに進む）。
+    """
+    hold = SlotHold.objects.select_for_update().filter(pk=hold.pk).first()
+    if hold is None:
+        return None
+    claims = SlotClaim.objects.filter(hold=hold)
+    if (hold.expires_at <= timezone.now() or hold.starts_at != reservation.starts_at
+            or hold.ends_at != reservation.ends_at or hold.party_size != reservation.party_size):
+        hold.delete()
+        return None
+    table_ids = set(claims.values_list('table_id', flat=True))
+    tables = [hold.table] + sorted(
+        Table.objects.filter(pk__in=table_ids - {hold.table_id}), key=lambda table: (-table.capacity, table.pk),
+    )
+    claims.update(hold=None, reservation=reservation)
+    hold.delete()
+    # 編集中の予約の枠と重なっていて仮押さえが取らなかった枠を取る
+    if not claim_tables(tables, reservation.starts_at, reservation.ends_at,
+                        exclude_reservation=reservation, reservation=reservation):
+        release_slots(reservation)
+        return None
+    _set_tables(reservation, tables)
+    return tables[0]
+
+
+def _claim_first(reservation, options):
+    """options: 1卓（Table）か、くっつけるテーブルのリスト（先頭が一番大きいテーブル）"""
+    for option in options:
+        tables = list(option) if isinstance(option, (list, tuple)) else [option]
+        if try_claim(reservation, tables):
+            _set_tables(reservation, tables)
+            return tables[0]
+    return None
+
+
+def assign_table(reservation, candidates=None, hold=None):
+    """
+    保存済みの予約にテーブルを割り当てて保存する。呼び出し側で transaction.atomic() の中で呼ぶこと。
+    hold（その予約のために取った仮押さえ）が使えればその席をそのまま使う。
+    candidates（フォームで見つけた Best Fit 順の空きテーブル、またはくっつけるテーブルのリスト）を順に試し、全部取られていたら
+    その日の空き状況を読み直してもう1回だけ試す。それでもだめなら NoTableAvailable。
+    """
+    release_slots(reservation)
+    # 期限切れの仮押さえが取っている枠は空いている扱いなので、先に片付ける
+    holds.sweep_expired(reservation.restaurant)
+    if hold is not None:
+        table = take_over_hold(reservation, hold)
+        if table is not None:
+            return table
+    if candidates:
+        table = _claim_first(reservation, candidates)
+        if table is not None:
+            return table
+    schedule = DaySchedule.load(reservation.restaurant, reservation.reservation_date, reservation)
+    table = _claim_first(reservation, schedule.seating_options(reservation.reservation_time, reservation.party_size))
+    if table is None:
+        raise NoTableAvailable
+    return table
+
+
+def sync_claims(reservation):
+    """有効でなくなった予約（キャンセル・利用済み）の枠を手放す"""
+    if reservation.status not in ACTIVE_STATUSES:
+        release_slots(reservation)
@@ -0,0 +1,106 @@
+"""
+古い予約のアーカイブ（Reservation → ArchivedReservation）
+
+利用済み・キャンセルになってから RESERVATION_ARCHIVE_DAYS 日より前の予約を、batch_size 件ずつ
+ArchivedReservation に移して Reservation から消す（1バッチ1トランザクション）。
+空席の判定・店舗の予約一覧・管理画面が見る Reservation を小さいままにしておくため。
+archive_reservations コマンドを cron などで1日1回くらい実行する。
+
+移すときの削除では signals.py の後片付けはしない（in_progress() で飛ばす）:
+- 枠: 利用済み・キャンセルにしたときにもう手放している
+- ダッシュボードの集計: 移した予約も数えたままにする（rebuild も両方のテーブルから作る）
+- 空席カレンダー: 過去の日なので関係ない
+
+ユーザーの予約一覧は ReservationHistory で両方のテーブルを合わせて新しい順に出す。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Value
+from django.utils import timezone
+
+from .models import ArchivedReservation, Reservation
+
+
+# 移す予約のステータス（これ以上変わらないもの）
+ARCHIVE_STATUSES = ['completed', 'cancelled', 'no_show']
+BATCH_SIZE = 1000
+
+ARCHIVED_FIELDS = [
+    'id', 'user_id', 'restaurant_id', 'reservation_date', 'reservation_time', 'starts_at', 'ends_at',
+    'party_size', 'status', 'notes', 'created_at', 'updated_at',
+]
+
+_archiving = ContextVar('archiving', default=False)
+
+
+def in_progress():
+    """アーカイブのための削除中なら True（signals.py で後片付けを飛ばす）"""
+    return _archiving.get()
+
+
+@contextmanager
+def _archiving_deletes():
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def archivable(days=None):
+    """移す対象の予約"""
+    days = settings.RESERVATION_ARCHIVE_DAYS if days is None else days
+    cutoff = timezone.localdate() - timedelta(days=days)
+    return Reservation.objects.filter(status__in=ARCHIVE_STATUSES, reservation_date__lt=cutoff)
+
+
+def archive(days=None, batch_size=BATCH_SIZE):
+    """古い予約を ArchivedReservation に移す。移した件数を返す"""
+    count = 0
+    while True:
+        with transaction.atomic(), _archiving_deletes():
+            rows = list(archivable(days).order_by('pk').values_list(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return count
+            ArchivedReservation.objects.bulk_create(
+                [ArchivedReservation(**dict(zip(ARCHIVED_FIELDS, row))) for row in rows],
+                batch_size=batch_size,
+            )
+            Reservation.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        count += len(rows)
+
+
+class ReservationHistory:
+    """
+    ユーザーの予約一覧（Reservation と ArchivedReservation を予約日時の新しい順に）。
+    ListView の Paginator にそのまま渡せるように、件数と切り出しだけ持つ。
+    切り出すときは UNION で並べた (ID, どちらのテーブルか) だけを取ってから、その分の行を読む。
+    """
+
+    def __init__(self, user):
+        self.reservations = Reservation.objects.filter(user=user).select_related('restaurant')
+        self.archived = ArchivedReservation.objects.filter(user=user).select_related('restaurant')
+
+    def _keys(self):
+        columns = ('id', 'reservation_date', 'reservation_time', 'archived')
+        hot = self.reservations.order_by().annotate(archived=Value(False)).values_list(*columns)
+        cold = self.archived.order_by().annotate(archived=Value(True)).values_list(*columns)
+        return hot.union(cold, all=True).order_by('-reservation_date', '-reservation_time', '-id')
+
+    def count(self):
+        return self.reservations.count() + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        keys = list(self._keys()[index])
+        hot = self.reservations.in_bulk([pk for pk, _, _, archived in keys if not archived])
+        cold = self.archived.in_bulk([pk for pk, _, _, archived in keys if archived])
+        return [(cold if archived else hot)[pk] for pk, _, _, archived in keys]
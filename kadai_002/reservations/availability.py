@@ -0,0 +1,306 @@
+"""
+空席の判定
+
+予約は starts_at から ends_at（予約時刻 + 店舗ごとの利用時間。日をまたぐこともある）まで席を使うものとして、
+時間が重なる有効な予約（pending / confirmed）と期限内の仮押さえがないテーブルを「空き」とする。
+
+- free_table_exists: 店舗検索用。(table, starts_at, ends_at) のインデックスを使う EXISTS で、
+  店舗ごとの判定を SQL でまとめて行う（Python で1件ずつ終了時刻を計算しない）
+- DaySchedule: 予約フォームや API 用。1店舗・1日分（日をまたぐ分は翌日も）のテーブルの埋まり具合
+  （occupancy.py のビット列）を1回で取ってきて、予約が使う枠のマスクとの AND で空きを調べる
+"""
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef, Q, Sum
+from django.utils import timezone
+
+from restaurants.models import Restaurant, Table
+from . import occupancy
+from .combination import best_combination
+from .models import Reservation, SlotClaim
+from .occupancy import SLOT_MINUTES, SLOT_SECONDS  # noqa: F401（フォームなどはここから使う）
+
+
+# 席を埋めている予約のステータス
+ACTIVE_STATUSES = ['pending', 'confirmed']
+
+# 満席のときに代わりに出す空き時間の件数と、探す日数（希望の日を含む）
+ALTERNATIVE_LIMIT = 5
+ALTERNATIVE_DAYS = 3
+
+
+def overlapping_reservations(starts_at, ends_at):
+    """
+    [starts_at, ends_at) と重なる有効な予約。
+    重なる = 既存の開始 < 新規の終了 かつ 既存の終了 > 新規の開始
+    """
+    return Reservation.objects.filter(
+        is_active=True,  # = status__in=ACTIVE_STATUSES（部分インデックス reservation_active_period_idx を使うため）
+        starts_at__lt=ends_at,
+        ends_at__gt=starts_at,
+    )
+
+
+def held_claims(starts_at, ends_at):
+    """
+    [starts_at, ends_at) と重なる、期限内の仮押さえの枠（SlotClaim）。
+    くっつけたテーブルは SlotHold.table には一番大きい席しかないので、SlotClaim の table で見る。
+    重なる仮押さえはこの期間の日付にも必ず枠を持っているので、日付で絞って (table, date, slot) のインデックスを使う。
+    期限が切れた仮押さえは、DaySchedule.load_days と同じくまだ消されていなくても空いていることにする。
+    """
+    return SlotClaim.objects.filter(
+        date__range=(timezone.localdate(starts_at), timezone.localdate(ends_at)),
+        hold__expires_at__gt=timezone.now(),
+        hold__starts_at__lt=ends_at,
+        hold__ends_at__gt=starts_at,
+    )
+
+
+def slot_start(reservation_time):
+    """その時刻を含む15分枠の開始時刻（19:07 → 19:00）"""
+    return reservation_time.replace(
+        minute=reservation_time.minute - reservation_time.minute % SLOT_MINUTES, second=0, microsecond=0,
+    )
+
+
+def free_table_exists(reservation_date, reservation_time, party_size):
+    """
+    「人数が座れて、その時間に空いているテーブル（またはくっつけられる空きテーブル）がある」店舗を表す条件（Q）。
+    Restaurant のクエリセットにそのまま使えるので、候補の店舗がいくつあっても検索のクエリは1回で済む。
+    終了時刻は店舗の利用時間（seating_minutes）で変わるので、利用時間ごとに
+    「seating_minutes = n かつ EXISTS(...)」を作って OR でつなぐ（利用時間の種類を調べるクエリが1回増える）。
+    EXISTS の中の比較は定数になるので (table, starts_at, ends_at) のインデックスがそのまま使える。
+    使い方: Restaurant.objects.filter(free_table_exists(date, time, 4))
+    時刻は15分枠の開始にそろえる（予約は15分単位なので、枠で判定する DaySchedule と同じ結果にする）。
+    """
+    reservation_time = slot_start(reservation_time)
+    starts_at = timezone.make_aware(
+        datetime.combine(reservation_date, reservation_time), timezone.get_default_timezone(),
+    )
+    durations = (Restaurant.objects.order_by('seating_minutes')
+                 .values_list('seating_minutes', flat=True).distinct())
+    condition = Q(pk__in=[])
+    for minutes in durations:
+        ends_at = starts_at + timedelta(minutes=minutes)
+        busy = overlapping_reservations(starts_at, ends_at)
+        held = held_claims(starts_at, ends_at)
+        free = (Table.objects
+                .filter(restaurant=OuterRef('pk'))
+                .exclude(Exists(busy.filter(table=OuterRef('pk'))))
+                .exclude(Exists(busy.filter(joined_tables=OuterRef('pk'))))
+                .exclude(Exists(held.filter(table=OuterRef('pk')))))
+        # 1卓で座れるか、同じ結合グループの空きテーブルをくっつければ座れるか
+        single = free.filter(capacity__gte=party_size)
+        joined = (free.exclude(join_group='').order_by().values('join_group')
+                  .annotate(total=Sum('capacity')).filter(total__gte=party_size))
+        condition |= Q(seating_minutes=minutes) & (Exists(single) | Exists(joined))
+    # 座れる席がそもそもない店舗は EXISTS の前に落とす（Restaurant の列だけで判定できる）
+    return Q(max_party_size__gte=party_size) & condition
+
+
+def check_reservation_time(restaurant, reservation_time):
+    """
+    予約・仮押さえを受け付ける時刻か（15分単位で営業時間内）。だめなら ValidationError
+    （ReservationForm と take_hold の両方から呼ぶ）
+    """
+    # 席は15分枠ごとに確保するので、予約時刻も15分単位にする
+    if reservation_time.minute % SLOT_MINUTES or reservation_time.second or reservation_time.microsecond:
+        raise ValidationError(f'予約時刻は{SLOT_MINUTES}分単位で指定してください。')
+    if reservation_time < restaurant.open_time:
+        raise ValidationError(f'営業時間外です。営業開始時刻は{restaurant.open_time.strftime("%H:%M")}です。')
+    if reservation_time > restaurant.close_time:
+        raise ValidationError(f'営業時間外です。営業終了時刻は{restaurant.close_time.strftime("%H:%M")}です。')
+
+
+def parse_search_params(params):
+    """
+    一覧の空席検索 ?date=2025-12-24&time=19:00&party_size=4 を
+    (日付, 時刻, 人数) にする。日付と時刻がそろっていなければ None。
+    """
+    try:
+        reservation_date = datetime.strptime(params.get('date', ''), '%Y-%m-%d').date()
+        reservation_time = datetime.strptime(params.get('time', ''), '%H:%M').time()
+    except ValueError:
+        return None
+    try:
+        party_size = int(params.get('party_size') or 1)
+    except ValueError:
+        party_size = 1
+    party_size = min(max(party_size, 1), 20)
+    return reservation_date, reservation_time, party_size
+
+
+def slot_times(restaurant):
+    """予約を受け付ける時刻（開店〜閉店、15分刻み）"""
+    times = []
+    day = datetime(2000, 1, 1)
+    current = datetime.combine(day, restaurant.open_time)
+    # 15分単位に切り上げ
+    overflow = (current.minute % SLOT_MINUTES) * 60 + current.second
+    if overflow:
+        current += timedelta(seconds=SLOT_SECONDS - overflow)
+    close = datetime.combine(day, restaurant.close_time)
+    while current <= close:
+        times.append(current.time())
+        current += timedelta(minutes=SLOT_MINUTES)
+    return times
+
+
+def seating_slots(starts_at, ends_at):
+    """
+    [starts_at, ends_at) が使う15分枠 {日付: [枠番号, ...]}（途中から始まる・終わる枠も含める）。
+    日をまたぐ予約は翌日の枠にも入る。
+    """
+    tz = timezone.get_default_timezone()
+    start = timezone.localtime(starts_at, tz).replace(tzinfo=None)
+    end = timezone.localtime(ends_at, tz).replace(tzinfo=None)
+    current = start.replace(minute=start.minute - start.minute % SLOT_MINUTES, second=0, microsecond=0)
+    slots = {}
+    while current < end:
+        slots.setdefault(current.date(), []).append((current.hour * 60 + current.minute) // SLOT_MINUTES)
+        current += timedelta(minutes=SLOT_MINUTES)
+    return slots
+
+
+class DaySchedule:
+    """
+    1店舗・1日分のテーブルの空き状況。
+    1卓で座れないときは、同じ結合グループのテーブルをくっつける組み合わせも探す（find_combination）。
+    DaySchedule.load(restaurant, date) でテーブルと埋まり具合をそれぞれ1クエリで取ってくる。
+    1テーブルの判定は日ごとの整数の AND（日をまたがなければ1回）。
+    """
+
+    def __init__(self, restaurant, reservation_date, tables, occupied):
+        """
+        tables: 定員の小さい順の Table のリスト
+        occupied: {(テーブルID, 日付): 埋まっている枠のビット列（整数）}（occupancy.load の結果）
+        """
+        self.restaurant = restaurant
+        self.reservation_date = reservation_date
+        self.tables = list(tables)
+        self.occupied = occupied
+        self._masks = {}
+
+    @classmethod
+    def load(cls, restaurant, reservation_date, exclude_reservation=None, exclude_hold=None):
+        """
+        exclude_reservation: 編集中の予約（自分が確保している枠は空いていることにする）
+        exclude_hold: 自分の仮押さえ（同上）
+        """
+        return cls.load_days(restaurant, reservation_date, 1, exclude_reservation, exclude_hold)[0]
+
+    @classmethod
+    def load_days(cls, restaurant, start_date, days, exclude_reservation=None, exclude_hold=None):
+        """
+        start_date から days 日分の DaySchedule のリスト（テーブルと埋まり具合はまとめて1クエリずつ）。
+        期限が切れた仮押さえの枠は、まだ消されていなくても空いていることにする（+1クエリ）。
+        """
+        tables = list(Table.objects.filter(restaurant=restaurant).order_by('capacity', 'pk'))
+        last_date = cls.last_date(restaurant, start_date + timedelta(days=days - 1))
+        occupied = occupancy.load(tables, start_date, last_date)
+        released = Q(hold__expires_at__lte=timezone.now())
+        if exclude_reservation is not None and exclude_reservation.pk:
+            released |= Q(reservation=exclude_reservation)
+        if exclude_hold is not None:
+            released |= Q(hold=exclude_hold)
+        own = SlotClaim.objects.filter(released, table__in=tables, date__range=(start_date, last_date))
+        for table_id, date, slot in own.values_list('table_id', 'date', 'slot'):
+            key = (table_id, date)
+            occupied[key] = occupied.get(key, 0) & ~(1 << slot)
+        return [
+            cls(restaurant, start_date + timedelta(days=offset), tables, occupied)
+            for offset in range(days)
+        ]
+
+    @staticmethod
+    def last_date(restaurant, reservation_date):
+        """その日の予約が使う可能性のある最後の日（一番遅い 23:45 開始の予約の終わり）"""
+        latest = datetime.combine(reservation_date, datetime.max.time()) + restaurant.seating_duration
+        return latest.date()
+
+    def masks(self, reservation_time):
+        """[(日付, その日の枠のマスク), ...]（時刻ごとに1回だけ作る）"""
+        if reservation_time not in self._masks:
+            period = self.restaurant.seating_period(self.reservation_date, reservation_time)
+            self._masks[reservation_time] = [
+                (date, occupancy.slot_mask(slots)) for date, slots in seating_slots(*period).items()
+            ]
+        return self._masks[reservation_time]
+
+    def is_table_free(self, table, reservation_time):
+        occupied = self.occupied
+        return not any(occupied.get((table.pk, date), 0) & mask for date, mask in self.masks(reservation_time))
+
+    def free_tables(self, reservation_time, party_size):
+        """人数が座れて空いているテーブル（定員の小さい順）"""
+        return [
+            table for table in self.tables
+            if table.capacity >= party_size and self.is_table_free(table, reservation_time)
+        ]
+
+    def find_table(self, reservation_time, party_size):
+        """Best Fit: 空いているテーブルのうち定員が一番小さいもの。なければ None"""
+        for table in self.tables:
+            if table.capacity >= party_size and self.is_table_free(table, reservation_time):
+                return table
+        return None
+
+    def find_combination(self, reservation_time, party_size):
+        """同じ結合グループの空いているテーブルの組み合わせ（combination.py）。なければ None"""
+        free = [
+            table for table in self.tables
+            if table.join_group and self.is_table_free(table, reservation_time)
+        ]
+        return best_combination(free, party_size)
+
+    def seating_options(self, reservation_time, party_size):
+        """
+        割り当てられる席の候補（それぞれテーブルのリスト）を試す順に並べたもの。
+        1卓で座れるならその Best Fit 順、座れないときだけくっつけたテーブルの組み合わせ。
+        """
+        options = [[table] for table in self.free_tables(reservation_time, party_size)]
+        if not options:
+            combination = self.find_combination(reservation_time, party_size)
+            if combination:
+                options.append(combination)
+        return options
+
+    def can_seat(self, reservation_time, party_size):
+        return (self.find_table(reservation_time, party_size) is not None
+                or self.find_combination(reservation_time, party_size) is not None)
+
+
+def nearest_free_times(schedules, reservation_time, party_size, limit=ALTERNATIVE_LIMIT):
+    """
+    満席だったときの代わりの候補。schedules（DaySchedule.load_days の結果、先頭が希望の日）から
+    party_size 名で座れる開始時刻を [(日付, 時刻), ...] で limit 件まで返す。
+    希望の日を先に、そのあとは翌日以降を日付順に、それぞれ希望の時刻に近い順で探す。
+    営業時間内の15分枠だけで、今日の過ぎた時刻と希望の日時そのものは除く。
+    読み込み済みの埋まり具合を見るだけなのでクエリは増えない。
+    """
+    now = timezone.localtime()
+    wanted = reservation_time.hour * 60 + reservation_time.minute
+    found = []
+    for schedule in schedules:
+        day = schedule.reservation_date
+        if day < now.date():
+            continue
+        times = sorted(
+            slot_times(schedule.restaurant),
+            key=lambda t: (abs(t.hour * 60 + t.minute - wanted), t),
+        )
+        for t in times:
+            if (day == now.date() and t <= now.time()) or (schedule is schedules[0] and t == reservation_time):
+                continue
+            if schedule.can_seat(t, party_size):
+                found.append((day, t))
+                if len(found) >= limit:
+                    return found
+    return found
+
+
+def find_available_table(restaurant, reservation_date, reservation_time, party_size, exclude_reservation=None):
+    """指定した日時・人数で割り当てられるテーブル（Best Fit）。なければ None"""
+    schedule = DaySchedule.load(restaurant, reservation_date, exclude_reservation)
+    return schedule.find_table(reservation_time, party_size)
@@ -0,0 +1,74 @@
+"""
+店舗ごとの空席カレンダー（/reservations/api/availability/<restaurant_pk>/ 用）
+
+N日分のテーブルと埋まり具合（occupancy.py）をそれぞれ1クエリでまとめて取り、日ごとに DaySchedule を作って
+営業時間内の15分枠ごとに「人数が座れる空席があるか」を調べる。
+結果は店舗ごとのバージョン付きでキャッシュし、予約・テーブル・店舗・仮押さえが変わったら
+signals.py から bump_version を呼んで古いキャッシュを使わないようにする。
+バージョンは DB（restaurants.index_versions）に持つ（LocMemCache だと追い出しで戻ったり、ほかのプロセスに届かない）。
+仮押さえは消されなくても期限が切れたら空くので、期限内の仮押さえがあるうちは一番早く切れるまでしかキャッシュしない。
+"""
+import math
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from restaurants import index_versions
+from .availability import DaySchedule, slot_times
+from .models import SlotHold
+
+
+CACHE_TIMEOUT = 300
+
+DEFAULT_DAYS = 14
+MAX_DAYS = 60
+
+
+def _version_name(restaurant_id):
+    return f'availability:{restaurant_id}'
+
+
+def get_version(restaurant_id):
+    return index_versions.get(_version_name(restaurant_id))
+
+
+def bump_version(restaurant_id):
+    """その店舗の空席カレンダーのキャッシュをすべて無効にする"""
+    index_versions.bump(_version_name(restaurant_id))
+
+
+def _cache_timeout(restaurant):
+    """期限内の仮押さえがあれば、一番早く切れるまでの秒数（CACHE_TIMEOUT まで）"""
+    now = timezone.now()
+    expires_at = (SlotHold.objects.filter(restaurant=restaurant, expires_at__gt=now)
+                  .order_by('expires_at').values_list('expires_at', flat=True).first())
+    if expires_at is None:
+        return CACHE_TIMEOUT
+    return min(CACHE_TIMEOUT, max(1, math.ceil((expires_at - now).total_seconds())))
+
+
+def build_calendar(restaurant, start_date, days, party_size):
+    """[(日付, [(時刻, 空席があるか), ...]), ...]"""
+    times = slot_times(restaurant)
+    if party_size > restaurant.max_party_size:
+        # 座れる席がない人数はクエリなしで全部 ×
+        return [
+            (start_date + timedelta(days=offset), [(t, False) for t in times])
+            for offset in range(days)
+        ]
+    return [
+        (schedule.reservation_date, [(t, schedule.can_seat(t, party_size)) for t in times])
+        for schedule in DaySchedule.load_days(restaurant, start_date, days)
+    ]
+
+
+def get_calendar(restaurant, start_date, days, party_size):
+    """build_calendar の結果をキャッシュから返す"""
+    key = (f'availability:{restaurant.pk}:{get_version(restaurant.pk)}:'
+           f'{start_date.isoformat()}:{days}:{party_size}')
+    calendar = cache.get(key)
+    if calendar is None:
+        calendar = build_calendar(restaurant, start_date, days, party_size)
+        cache.set(key, calendar, _cache_timeout(restaurant))
+    return calendar
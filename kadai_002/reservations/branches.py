@@ -0,0 +1,63 @@
+"""
+系列店（同じ会社の別の店舗）の空席
+
+予約したい店舗が満席のときの代わりに、同じ Company の店舗のうち
+その日時・人数で座れる席がある店舗を、近い候補から順に返す。
+空席の判定は free_table_exists（店舗検索と同じ EXISTS）を店舗のクエリにつけるだけなので、
+系列店がいくつあってもクエリの数は変わらない（利用時間の種類を調べる1回 + 店舗1回）。
+"""
+from datetime import datetime
+
+from django.utils import timezone
+
+from restaurants.geo import haversine_km
+from restaurants.models import Restaurant
+from .availability import free_table_exists
+
+
+BRANCH_LIMIT = 5
+
+
+def _distance_km(restaurant, branch):
+    if None in (restaurant.latitude, restaurant.longitude, branch.latitude, branch.longitude):
+        return None
+    return round(haversine_km(restaurant.latitude, restaurant.longitude, branch.latitude, branch.longitude), 1)
+
+
+def free_branches(restaurant, reservation_date, reservation_time, party_size,
+                  category=None, city=None, limit=BRANCH_LIMIT):
+    """
+    restaurant と同じ会社の店舗で、営業時間内かつ party_size 名で座れる席がある店舗のリスト。
+    category / city を渡すとその店舗だけにする。
+    並び順: 同じカテゴリ → 同じ市区町村 → 距離が近い（緯度経度がなければ後ろ）→ 評価が高い
+    各店舗に distance_km（km、わからなければ None）をつけて返す。
+    """
+    starts_at = timezone.make_aware(
+        datetime.combine(reservation_date, reservation_time), timezone.get_default_timezone(),
+    )
+    if starts_at <= timezone.now():
+        return []
+
+    qs = (Restaurant.objects
+          .filter(company_id=restaurant.company_id,
+                  open_time__lte=reservation_time, close_time__gte=reservation_time)
+          .exclude(pk=restaurant.pk)
+          .filter(free_table_exists(reservation_date, reservation_time, party_size))
+          .select_related('category'))
+    if category:
+        qs = qs.filter(category=category)
+    if city:
+        qs = qs.filter(city=city)
+
+    branches = list(qs)
+    for branch in branches:
+        branch.distance_km = _distance_km(restaurant, branch)
+    branches.sort(key=lambda branch: (
+        branch.category_id != restaurant.category_id,
+        branch.city != restaurant.city,
+        branch.distance_km is None,
+        branch.distance_km or 0,
+        -branch.rating_avg,
+        branch.pk,
+    ))
+    return branches[:limit]
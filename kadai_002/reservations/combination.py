@@ -0,0 +1,62 @@
+"""
+テーブルの組み合わせ（大人数の予約用）
+
+1卓では座れない人数のときに、同じ結合グループ（Table.join_group）の空いているテーブルを
+くっつけて使う。組み合わせは「余る席が一番少ない → テーブルの数が一番少ない」ものを選ぶ。
+
+グループごとに「定員の合計 → その合計になる一番少ないテーブルの組み合わせ」を
+0/1 ナップサックの DP で作る。余りが最小の組み合わせの合計は 人数 + 最大の定員 - 1 を超えない
+（超えていたらどれか1卓外しても座れる）ので、計算量は テーブル数 × (人数 + 最大の定員) で頭打ちになる。
+30卓・20名でも数百〜千回程度のループで済む（benchmark_table_combination コマンドで確認）。
+"""
+
+
+def _group_tables(tables):
+    groups = {}
+    for table in tables:
+        if table.join_group:
+            groups.setdefault(table.join_group, []).append(table)
+    return groups
+
+
+def _best_in_group(tables, party_size):
+    """1グループ内で余りが最小（同じなら卓数が最小）の組み合わせ。座れなければ None"""
+    limit = party_size + max(table.capacity for table in tables) - 1
+    # picked[合計] = その合計になる一番少ないテーブル（添字のタプル）。作れない合計は None
+    picked = [None] * (limit + 1)
+    picked[0] = ()
+    for i, table in enumerate(tables):
+        capacity = table.capacity
+        # 同じテーブルを2回使わないように大きい合計から更新する
+        for total in range(limit - capacity, -1, -1):
+            base = picked[total]
+            if base is None:
+                continue
+            current = picked[total + capacity]
+            if current is None or len(base) + 1 < len(current):
+                picked[total + capacity] = base + (i,)
+    for total in range(party_size, limit + 1):
+        if picked[total] is not None:
+            return [tables[i] for i in picked[total]]
+    return None
+
+
+def best_combination(tables, party_size):
+    """
+    空いているテーブル（結合グループなしは無視）から、party_size 人が座れる組み合わせを返す。
+    余りが最小 → 卓数が最小 → グループ名順で1つに決める。見つからなければ None
+    """
+    found = None
+    for name, group in sorted(_group_tables(tables).items()):
+        if sum(table.capacity for table in group) < party_size:
+            continue
+        combination = _best_in_group(group, party_size)
+        if combination is None:
+            continue
+        key = (sum(table.capacity for table in combination), len(combination))
+        if found is None or key < found[0]:
+            found = (key, combination)
+    if found is None:
+        return None
+    # 一番大きいテーブルを先頭に（Reservation.table にはこれを入れる）
+    return sorted(found[1], key=lambda table: (-table.capacity, table.pk))
@@ -1,18 +1,31 @@
 from django import forms
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from datetime import datetime, timedelta
+from django.db.models import Q
 from .models import Reservation
-from restaurants.models import Table
+from .availability import ALTERNATIVE_DAYS, SLOT_MINUTES, DaySchedule, check_reservation_time, nearest_free_times
+from .branches import free_branches
+from .holds import get_active_hold
 
 
 class ReservationForm(forms.ModelForm):
     """予約フォーム"""
+
+    # 空席カレンダーで時間を選んだときに取った仮押さえ（holds.py）の ID
+    hold = forms.IntegerField(required=False, widget=forms.HiddenInput)
     
-    def __init__(self, *args, restaurant=None, **kwargs):
+    def __init__(self, *args, restaurant=None, user=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.restaurant = restaurant
+        self.user = user
+        self.active_hold = None  # 使える仮押さえ（保存時にこの枠を予約に付け替える）
         self.assigned_table = None  # 割り当てられた席を保存
+        self.candidate_tables = []  # 空いている席の候補（1卓ずつ、またはくっつけるテーブルのリスト）。保存時にこの順で確保を試す
+        self.alternative_times = []  # 満席だったときに代わりに空いている (日付, 時刻)
+        self.alternative_branches = []  # 満席だったときに同じ日時で空いている系列店（新規予約のときだけ）
+        self.schedules = []  # 希望の日から ALTERNATIVE_DAYS 日分の DaySchedule
+        if restaurant and restaurant.max_party_size:
+            self.fields['party_size'].widget.attrs['max'] = min(restaurant.max_party_size, 20)
     
     class Meta:
         model = Reservation
@@ -24,7 +37,8 @@ class ReservationForm(forms.ModelForm):
             }),
             'reservation_time': forms.TimeInput(attrs={
                 'type': 'time',
-                'class': 'form-control'
+                'class': 'form-control',
+                'step': SLOT_MINUTES * 60,
             }),
             'party_size': forms.NumberInput(attrs={
                 'class': 'form-control',
@@ -47,68 +61,24 @@ class ReservationForm(forms.ModelForm):
     def _find_available_table(self, party_size, reservation_date, reservation_time):
         """
         指定された人数と日時に対して空いているテーブルを検索します。
-        2時間制を考慮し、Best Fit（最小の定員で条件を満たす席）を返します。
+        店舗の利用時間（seating_minutes）を考慮し、Best Fit（最小の定員で条件を満たす席）を返します。
+        1卓で座れないときは、くっつけたテーブルの組み合わせの先頭（一番大きい席）を返します。
+        （判定は availability.DaySchedule。テーブルと予約をそれぞれ1クエリで取得）
         """
         if not self.restaurant:
             return None
-        
-        # 2時間後の終了時刻を計算
-        start_datetime = datetime.combine(reservation_date, reservation_time)
-        end_datetime = start_datetime + timedelta(hours=2)
-        end_time = end_datetime.time()
-        
-        # 日をまたぐ場合の処理
-        if end_datetime.date() > reservation_date:
-            # 日をまたぐ場合は23:59:59まで
-            from datetime import time as datetime_time
-            end_time = datetime_time(23, 59, 59)
-        
-        # この店舗の全テーブルを取得（人数制約を満たすもののみ）
-        available_tables = Table.objects.filter(
-            restaurant=self.restaurant,
-            capacity__gte=party_size  # 定員が予約人数以上
-        ).order_by('capacity')  # Best Fit のため定員の小さい順
-        
-        # 各テーブルについて空き状況をチェック
-        for table in available_tables:
-            # このテーブルの予約をチェック（編集中の予約は除外）
-            overlapping_reservations = Reservation.objects.filter(
-                table=table,
-                reservation_date=reservation_date,
-                status__in=['pending', 'confirmed']  # キャンセル・完了済みは除外
-            )
-            
-            # 編集中の予約は除外
-            if self.instance and self.instance.pk:
-                overlapping_reservations = overlapping_reservations.exclude(pk=self.instance.pk)
-            
-            # 時間の重複をチェック
-            is_available = True
-            for existing_reservation in overlapping_reservations:
-                existing_start = existing_reservation.reservation_time
-                existing_end_datetime = datetime.combine(
-                    reservation_date, 
-                    existing_start
-                ) + timedelta(hours=2)
-                existing_end = existing_end_datetime.time()
-                
-                # 日をまたぐ場合の処理
-                if existing_end_datetime.date() > reservation_date:
-                    from datetime import time as datetime_time
-                    existing_end = datetime_time(23, 59, 59)
-                
-                # 時間の重複チェック
-                # 新規予約: [reservation_time, end_time]
-                # 既存予約: [existing_start, existing_end]
-                # 重複 = NOT (新規の終了 <= 既存の開始 OR 既存の終了 <= 新規の開始)
-                if not (end_time <= existing_start or existing_end <= reservation_time):
-                    is_available = False
-                    break
-            
-            if is_available:
-                return table  # Best Fit: 最初に見つかった（最小定員の）席を返す
-        
-        return None  # 空き席なし
+        # 同じ日時・人数の仮押さえがあれば、その枠は自分のものとして空いていることにする
+        hold = get_active_hold(self.user, self.restaurant, self.cleaned_data.get('hold'))
+        if hold and (hold.reservation_date, hold.reservation_time, hold.party_size) == (
+                reservation_date, reservation_time, party_size):
+            self.active_hold = hold
+        # 満席だったときの代わりの時間もここで読み込んだ分から探す（翌日以降の分もまとめて1回で取る）
+        self.schedules = DaySchedule.load_days(
+            self.restaurant, reservation_date, ALTERNATIVE_DAYS,
+            exclude_reservation=self.instance, exclude_hold=self.active_hold,
+        )
+        self.candidate_tables = self.schedules[0].seating_options(reservation_time, party_size)
+        return self.candidate_tables[0][0] if self.candidate_tables else None
     
     def clean(self):
         cleaned_data = super().clean()
@@ -130,19 +100,19 @@ class ReservationForm(forms.ModelForm):
         if reservation_date == today and reservation_time <= current_time:
             raise ValidationError('現在時刻より前の時間は予約できません。')
         
-        # 2. 営業時間チェック
+        # 2. 15分単位・営業時間チェック（仮押さえと同じ）
         if self.restaurant:
-            if reservation_time < self.restaurant.open_time:
-                raise ValidationError(
-                    f'営業時間外です。営業開始時刻は{self.restaurant.open_time.strftime("%H:%M")}です。'
-                )
-            
-            if reservation_time > self.restaurant.close_time:
+            check_reservation_time(self.restaurant, reservation_time)
+
+            # 3. 人数チェック（席の集計だけで判定できるので、テーブルや予約は見に行かない）
+            if party_size and party_size > self.restaurant.max_party_size:
+                if not self.restaurant.max_party_size:
+                    raise ValidationError('申し訳ございません。この店舗はWeb予約を受け付けていません。')
                 raise ValidationError(
-                    f'営業時間外です。営業終了時刻は{self.restaurant.close_time.strftime("%H:%M")}です。'
+                    f'申し訳ございません。この店舗でご予約いただけるのは{self.restaurant.max_party_size}名様までです。'
                 )
-            
-            # 3. 空き席検索（2時間制を考慮）
+
+            # 4. 空き席検索（店舗の利用時間を考慮）
             if party_size:
                 available_table = self._find_available_table(
                     party_size, 
@@ -151,6 +121,19 @@ class ReservationForm(forms.ModelForm):
                 )
                 
                 if not available_table:
+                    self.alternative_times = nearest_free_times(self.schedules, reservation_time, party_size)
+                    if not self.instance.pk:
+                        self.alternative_branches = free_branches(
+                            self.restaurant, reservation_date, reservation_time, party_size,
+                        )
+                    if self.alternative_times:
+                        times = '、'.join(
+                            f'{day.month}/{day.day} {t.strftime("%H:%M")}' for day, t in self.alternative_times
+                        )
+                        raise ValidationError(
+                            f'申し訳ございません。{party_size}名様でご利用いただける空席が見つかりませんでした。'
+                            f'近い時間では {times} が空いています。'
+                        )
                     raise ValidationError(
                         f'申し訳ございません。{party_size}名様でご利用いただける空席が見つかりませんでした。'
                         f'別の日時をお選びいただくか、お問い合わせください。'
@@ -160,3 +143,43 @@ class ReservationForm(forms.ModelForm):
                 self.assigned_table = available_table
         
         return cleaned_data
+
+
+class OwnerReservationFilterForm(forms.Form):
+    """オーナーの予約一覧の絞り込み（GET）。restaurants には自社の店舗だけを渡す"""
+
+    restaurant = forms.ModelChoiceField(
+        queryset=None, required=False, empty_label='全ての店舗',
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    status = forms.ChoiceField(
+        choices=[('', '全てのステータス')] + Reservation.STATUS_CHOICES, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    customer = forms.CharField(
+        required=False, max_length=100,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': '予約者の名前・メールアドレス'}),
+    )
+
+    def __init__(self, *args, restaurants=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['restaurant'].queryset = restaurants
+
+    def filter(self, queryset):
+        """正しく入力された条件だけで絞り込む（おかしい値の条件は無視する）"""
+        self.is_valid()
+        data = getattr(self, 'cleaned_data', {})
+        if data.get('restaurant'):
+            queryset = queryset.filter(restaurant=data['restaurant'])
+        if data.get('date_from'):
+            queryset = queryset.filter(reservation_date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(reservation_date__lte=data['date_to'])
+        if data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        customer = (data.get('customer') or '').strip()
+        if customer:
+            queryset = queryset.filter(Q(user__name__icontains=customer) | Q(user__email__icontains=customer))
+        return queryset
@@ -0,0 +1,82 @@
+"""
+仮押さえ（SlotHold）
+
+予約フォームで時間を選んだ時点で、そのテーブルの枠を HOLD_MINUTES 分だけ SlotClaim で確保しておく。
+同じ枠を選んだ人どうしの取り合いはここ（時間を選んだとき）で決まり、
+予約を保存するときは仮押さえの枠を付け替えるだけなので、空席の探し直しで失敗しにくくなる。
+
+期限が切れた仮押さえは
+- 空席の判定（DaySchedule.load_days）では最初から空いているものとして扱い、
+- 仮押さえ・予約の保存のときにその店舗の分をまとめて消し（sweep_expired）、
+- 残った分は sweep_slot_holds コマンドで定期的に消す。
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import allocation
+from .availability import DaySchedule, check_reservation_time
+from .models import SlotHold
+
+
+HOLD_MINUTES = 5
+
+
+def sweep_expired(restaurant=None, batch_size=500):
+    """期限切れの仮押さえを消す（枠は signals の pre_delete で空く）。消した件数を返す"""
+    holds = SlotHold.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at', 'pk')
+    if restaurant is not None:
+        holds = holds.filter(restaurant=restaurant)
+    count = 0
+    while True:
+        batch = list(holds[:batch_size])
+        if not batch:
+            return count
+        with transaction.atomic():
+            for hold in batch:
+                hold.delete()
+        count += len(batch)
+
+
+def release_user_holds(user, restaurant):
+    """そのユーザーがその店舗で持っている仮押さえを手放す（時間を選び直したとき）"""
+    for hold in SlotHold.objects.filter(user=user, restaurant=restaurant):
+        hold.delete()
+
+
+def take_hold(user, restaurant, reservation_date, reservation_time, party_size, exclude_reservation=None):
+    """
+    その日時・人数で座れる席（Best Fit 順、なければくっつけたテーブル）を仮押さえする。
+    ほかの人に先に取られていれば次の候補を試し、全部だめなら None
+    15分単位・営業時間内でない時刻は ValidationError（予約フォームと同じチェック）。
+    exclude_reservation: 編集中の予約（その予約が使っている枠は空いていることにする）
+    """
+    check_reservation_time(restaurant, reservation_time)
+    if party_size > restaurant.max_party_size:
+        return None
+    with transaction.atomic():
+        sweep_expired(restaurant)
+        release_user_holds(user, restaurant)
+        schedule = DaySchedule.load(restaurant, reservation_date, exclude_reservation)
+        starts_at, ends_at = restaurant.seating_period(reservation_date, reservation_time)
+        expires_at = timezone.now() + timedelta(minutes=HOLD_MINUTES)
+        for tables in schedule.seating_options(reservation_time, party_size):
+            hold = SlotHold.objects.create(
+                user=user, restaurant=restaurant, table=tables[0],
+                reservation_date=reservation_date, reservation_time=reservation_time, party_size=party_size,
+                starts_at=starts_at, ends_at=ends_at, expires_at=expires_at,
+            )
+            if allocation.claim_tables(tables, starts_at, ends_at, exclude_reservation=exclude_reservation, hold=hold):
+                return hold
+            hold.delete()
+    return None
+
+
+def get_active_hold(user, restaurant, pk):
+    """フォームから送られてきた仮押さえ（自分の・その店舗の・期限内のもの）。なければ None"""
+    if not pk or not getattr(user, 'is_authenticated', False):
+        return None
+    return SlotHold.objects.filter(
+        pk=pk, user=user, restaurant=restaurant, expires_at__gt=timezone.now(),
+    ).first()
@@ -0,0 +1,44 @@
+"""
+予約のステータスの自動更新
+
+利用時間（ends_at）が過ぎても pending / confirmed のままの予約を completed にする。
+有効な予約（ACTIVE_STATUSES。DB では Reservation.is_active）だけの部分インデックスを使っているので、
+過去の予約を有効なままにしておかなければ、空席の判定が見るインデックスにはこれからの予約だけが残る。
+
+1件ずつ save() すると件数分のクエリになるので、batch_size 件ずつまとめて UPDATE する（シグナルは飛ばない）。
+そのぶん save() のときにシグナルでやっていることはここで同じようにやる:
+- 確保していた枠（SlotClaim）を手放す（sync_claims と同じ）
+- ダッシュボードの集計・空席カレンダーのキャッシュ: 利用済みにしても変わらないので何もしない
+  （集計は pending / confirmed / completed を同じに数える。カレンダーは今日以降しか出さない）
+complete_past_reservations コマンドを cron などで定期的に実行する。
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .allocation import release_claims
+from .availability import ACTIVE_STATUSES
+from .models import Reservation, SlotClaim
+
+
+BATCH_SIZE = 1000
+
+
+def past_reservations(now=None):
+    """利用時間が終わっているのに有効なままの予約（reservation_active_ends_idx を使う）"""
+    return Reservation.objects.filter(is_active=True, ends_at__lte=now or timezone.now())
+
+
+def complete_past(now=None, batch_size=BATCH_SIZE):
+    """利用時間が終わった予約を completed にする。更新した件数を返す"""
+    now = now or timezone.now()
+    count = 0
+    while True:
+        with transaction.atomic():
+            ids = list(past_reservations(now).order_by('ends_at').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return count
+            # 取ってから UPDATE までの間にキャンセルされたものは除く
+            count += Reservation.objects.filter(pk__in=ids, status__in=ACTIVE_STATUSES).update(
+                status='completed', updated_at=now,
+            )
+            release_claims(SlotClaim.objects.filter(reservation_id__in=ids))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reservations import archive
+
+
+class Command(BaseCommand):
+    help = '古い予約（利用済み・キャンセル）を過去の予約のテーブルに移します（cron などで1日1回実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help=f'予約日から何日たったものを移すか（デフォルト: settings.RESERVATION_ARCHIVE_DAYS = {settings.RESERVATION_ARCHIVE_DAYS}）',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=archive.BATCH_SIZE,
+            help=f'1回のトランザクションで移す件数（デフォルト: {archive.BATCH_SIZE}）',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='移さずに、対象の件数だけ表示する',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archive.archivable(options['days']).count()
+            self.stdout.write(
+                self.style.WARNING(f'移す予約: {count}件（dry-run のため未実行）')
+            )
+            return
+
+        count = archive.archive(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {count}件の予約を過去の予約に移しました。')
+        )
@@ -0,0 +1,62 @@
+import random
+import time as time_module
+from datetime import date, time
+
+from django.core.management.base import BaseCommand
+
+from reservations import occupancy
+from reservations.availability import DaySchedule
+from restaurants.models import Restaurant, Table
+
+
+class Command(BaseCommand):
+    help = 'テーブルの組み合わせ探索（1卓で座れないときの割り当て）の処理時間を測ります（DB は使いません）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=30, help='1店舗のテーブル数（デフォルト: 30）')
+        parser.add_argument('--groups', type=int, default=1, help='結合グループの数（デフォルト: 1 = 全部くっつけられる）')
+        parser.add_argument('--trials', type=int, default=50, help='埋まり具合を変えて試す回数（デフォルト: 50）')
+        parser.add_argument('--max-party', type=int, default=20, help='試す最大人数（デフォルト: 20）')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        restaurant = Restaurant(seating_minutes=120, open_time=time(11), close_time=time(22))
+        tables = sorted(
+            (
+                Table(pk=i + 1, capacity=rng.choice([2, 2, 4, 4, 6, 8]), join_group=f'G{i % options["groups"]}')
+                for i in range(options['tables'])
+            ),
+            key=lambda table: (table.capacity, table.pk),
+        )
+        day = date(2000, 1, 3)
+        times = [time(hour, minute) for hour in range(11, 22) for minute in (0, 15, 30, 45)]
+
+        # 1回目だけかかる準備（タイムゾーンの読み込みなど）を測らないように1回呼んでおく
+        DaySchedule(restaurant, day, tables, {}).seating_options(times[0], 2)
+
+        elapsed = []
+        for trial in range(options['trials']):
+            # 1回目は全部空き（組み合わせの候補が一番多い）、あとはランダムに埋める
+            occupied = {}
+            if trial:
+                for table in tables:
+                    bits = 0
+                    for _ in range(rng.randint(0, 4)):
+                        start = rng.randrange(44, 88)
+                        bits |= occupancy.slot_mask(range(start, start + 8))
+                    occupied[(table.pk, day)] = bits
+            schedule = DaySchedule(restaurant, day, tables, occupied)
+            for reservation_time in times:
+                for party_size in range(1, options['max_party'] + 1):
+                    started = time_module.perf_counter()
+                    schedule.seating_options(reservation_time, party_size)
+                    elapsed.append((time_module.perf_counter() - started) * 1000)
+
+        elapsed.sort()
+        self.stdout.write(
+            f'{options["tables"]}卓 / {options["groups"]}グループ / {len(elapsed)}回: '
+            f'平均 {sum(elapsed) / len(elapsed):.3f}ms, '
+            f'p99 {elapsed[int(len(elapsed) * 0.99) - 1]:.3f}ms, '
+            f'最大 {elapsed[-1]:.3f}ms'
+        )
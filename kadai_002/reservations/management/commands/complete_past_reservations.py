@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from reservations import lifecycle
+
+
+class Command(BaseCommand):
+    help = '利用時間が過ぎた予約（予約確認中・予約確定）を利用済みにします（cron などで1時間おきなどに実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=lifecycle.BATCH_SIZE,
+            help=f'1回の UPDATE で更新する件数（デフォルト: {lifecycle.BATCH_SIZE}）',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='更新はせず、対象の件数だけ表示する',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = lifecycle.past_reservations().count()
+            self.stdout.write(
+                self.style.WARNING(f'利用済みにする予約: {count}件（dry-run のため未更新）')
+            )
+            return
+
+        count = lifecycle.complete_past(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {count}件の予約を利用済みにしました。')
+        )
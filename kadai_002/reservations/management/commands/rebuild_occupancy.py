@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from reservations import occupancy
+
+
+class Command(BaseCommand):
+    help = 'テーブルごと・日ごとの埋まり具合（ビット列）を席の確保データ（SlotClaim）から作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='1回に読み書きする件数（デフォルト: 1000）',
+        )
+
+    def handle(self, *args, **options):
+        count = occupancy.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {count}件（テーブル×日）の埋まり具合を作り直しました。')
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from reservations import rollup
+
+
+class Command(BaseCommand):
+    help = 'オーナーのダッシュボード用の予約の集計（店舗・日付・時間ごと）を予約から作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--restaurant',
+            type=int,
+            action='append',
+            help='作り直す店舗の ID（複数指定可。省略すると全店舗）',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=rollup.BATCH_SIZE,
+            help=f'1回に読む予約の件数（デフォルト: {rollup.BATCH_SIZE}）',
+        )
+
+    def handle(self, *args, **options):
+        written = rollup.rebuild(restaurant_ids=options['restaurant'], batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: 集計を{written}行作り直しました。')
+        )
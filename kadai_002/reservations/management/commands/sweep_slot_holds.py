@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from reservations import holds
+
+
+class Command(BaseCommand):
+    help = '期限が切れた仮押さえを消して、押さえていた枠を空けます（cron などで数分おきに実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='1回のトランザクションで消す件数（デフォルト: 500）',
+        )
+
+    def handle(self, *args, **options):
+        count = holds.sweep_expired(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: 期限切れの仮押さえを{count}件消しました。')
+        )
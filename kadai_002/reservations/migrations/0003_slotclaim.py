@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:47
+
+import django.db.models.deletion
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+
+
+ACTIVE_STATUSES = ['pending', 'confirmed']
+
+
+def seating_slots(reservation_date, reservation_time):
+    # この時点では予約は2時間（日をまたぐ分は 23:59:59 まで）
+    start = datetime.combine(reservation_date, reservation_time)
+    end = min(start + timedelta(hours=2), datetime.combine(reservation_date, datetime.max.time()))
+    first = (start.hour * 3600 + start.minute * 60 + start.second) // 900
+    last = -(-(end.hour * 3600 + end.minute * 60 + end.second) // 900)
+    return range(first, last)
+
+
+def fill_slot_claims(apps, schema_editor):
+    # 既存の有効な予約の枠を確保しておく（すでに重なっている予約があれば先に入った方だけ）
+    Reservation = apps.get_model('reservations', 'Reservation')
+    SlotClaim = apps.get_model('reservations', 'SlotClaim')
+    claims = []
+    reservations = (Reservation.objects
+                    .filter(status__in=ACTIVE_STATUSES, table__isnull=False)
+                    .order_by('created_at', 'pk'))
+    for reservation in reservations:
+        for slot in seating_slots(reservation.reservation_date, reservation.reservation_time):
+            claims.append(SlotClaim(
+                reservation_id=reservation.pk, table_id=reservation.table_id,
+                date=reservation.reservation_date, slot=slot,
+            ))
+    SlotClaim.objects.bulk_create(claims, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0002_reservation_table'),
+        ('restaurants', '0009_search_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('slot', models.PositiveSmallIntegerField(help_text='0時からの15分枠の番号（0〜95）', verbose_name='枠')),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='reservations.reservation', verbose_name='予約')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='restaurants.table', verbose_name='テーブル')),
+            ],
+            options={
+                'verbose_name': '席の確保',
+                'verbose_name_plural': '席の確保',
+                'constraints': [models.UniqueConstraint(fields=('table', 'date', 'slot'), name='unique_table_date_slot')],
+            },
+        ),
+        migrations.RunPython(fill_slot_claims, migrations.RunPython.noop),
+    ]
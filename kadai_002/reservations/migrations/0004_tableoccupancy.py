@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_occupancy(apps, schema_editor):
+    # 既存の SlotClaim からテーブル・日ごとのビット列を作る
+    SlotClaim = apps.get_model('reservations', 'SlotClaim')
+    TableOccupancy = apps.get_model('reservations', 'TableOccupancy')
+    occupancy = {}
+    for table_id, date, slot in SlotClaim.objects.values_list('table_id', 'date', 'slot'):
+        occupancy[(table_id, date)] = occupancy.get((table_id, date), 0) | (1 << slot)
+    TableOccupancy.objects.bulk_create(
+        [
+            TableOccupancy(table_id=table_id, date=date, bits=value.to_bytes(12, 'big'))
+            for (table_id, date), value in occupancy.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0003_slotclaim'),
+        ('restaurants', '0009_search_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('bits', models.BinaryField(help_text='枠 n が埋まっていれば n ビット目が 1', max_length=12, verbose_name='埋まっている枠')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancies', to='restaurants.table', verbose_name='テーブル')),
+            ],
+            options={
+                'verbose_name': '席の埋まり具合',
+                'verbose_name_plural': '席の埋まり具合',
+                'constraints': [models.UniqueConstraint(fields=('table', 'date'), name='unique_table_occupancy')],
+            },
+        ),
+        migrations.RunPython(fill_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:10
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# 以下はこのマイグレーションを書いた時点の availability.py のコピー
+# （あとでステータスや枠の長さを変えても、このマイグレーションの結果は変わらないように）
+ACTIVE_STATUSES = ['pending', 'confirmed']
+SLOT_MINUTES = 15
+
+
+def seating_slots(starts_at, ends_at):
+    """[starts_at, ends_at) が使う15分枠 {日付: [枠番号, ...]}（日をまたぐ予約は翌日の枠にも入る）"""
+    tz = timezone.get_default_timezone()
+    start = timezone.localtime(starts_at, tz).replace(tzinfo=None)
+    end = timezone.localtime(ends_at, tz).replace(tzinfo=None)
+    current = start.replace(minute=start.minute - start.minute % SLOT_MINUTES, second=0, microsecond=0)
+    slots = {}
+    while current < end:
+        slots.setdefault(current.date(), []).append((current.hour * 60 + current.minute) // SLOT_MINUTES)
+        current += timedelta(minutes=SLOT_MINUTES)
+    return slots
+
+
+def fill_periods(apps, schema_editor):
+    Reservation = apps.get_model('reservations', 'Reservation')
+    SlotClaim = apps.get_model('reservations', 'SlotClaim')
+    TableOccupancy = apps.get_model('reservations', 'TableOccupancy')
+    tz = timezone.get_default_timezone()
+
+    reservations = list(Reservation.objects.select_related('restaurant').order_by('created_at', 'pk'))
+    for reservation in reservations:
+        starts_at = timezone.make_aware(
+            datetime.combine(reservation.reservation_date, reservation.reservation_time), tz,
+        )
+        reservation.starts_at = starts_at
+        reservation.ends_at = starts_at + timedelta(minutes=reservation.restaurant.seating_minutes)
+    Reservation.objects.bulk_update(reservations, ['starts_at', 'ends_at'], batch_size=1000)
+
+    # これまで 23:59:59 で切っていた日をまたぐ予約の翌日分も含めて、確保している枠を作り直す
+    # （すでに重なっている予約があれば先に入った方だけ）
+    claims = [
+        SlotClaim(reservation_id=reservation.pk, table_id=reservation.table_id, date=date, slot=slot)
+        for reservation in reservations
+        if reservation.status in ACTIVE_STATUSES and reservation.table_id
+        for date, slots in seating_slots(reservation.starts_at, reservation.ends_at).items()
+        for slot in slots
+    ]
+    SlotClaim.objects.all().delete()
+    SlotClaim.objects.bulk_create(claims, batch_size=1000, ignore_conflicts=True)
+
+    occupancy = {}
+    for table_id, date, slot in SlotClaim.objects.values_list('table_id', 'date', 'slot'):
+        occupancy[(table_id, date)] = occupancy.get((table_id, date), 0) | (1 << slot)
+    TableOccupancy.objects.all().delete()
+    TableOccupancy.objects.bulk_create(
+        [
+            TableOccupancy(table_id=table_id, date=date, bits=value.to_bytes(12, 'big'))
+            for (table_id, date), value in occupancy.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0004_tableoccupancy'),
+        ('restaurants', '0010_restaurant_seating_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='starts_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='利用開始'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='ends_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='利用終了'),
+        ),
+        migrations.RunPython(fill_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='starts_at',
+            field=models.DateTimeField(editable=False, verbose_name='利用開始'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='ends_at',
+            field=models.DateTimeField(editable=False, verbose_name='利用終了'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['table', 'starts_at', 'ends_at'], name='reservation_table_period_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_reservation_period'),
+        ('restaurants', '0011_table_join_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='joined_tables',
+            field=models.ManyToManyField(blank=True, help_text='大人数の予約で table とくっつけて使う座席', related_name='joined_reservations', to='restaurants.table', verbose_name='結合したテーブル'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_reservation_joined_tables'),
+        ('restaurants', '0011_table_join_group'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='slotclaim',
+            name='reservation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='reservations.reservation', verbose_name='予約'),
+        ),
+        migrations.CreateModel(
+            name='SlotHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reservation_date', models.DateField(verbose_name='予約日')),
+                ('reservation_time', models.TimeField(verbose_name='予約時刻')),
+                ('party_size', models.PositiveIntegerField(verbose_name='人数')),
+                ('starts_at', models.DateTimeField(verbose_name='利用開始')),
+                ('ends_at', models.DateTimeField(verbose_name='利用終了')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='期限')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_holds', to='restaurants.restaurant', verbose_name='店舗')),
+                ('table', models.ForeignKey(help_text='くっつけて使うときは一番大きい席（ほかの席は SlotClaim にある）', on_delete=django.db.models.deletion.CASCADE, related_name='slot_holds', to='restaurants.table', verbose_name='テーブル')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_holds', to=settings.AUTH_USER_MODEL, verbose_name='ユーザー')),
+            ],
+            options={
+                'verbose_name': '仮押さえ',
+                'verbose_name_plural': '仮押さえ',
+            },
+        ),
+        migrations.AddField(
+            model_name='slotclaim',
+            name='hold',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='reservations.slothold', verbose_name='仮押さえ'),
+        ),
+        migrations.AddConstraint(
+            model_name='slotclaim',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('hold__isnull', True), ('reservation__isnull', False)), models.Q(('hold__isnull', False), ('reservation__isnull', True)), _connector='OR'), name='slot_claim_reservation_or_hold'),
+        ),
+    ]
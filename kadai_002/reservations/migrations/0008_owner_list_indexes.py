@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_slothold'),
+        ('restaurants', '0012_restaurant_capacity_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['restaurant', 'reservation_date', 'reservation_time'], name='reservation_rest_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['restaurant', 'status', 'reservation_date'], name='reservation_rest_status_idx'),
+        ),
+    ]
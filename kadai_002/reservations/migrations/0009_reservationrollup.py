@@ -0,0 +1,87 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:13
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# 以下はこのマイグレーションを書いた時点の rollup.py の集計のコピー
+# （あとで rollup.py を変えても、このマイグレーションの結果は変わらないように。1回しか動かないので NumPy は使わない）
+FIELDS = ['reservation_count', 'cancelled_count', 'no_show_count', 'covers', 'seat_minutes']
+SOURCE_FIELDS = ['restaurant_id', 'reservation_date', 'reservation_time', 'party_size', 'status', 'starts_at', 'ends_at']
+
+
+def aggregate(rows):
+    """{(店舗ID, 日付, 時間): FIELDS の値のリスト}（利用時間が日付をまたぐ分は翌日の 0 時台からに入れる）"""
+    totals = {}
+
+    def add(restaurant_id, day, hour, index, value):
+        key = (restaurant_id, day + timedelta(days=hour // 24), hour % 24)
+        totals.setdefault(key, [0] * len(FIELDS))[index] += value
+
+    for restaurant_id, day, start_time, party_size, status, starts_at, ends_at in rows:
+        start = start_time.hour * 60 + start_time.minute
+        end = start + int((ends_at - starts_at).total_seconds()) // 60
+        cancelled = status == 'cancelled'
+        no_show = status == 'no_show'
+        served = 0 if cancelled or no_show else party_size
+        hour = start // 60
+        add(restaurant_id, day, hour, 0, 1)
+        add(restaurant_id, day, hour, 1, int(cancelled))
+        add(restaurant_id, day, hour, 2, int(no_show))
+        add(restaurant_id, day, hour, 3, served)
+        for hour in range(start // 60, min((end + 59) // 60, 48)):
+            overlap = min(end, hour * 60 + 60) - max(start, hour * 60)
+            add(restaurant_id, day, hour, 4, max(overlap, 0) * served)
+    return {key: values for key, values in totals.items() if any(values)}
+
+
+def fill_rollups(apps, schema_editor):
+    """今ある予約から集計を作る（店舗ごと）"""
+    Reservation = apps.get_model('reservations', 'Reservation')
+    ReservationRollup = apps.get_model('reservations', 'ReservationRollup')
+    restaurant_ids = Reservation.objects.order_by('restaurant_id').values_list('restaurant_id', flat=True).distinct()
+    for restaurant_id in list(restaurant_ids):
+        rows = list(Reservation.objects.filter(restaurant_id=restaurant_id).values_list(*SOURCE_FIELDS))
+        ReservationRollup.objects.bulk_create([
+            ReservationRollup(restaurant_id=restaurant_id, date=day, hour=hour,
+                              **{field: value for field, value in zip(FIELDS, values)})
+            for (restaurant_id, day, hour), values in aggregate(rows).items()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0008_owner_list_indexes'),
+        ('restaurants', '0012_restaurant_capacity_summary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('pending', '予約確認中'), ('confirmed', '予約確定'), ('cancelled', 'キャンセル'), ('completed', '利用済み'), ('no_show', '無断キャンセル')], default='pending', max_length=20, verbose_name='ステータス'),
+        ),
+        migrations.CreateModel(
+            name='ReservationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='時')),
+                ('reservation_count', models.IntegerField(default=0, verbose_name='予約数')),
+                ('cancelled_count', models.IntegerField(default=0, verbose_name='キャンセル数')),
+                ('no_show_count', models.IntegerField(default=0, verbose_name='無断キャンセル数')),
+                ('covers', models.IntegerField(default=0, help_text='キャンセル・無断キャンセルを除いた人数', verbose_name='来店人数')),
+                ('seat_minutes', models.IntegerField(default=0, verbose_name='利用人数×分')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_rollups', to='restaurants.restaurant', verbose_name='店舗')),
+            ],
+            options={
+                'verbose_name': '予約の集計',
+                'verbose_name_plural': '予約の集計',
+                'constraints': [models.UniqueConstraint(fields=('restaurant', 'date', 'hour'), name='unique_reservation_rollup')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_reservationrollup'),
+        ('restaurants', '0012_restaurant_capacity_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reservation',
+            name='reservation_table_period_idx',
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='is_active',
+            field=models.GeneratedField(db_persist=False, expression=models.Q(('status__in', ['pending', 'confirmed'])), output_field=models.BooleanField(), verbose_name='有効'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['table', 'starts_at', 'ends_at'], name='reservation_active_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['ends_at'], name='reservation_active_ends_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0010_active_partial_indexes'),
+        ('restaurants', '0012_restaurant_capacity_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='予約ID')),
+                ('reservation_date', models.DateField(verbose_name='予約日')),
+                ('reservation_time', models.TimeField(verbose_name='予約時刻')),
+                ('starts_at', models.DateTimeField(verbose_name='利用開始')),
+                ('ends_at', models.DateTimeField(verbose_name='利用終了')),
+                ('party_size', models.PositiveIntegerField(verbose_name='人数')),
+                ('status', models.CharField(choices=[('pending', '予約確認中'), ('confirmed', '予約確定'), ('cancelled', 'キャンセル'), ('completed', '利用済み'), ('no_show', '無断キャンセル')], max_length=20, verbose_name='ステータス')),
+                ('notes', models.TextField(blank=True, verbose_name='備考')),
+                ('created_at', models.DateTimeField(verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(verbose_name='更新日時')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='移動日時')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to='restaurants.restaurant', verbose_name='店舗')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to=settings.AUTH_USER_MODEL, verbose_name='予約者')),
+            ],
+            options={
+                'verbose_name': '過去の予約',
+                'verbose_name_plural': '過去の予約',
+                'ordering': ['-reservation_date', '-reservation_time'],
+                'indexes': [models.Index(fields=['user', 'reservation_date', 'reservation_time'], name='archived_user_date_idx')],
+            },
+        ),
+    ]
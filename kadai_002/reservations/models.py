@@ -11,6 +11,7 @@ class Reservation(models.Model):
         ('confirmed', '予約確定'),
         ('cancelled', 'キャンセル'),
         ('completed', '利用済み'),
+        ('no_show', '無断キャンセル'),
     ]
     
     user = models.ForeignKey(
@@ -34,10 +35,22 @@ class Reservation(models.Model):
         blank=True,
         help_text='割り当てられた座席'
     )
+    joined_tables = models.ManyToManyField(
+        Table,
+        related_name='joined_reservations',
+        verbose_name='結合したテーブル',
+        blank=True,
+        help_text='大人数の予約で table とくっつけて使う座席'
+    )
     
     # 予約日時
     reservation_date = models.DateField(verbose_name='予約日')
     reservation_time = models.TimeField(verbose_name='予約時刻')
+
+    # 席を使う時間帯 [starts_at, ends_at)。保存時に予約日時と店舗の利用時間から入れる
+    # 重なる予約の判定は starts_at < 相手の終了 かつ ends_at > 相手の開始 を SQL で行う
+    starts_at = models.DateTimeField(verbose_name='利用開始', editable=False)
+    ends_at = models.DateTimeField(verbose_name='利用終了', editable=False)
     
     # 人数
     party_size = models.PositiveIntegerField(verbose_name='人数')
@@ -50,6 +63,16 @@ class Reservation(models.Model):
         verbose_name='ステータス'
     )
     
+    # ステータスが pending / confirmed なら真（DB が計算する列）。
+    # SQLite は「status IN (?, ?)」のようにパラメーターの入った条件では部分インデックスを使わないので、
+    # 有効な予約だけの部分インデックスはこの列を条件にして、検索も is_active=True で絞る
+    is_active = models.GeneratedField(
+        expression=models.Q(status__in=['pending', 'confirmed']),
+        output_field=models.BooleanField(),
+        db_persist=False,
+        verbose_name='有効',
+    )
+    
     # 備考
     notes = models.TextField(blank=True, verbose_name='備考')
     
@@ -61,6 +84,225 @@ class Reservation(models.Model):
         ordering = ['-reservation_date', '-reservation_time']
         verbose_name = '予約'
         verbose_name_plural = '予約'
+        indexes = [
+            # テーブルごとの重なり判定（availability.overlapping_reservations）用。
+            # 有効な予約だけの部分インデックスなので、過去の予約を利用済みにしていけば（lifecycle.py）これからの予約だけになる
+            models.Index(
+                fields=['table', 'starts_at', 'ends_at'], name='reservation_active_period_idx',
+                condition=models.Q(is_active=True),
+            ),
+            # 利用時間が過ぎた有効な予約を探す（lifecycle.complete_past）用
+            models.Index(
+                fields=['ends_at'], name='reservation_active_ends_idx',
+                condition=models.Q(is_active=True),
+            ),
+            # オーナーの予約一覧（店舗・日付で絞って日時順にカーソルでページ送り）用
+            models.Index(fields=['restaurant', 'reservation_date', 'reservation_time'], name='reservation_rest_date_idx'),
+            models.Index(fields=['restaurant', 'status', 'reservation_date'], name='reservation_rest_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.name} - {self.restaurant.name} ({self.reservation_date} {self.reservation_time})"
+
+    def save(self, *args, **kwargs):
+        # 予約日時が変わったときだけ入れ直す（ステータスの変更などでは、あとから店舗の利用時間が
+        # 変わっていても確保済みの枠とずれないようにそのままにする）
+        starts_at, ends_at = self.restaurant.seating_period(self.reservation_date, self.reservation_time)
+        if starts_at != self.starts_at or self.ends_at is None:
+            self.starts_at, self.ends_at = starts_at, ends_at
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'reservation_date', 'reservation_time'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'starts_at', 'ends_at'}
+        super().save(*args, **kwargs)
+
+
+class ArchivedReservation(models.Model):
+    """
+    古い予約の保管場所（利用済み・キャンセルで RESERVATION_ARCHIVE_DAYS 日より前のもの）
+    Reservation から archive.py で移す。予約の ID はそのまま使う。
+    空席の判定や店舗の予約一覧は見ないので、Reservation を小さいままにしておける。
+    ユーザーの予約一覧では Reservation と合わせて表示する。
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='予約ID')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_reservations',
+        verbose_name='予約者'
+    )
+    restaurant = models.ForeignKey(
+        Restaurant,
+        on_delete=models.CASCADE,
+        related_name='archived_reservations',
+        verbose_name='店舗'
+    )
+    reservation_date = models.DateField(verbose_name='予約日')
+    reservation_time = models.TimeField(verbose_name='予約時刻')
+    starts_at = models.DateTimeField(verbose_name='利用開始')
+    ends_at = models.DateTimeField(verbose_name='利用終了')
+    party_size = models.PositiveIntegerField(verbose_name='人数')
+    status = models.CharField(max_length=20, choices=Reservation.STATUS_CHOICES, verbose_name='ステータス')
+    notes = models.TextField(blank=True, verbose_name='備考')
+    created_at = models.DateTimeField(verbose_name='作成日時')
+    updated_at = models.DateTimeField(verbose_name='更新日時')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='移動日時')
+
+    class Meta:
+        ordering = ['-reservation_date', '-reservation_time']
+        verbose_name = '過去の予約'
+        verbose_name_plural = '過去の予約'
+        indexes = [
+            # ユーザーの予約一覧（新しい順）用
+            models.Index(fields=['user', 'reservation_date', 'reservation_time'], name='archived_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.restaurant.name} ({self.reservation_date} {self.reservation_time})"
+
+
+class SlotHold(models.Model):
+    """
+    仮押さえ（予約フォームで時間を選んだときに、そのテーブルの枠を HOLD_MINUTES 分だけ確保しておく）
+    予約と同じく SlotClaim で枠を取るので、ほかの人の予約・仮押さえとはぶつからない。
+    予約を保存するときに枠ごと予約に付け替える。期限が切れたものは holds.py で片付ける。
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='slot_holds',
+        verbose_name='ユーザー'
+    )
+    restaurant = models.ForeignKey(
+        Restaurant,
+        on_delete=models.CASCADE,
+        related_name='slot_holds',
+        verbose_name='店舗'
+    )
+    table = models.ForeignKey(
+        Table,
+        on_delete=models.CASCADE,
+        related_name='slot_holds',
+        verbose_name='テーブル',
+        help_text='くっつけて使うときは一番大きい席（ほかの席は SlotClaim にある）'
+    )
+    reservation_date = models.DateField(verbose_name='予約日')
+    reservation_time = models.TimeField(verbose_name='予約時刻')
+    party_size = models.PositiveIntegerField(verbose_name='人数')
+    starts_at = models.DateTimeField(verbose_name='利用開始')
+    ends_at = models.DateTimeField(verbose_name='利用終了')
+    expires_at = models.DateTimeField(verbose_name='期限', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
+
+    class Meta:
+        verbose_name = '仮押さえ'
+        verbose_name_plural = '仮押さえ'
+
+    def __str__(self):
+        return f"{self.restaurant.name} {self.reservation_date} {self.reservation_time} (〜{self.expires_at})"
+
+
+class SlotClaim(models.Model):
+    """
+    テーブルの15分枠の確保（二重予約防止用）
+    予約（または仮押さえ）がテーブルを使う15分枠ごとに1行入れる。(テーブル, 日付, 枠) がユニークなので、
+    同じ枠を同時に確保しようとしても後から入れた方が IntegrityError になる（allocation.py）。
+    """
+    reservation = models.ForeignKey(
+        Reservation,
+        on_delete=models.CASCADE,
+        related_name='slot_claims',
+        verbose_name='予約',
+        null=True,
+        blank=True
+    )
+    hold = models.ForeignKey(
+        SlotHold,
+        on_delete=models.CASCADE,
+        related_name='slot_claims',
+        verbose_name='仮押さえ',
+        null=True,
+        blank=True
+    )
+    table = models.ForeignKey(
+        Table,
+        on_delete=models.CASCADE,
+        related_name='slot_claims',
+        verbose_name='テーブル'
+    )
+    date = models.DateField(verbose_name='日付')
+    slot = models.PositiveSmallIntegerField(verbose_name='枠', help_text='0時からの15分枠の番号（0〜95）')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'date', 'slot'], name='unique_table_date_slot'),
+            # 予約か仮押さえのどちらか一方
+            models.CheckConstraint(
+                condition=(models.Q(reservation__isnull=False, hold__isnull=True)
+                           | models.Q(reservation__isnull=True, hold__isnull=False)),
+                name='slot_claim_reservation_or_hold',
+            ),
+        ]
+        verbose_name = '席の確保'
+        verbose_name_plural = '席の確保'
+
+    def __str__(self):
+        return f"{self.table} {self.date} 枠{self.slot}"
+
+
+class TableOccupancy(models.Model):
+    """
+    テーブル1つ・1日分の埋まり具合（15分枠 96個を 12バイトのビット列で持つ）
+    SlotClaim から作る読み取り用のデータで、空席の判定はこれのビット演算だけで行う（occupancy.py）。
+    """
+    table = models.ForeignKey(
+        Table,
+        on_delete=models.CASCADE,
+        related_name='occupancies',
+        verbose_name='テーブル'
+    )
+    date = models.DateField(verbose_name='日付')
+    bits = models.BinaryField(max_length=12, verbose_name='埋まっている枠', help_text='枠 n が埋まっていれば n ビット目が 1')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table', 'date'], name='unique_table_occupancy'),
+        ]
+        verbose_name = '席の埋まり具合'
+        verbose_name_plural = '席の埋まり具合'
+
+    def __str__(self):
+        return f"{self.table} {self.date}"
+
+
+class ReservationRollup(models.Model):
+    """
+    店舗・日付・時間（0〜23時）ごとの予約の集計（オーナーのダッシュボード用）
+    Reservation の保存・削除のたびに rollup.py で差分を足し引きする。
+    ダッシュボードはこれだけを読み、予約のテーブルは見に行かない。
+    ずれた場合は rebuild_reservation_rollups コマンドで作り直す。
+    """
+    restaurant = models.ForeignKey(
+        Restaurant,
+        on_delete=models.CASCADE,
+        related_name='reservation_rollups',
+        verbose_name='店舗'
+    )
+    date = models.DateField(verbose_name='日付')
+    hour = models.PositiveSmallIntegerField(verbose_name='時')
+    # 予約時刻がこの時間の予約（件数はステータスに関係なく全部）
+    reservation_count = models.IntegerField(default=0, verbose_name='予約数')
+    cancelled_count = models.IntegerField(default=0, verbose_name='キャンセル数')
+    no_show_count = models.IntegerField(default=0, verbose_name='無断キャンセル数')
+    covers = models.IntegerField(default=0, verbose_name='来店人数', help_text='キャンセル・無断キャンセルを除いた人数')
+    # この1時間に席が使われていた「人数 × 分」（2名で30分なら 60）。利用時間が次の時間・翌日にかかる分はそちらに入る
+    seat_minutes = models.IntegerField(default=0, verbose_name='利用人数×分')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'date', 'hour'], name='unique_reservation_rollup'),
+        ]
+        verbose_name = '予約の集計'
+        verbose_name_plural = '予約の集計'
+
+    def __str__(self):
+        return f"{self.restaurant} {self.date} {self.hour}時"
@@ -0,0 +1,82 @@
+"""
+テーブルごと・日ごとの埋まり具合のビット列（TableOccupancy）
+
+1日を15分枠 96個に分け、枠 n が埋まっていれば n ビット目を立てた整数を
+12バイトにして保存する。予約が使う枠のマスクとの AND が 0 なら空いている。
+SlotClaim（二重予約防止用の1枠1行のデータ）を確保・解放するのと同じトランザクションで更新し、
+ずれたときは rebuild_occupancy コマンドで SlotClaim から作り直す。
+"""
+from django.db import transaction
+
+from .models import SlotClaim, TableOccupancy
+
+
+# 予約時刻の単位（席の確保・埋まり具合もこの枠ごと）
+SLOT_MINUTES = 15
+SLOT_SECONDS = SLOT_MINUTES * 60
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BYTES_PER_DAY = SLOTS_PER_DAY // 8
+
+
+def to_int(bits):
+    return int.from_bytes(bytes(bits or b''), 'big')
+
+
+def to_bytes(value):
+    return value.to_bytes(BYTES_PER_DAY, 'big')
+
+
+def slot_mask(slots):
+    mask = 0
+    for slot in slots:
+        mask |= 1 << slot
+    return mask
+
+
+def _update(table_id, date, mask, occupied):
+    # 同じテーブル・同じ日の行だけロックする（違うテーブルの予約は待たない）
+    with transaction.atomic():
+        row, _ = (TableOccupancy.objects.select_for_update()
+                  .get_or_create(table_id=table_id, date=date, defaults={'bits': to_bytes(0)}))
+        value = to_int(row.bits)
+        value = value | mask if occupied else value & ~mask
+        row.bits = to_bytes(value)
+        row.save(update_fields=['bits'])
+
+
+def mark(table_id, date, slots):
+    """枠を埋まっていることにする"""
+    _update(table_id, date, slot_mask(slots), True)
+
+
+def unmark(table_id, date, slots):
+    """枠を空ける"""
+    _update(table_id, date, slot_mask(slots), False)
+
+
+def load(tables, date_from, date_to=None):
+    """{(テーブルID, 日付): ビット列の整数}（行がない = 全部空き）"""
+    rows = TableOccupancy.objects.filter(
+        table__in=tables, date__range=(date_from, date_to or date_from),
+    ).values_list('table_id', 'date', 'bits')
+    return {(table_id, date): to_int(bits) for table_id, date, bits in rows}
+
+
+def rebuild(batch_size=1000):
+    """SlotClaim からすべて作り直す。作った行数を返す"""
+    occupancy = {}
+    claims = SlotClaim.objects.order_by().values_list('table_id', 'date', 'slot').iterator(chunk_size=batch_size)
+    for table_id, date, slot in claims:
+        key = (table_id, date)
+        occupancy[key] = occupancy.get(key, 0) | (1 << slot)
+
+    with transaction.atomic():
+        TableOccupancy.objects.all().delete()
+        TableOccupancy.objects.bulk_create(
+            [
+                TableOccupancy(table_id=table_id, date=date, bits=to_bytes(value))
+                for (table_id, date), value in occupancy.items()
+            ],
+            batch_size=batch_size,
+        )
+    return len(occupancy)
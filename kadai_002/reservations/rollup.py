@@ -0,0 +1,230 @@
+"""
+予約の集計（ReservationRollup: 店舗・日付・時間ごと）の更新と、オーナーのダッシュボードの計算
+
+- 予約の保存・削除: signals.py から apply を呼び、変わる前の分を引いて変わった後の分を足す
+  （ステータスが pending → confirmed のように集計に関係ない変更なら何も書かない）
+- 作り直し: rebuild_reservation_rollups コマンドから rebuild を呼ぶ（アーカイブに移した予約も数える）
+- ダッシュボード: dashboard は ReservationRollup だけを読む
+
+どれも予約の行をまとめて NumPy の配列にしてから計算する（1件ずつ Python でループしない）。
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ArchivedReservation, Reservation, ReservationRollup
+
+
+FIELDS = ['reservation_count', 'cancelled_count', 'no_show_count', 'covers', 'seat_minutes']
+# aggregate に渡す予約の値
+SOURCE_FIELDS = ['restaurant_id', 'reservation_date', 'reservation_time', 'party_size', 'status', 'starts_at', 'ends_at']
+HOURS = 24
+BATCH_SIZE = 5000
+
+WEEKDAY_LABELS = ['月', '火', '水', '木', '金', '土', '日']
+
+
+def aggregate(rows, signs=None):
+    """
+    rows: SOURCE_FIELDS の値のタプルのリスト、signs: 行ごとに +1 / -1（省略すると全部 +1）
+    {(店舗ID, 日付): 24時間 × FIELDS の int 配列} を返す（全部 0 の日は入れない）。
+    利用時間が日付をまたぐ分は翌日の 0 時台からに入れる。
+    """
+    n = len(rows)
+    if not n:
+        return {}
+    restaurant = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+    day = np.fromiter((row[1].toordinal() for row in rows), dtype=np.int64, count=n)
+    start = np.fromiter((row[2].hour * 60 + row[2].minute for row in rows), dtype=np.int64, count=n)
+    party = np.fromiter((row[3] for row in rows), dtype=np.int64, count=n)
+    status = np.array([row[4] for row in rows])
+    minutes = np.fromiter((int((row[6] - row[5]).total_seconds()) // 60 for row in rows), dtype=np.int64, count=n)
+    sign = np.ones(n, dtype=np.int64) if signs is None else np.asarray(signs, dtype=np.int64)
+
+    cancelled = status == 'cancelled'
+    no_show = status == 'no_show'
+    served = party * ~(cancelled | no_show) * sign
+
+    # 予約日と翌日の 48 時間分を作る
+    values = np.zeros((n, 2 * HOURS, len(FIELDS)), dtype=np.int64)
+    index = np.arange(n)
+    start_hour = start // 60
+    values[index, start_hour, 0] = sign
+    values[index, start_hour, 1] = cancelled * sign
+    values[index, start_hour, 2] = no_show * sign
+    values[index, start_hour, 3] = served
+    edges = np.arange(2 * HOURS) * 60
+    overlap = np.minimum((start + minutes)[:, None], edges + 60) - np.maximum(start[:, None], edges)
+    values[:, :, 4] = np.clip(overlap, 0, 60) * served[:, None]
+
+    keys = np.concatenate([np.stack([restaurant, day], axis=1), np.stack([restaurant, day + 1], axis=1)])
+    parts = np.concatenate([values[:, :HOURS], values[:, HOURS:]])
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    totals = np.zeros((len(unique_keys), HOURS, len(FIELDS)), dtype=np.int64)
+    np.add.at(totals, inverse.ravel(), parts)
+
+    keep = totals.any(axis=(1, 2))
+    return {
+        (int(restaurant_id), date.fromordinal(int(ordinal))): table
+        for (restaurant_id, ordinal), table in zip(unique_keys[keep], totals[keep])
+    }
+
+
+def source_values(reservation):
+    return tuple(getattr(reservation, field) for field in SOURCE_FIELDS)
+
+
+def snapshot(reservation_id):
+    """保存前の DB の値（pre_save で取っておく）"""
+    return Reservation.objects.filter(pk=reservation_id).order_by().values_list(*SOURCE_FIELDS).first()
+
+
+def _add(restaurant_id, day, hour, vector):
+    delta = {field: int(value) for field, value in zip(FIELDS, vector)}
+    rollups = ReservationRollup.objects.filter(restaurant_id=restaurant_id, date=day, hour=hour)
+    if rollups.update(**{field: F(field) + value for field, value in delta.items()}):
+        return
+    if not any(value > 0 for value in delta.values()):
+        # 引くだけなのに行がない（店舗ごと消していて、集計の行が先に CASCADE で消えた）ときは作らない
+        return
+    try:
+        with transaction.atomic():
+            ReservationRollup.objects.create(restaurant_id=restaurant_id, date=day, hour=hour, **delta)
+    except IntegrityError:
+        # 同時に同じ時間の行を作られた
+        rollups.update(**{field: F(field) + value for field, value in delta.items()})
+
+
+def apply(before=None, after=None):
+    """1件の予約の変更を集計に反映する（before / after は SOURCE_FIELDS の値、新規なら before=None、削除なら after=None）"""
+    rows, signs = [], []
+    if before:
+        rows.append(before)
+        signs.append(-1)
+    if after:
+        rows.append(after)
+        signs.append(1)
+    for (restaurant_id, day), table in aggregate(rows, signs).items():
+        for hour in np.flatnonzero(table.any(axis=1)):
+            _add(restaurant_id, day, int(hour), table[hour])
+
+
+def _rollup_objects(totals):
+    return [
+        ReservationRollup(restaurant_id=restaurant_id, date=day, hour=int(hour),
+                          **{field: int(value) for field, value in zip(FIELDS, table[hour])})
+        for (restaurant_id, day), table in totals.items()
+        for hour in np.flatnonzero(table.any(axis=1))
+    ]
+
+
+def rebuild(restaurant_ids=None, batch_size=BATCH_SIZE):
+    """
+    予約（アーカイブに移したものも含む）から集計を作り直す（restaurant_ids を渡すとその店舗だけ）。作った行数を返す。
+    店舗ごとに1トランザクションで、予約を id の順に batch_size 件ずつ読んで足していく
+    （1店舗分の集計は1日あたり 24時間 × 5項目なので、何年分でもメモリに載る）。
+    """
+    sources = [Reservation.objects.all(), ArchivedReservation.objects.all()]
+    if restaurant_ids is None:
+        restaurant_ids = sorted({
+            restaurant_id
+            for source in sources
+            for restaurant_id in source.order_by().values_list('restaurant_id', flat=True).distinct()
+        })
+        ReservationRollup.objects.exclude(restaurant_id__in=restaurant_ids).delete()
+    written = 0
+    for restaurant_id in restaurant_ids:
+        with transaction.atomic():
+            ReservationRollup.objects.filter(restaurant_id=restaurant_id).delete()
+            totals = {}
+            for source in sources:
+                rows = source.filter(restaurant_id=restaurant_id).order_by('id')
+                last_id = 0
+                while True:
+                    batch = list(rows.filter(id__gt=last_id).values_list('id', *SOURCE_FIELDS)[:batch_size])
+                    if not batch:
+                        break
+                    last_id = batch[-1][0]
+                    for key, table in aggregate([row[1:] for row in batch]).items():
+                        totals[key] = totals[key] + table if key in totals else table
+            objects = _rollup_objects(totals)
+            ReservationRollup.objects.bulk_create(objects, batch_size=1000)
+            written += len(objects)
+    return written
+
+
+def business_hours(restaurant):
+    """ダッシュボードに出す時間（日付をまたいで営業する店は 18〜23時, 0〜2時 のように開店から順に）"""
+    open_hour, close_hour = restaurant.open_time.hour, restaurant.close_time.hour
+    if restaurant.close_time < restaurant.open_time:
+        return list(range(open_hour, HOURS)) + list(range(0, close_hour + 1))
+    return list(range(open_hour, max(close_hour, open_hour) + 1))
+
+
+def dashboard(restaurants, start, end):
+    """
+    restaurants の start〜end（両端を含む）の集計を店舗ごとに返す。
+    日付をまたいで営業する店の開店前の時間（0時台など）は前の日の営業に入れる
+    （金曜の夜から続く土曜 1時台は金曜の行に出し、end の翌日の分も読む）。
+    - heatmap: 曜日 × 時間（営業時間の分）の席の埋まり具合（使われた人数×分 / 席数×60分 の平均、0〜1）
+    - cancel_rate / no_show_rate: 予約のうちキャンセル・無断キャンセルの割合
+    - covers / covers_per_day: 来店人数の合計と1日あたり
+    """
+    restaurants = list(restaurants)
+    if not restaurants:
+        return []
+    position = {restaurant.pk: i for i, restaurant in enumerate(restaurants)}
+    rows = list(
+        ReservationRollup.objects
+        .filter(restaurant_id__in=position, date__range=(start, end + timedelta(days=1)))
+        .values_list('restaurant_id', 'date', 'hour', *FIELDS)
+    )
+    # 店舗ごとの「この時間より前は前の日の営業」（日付をまたがない店は 0）
+    carry_hours = np.array([
+        restaurant.open_time.hour if restaurant.close_time < restaurant.open_time else 0
+        for restaurant in restaurants
+    ], dtype=np.int64)
+
+    n = len(rows)
+    index = np.fromiter((position[row[0]] for row in rows), dtype=np.int64, count=n)
+    ordinal = np.fromiter((row[1].toordinal() for row in rows), dtype=np.int64, count=n)
+    hour = np.fromiter((row[2] for row in rows), dtype=np.int64, count=n)
+    values = np.array([row[3:] for row in rows], dtype=np.int64).reshape(n, len(FIELDS))
+
+    business_day = ordinal - (hour < carry_hours[index])
+    keep = (business_day >= start.toordinal()) & (business_day <= end.toordinal())
+    index, hour, values = index[keep], hour[keep], values[keep]
+    weekday = (business_day[keep] - 1) % 7
+
+    totals = np.zeros((len(restaurants), len(FIELDS)), dtype=np.int64)
+    np.add.at(totals, index, values)
+    seat_minutes = np.zeros((len(restaurants), 7, HOURS), dtype=np.int64)
+    np.add.at(seat_minutes, (index, weekday, hour), values[:, FIELDS.index('seat_minutes')])
+
+    # 期間中のそれぞれの曜日の日数（date.toordinal() は 1 が月曜）
+    ordinals = np.arange(start.toordinal(), end.toordinal() + 1)
+    weekday_days = np.bincount((ordinals - 1) % 7, minlength=7)
+    days = len(ordinals)
+
+    summaries = []
+    for i, restaurant in enumerate(restaurants):
+        capacity = restaurant.total_seats * 60 * weekday_days[:, None]
+        occupancy = np.divide(seat_minutes[i], capacity, out=np.zeros((7, HOURS)), where=capacity > 0)
+        hours = business_hours(restaurant)
+        count, cancelled, no_show, covers, _ = (int(value) for value in totals[i])
+        summaries.append({
+            'restaurant': restaurant,
+            'hours': hours,
+            'heatmap': [
+                (WEEKDAY_LABELS[wd], [min(float(occupancy[wd, h]), 1.0) for h in hours])
+                for wd in range(7)
+            ],
+            'reservation_count': count,
+            'cancel_rate': cancelled / count if count else 0.0,
+            'no_show_rate': no_show / count if count else 0.0,
+            'covers': covers,
+            'covers_per_day': covers / days,
+        })
+    return summaries
@@ -0,0 +1,69 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from restaurants.models import Restaurant, Table
+from . import archive, availability_calendar, rollup
+from .allocation import release_claims, release_slots, sync_claims
+from .models import Reservation, SlotClaim, SlotHold
+
+
+@receiver(post_save, sender=Reservation)
+def reservation_saved(sender, instance, **kwargs):
+    # キャンセル・利用済みになったら確保していた枠を空ける
+    sync_claims(instance)
+
+
+@receiver(pre_delete, sender=Reservation)
+def reservation_deleting(sender, instance, **kwargs):
+    # SlotClaim は CASCADE で消えるが、埋まり具合のビット列は自分で空ける
+    # （アーカイブに移すときは、利用済み・キャンセルでもう手放しているので何もしない）
+    if archive.in_progress():
+        return
+    release_slots(instance)
+
+
+@receiver(pre_delete, sender=SlotHold)
+def slot_hold_deleting(sender, instance, **kwargs):
+    # 期限切れ・選び直しで消えるとき。予約に付け替えた後なら SlotClaim は残っていない
+    release_claims(SlotClaim.objects.filter(hold=instance))
+
+
+# --- ダッシュボードの集計（ReservationRollup） ---
+
+@receiver(pre_save, sender=Reservation)
+def reservation_saving(sender, instance, **kwargs):
+    # 変わる前の分を引くために、保存前の値を取っておく
+    instance._rollup_before = rollup.snapshot(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=Reservation)
+def update_rollup(sender, instance, **kwargs):
+    rollup.apply(before=getattr(instance, '_rollup_before', None), after=rollup.source_values(instance))
+
+
+@receiver(post_delete, sender=Reservation)
+def remove_from_rollup(sender, instance, **kwargs):
+    # アーカイブに移した予約は集計に残す
+    if archive.in_progress():
+        return
+    rollup.apply(before=rollup.source_values(instance))
+
+
+# --- 空席カレンダーのキャッシュの無効化 ---
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+@receiver(post_save, sender=SlotHold)
+@receiver(post_delete, sender=SlotHold)
+def invalidate_availability_calendar(sender, instance, **kwargs):
+    if sender is Reservation and archive.in_progress():
+        return  # 過去の日の予約なのでカレンダーは変わらない
+    availability_calendar.bump_version(instance.restaurant_id)
+
+
+@receiver(post_save, sender=Restaurant)
+def restaurant_hours_changed(sender, instance, **kwargs):
+    # 営業時間が変わると受け付ける時刻も変わる
+    availability_calendar.bump_version(instance.pk)
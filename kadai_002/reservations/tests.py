@@ -1,3 +1,869 @@
-from django.test import TestCase
+import threading
+from unittest import mock
+from datetime import date, time, timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from restaurants import capacity, index_versions
+from restaurants.models import Category, Company, Restaurant, Table
+from . import occupancy
+from .allocation import NoTableAvailable, assign_table
+from . import availability_calendar
+from .availability_calendar import build_calendar
+from .availability import DaySchedule, free_table_exists, nearest_free_times
+from .branches import free_branches
+from .combination import best_combination
+from .forms import ReservationForm
+from .holds import HOLD_MINUTES, take_hold
+from . import archive, lifecycle, rollup
+from .models import ArchivedReservation, Reservation, ReservationRollup, SlotClaim, SlotHold
+from .views import OwnerReservationListView
+
+
+def book(user, restaurant, reservation_date, reservation_time, party_size=2, candidates=None, hold=None):
+    """
+    予約を保存してテーブルを確保する（ReservationCreateView と同じ流れ）。取れなければ None
+    candidates はフォームのチェックで見つけた空席（保存までの間に古くなっているかもしれない）
+    hold は時間を選んだときに取った仮押さえ
+    """
+    try:
+        with transaction.atomic():
+            reservation = Reservation.objects.create(
+                user=user, restaurant=restaurant,
+                reservation_date=reservation_date, reservation_time=reservation_time,
+                party_size=party_size,
+            )
+            assign_table(reservation, candidates, hold=hold)
+            return reservation
+    except NoTableAvailable:
+        return None
+
+
+class AllocationFixtureMixin:
+    """店舗 THREADS 件（各4名席×3）とユーザー THREADS 人"""
+
+    THREADS = 12
+
+    def setUp(self):
+        # テストごとに DB のバージョンは巻き戻るので、前のテストのキャッシュが同じバージョンで残らないようにする
+        cache.clear()
+        index_versions._checked.clear()
+        owner = User.objects.create_user('owner@example.com', None, name='owner', is_owner_member=True)
+        company = Company.objects.create(
+            owner=owner, name='テスト', representative='r', zipcode='1', address='a', business='b',
+        )
+        category = Category.objects.create(company=company, name='和食')
+        self.restaurants = [
+            Restaurant.objects.create(
+                company=company, category=category, name=f'店舗{i}', price_min=1000, price_max=2000,
+                open_time=time(11), close_time=time(22), zipcode='1', address='a', tel='1',
+            )
+            for i in range(self.THREADS)
+        ]
+        for restaurant in self.restaurants:
+            for _ in range(3):
+                Table.objects.create(restaurant=restaurant, capacity=4)
+            # 席の集計（max_party_size など）はシグナルで DB 側だけ更新されている
+            restaurant.refresh_from_db()
+        self.users = [
+            User.objects.create_user(f'user{i}@example.com', None, name=f'user{i}')
+            for i in range(self.THREADS)
+        ]
+        self.reservation_date = date.today() + timedelta(days=7)
+
+
+class DayScheduleTests(AllocationFixtureMixin, TestCase):
+    """空席は1日分のテーブルと埋まり具合をまとめて読んで判定し、テーブルが増えてもクエリは増えない"""
+
+    THREADS = 1
+
+    def setUp(self):
+        super().setUp()
+        self.restaurant = self.restaurants[0]
+        Table.objects.create(restaurant=self.restaurant, capacity=2)
+        Table.objects.create(restaurant=self.restaurant, capacity=6)
+        self.restaurant.refresh_from_db()
+
+    def test_best_fit_and_own_reservation(self):
+        schedule = DaySchedule.load(self.restaurant, self.reservation_date)
+        self.assertEqual(schedule.find_table(time(19), 2).capacity, 2)
+        self.assertEqual(schedule.find_table(time(19), 5).capacity, 6)
+
+        reservation = book(self.users[0], self.restaurant, self.reservation_date, time(19))
+        self.assertEqual(reservation.table.capacity, 2)
+        schedule = DaySchedule.load(self.restaurant, self.reservation_date)
+        self.assertEqual(schedule.find_table(time(20, 45), 2).capacity, 4)
+        self.assertEqual(schedule.find_table(time(21), 2).capacity, 2)
+        # 編集中の予約の席は空いていることにする
+        schedule = DaySchedule.load(self.restaurant, self.reservation_date, exclude_reservation=reservation)
+        self.assertEqual(schedule.find_table(time(19, 30), 2), reservation.table)
+
+    def test_form_queries_do_not_grow_with_tables(self):
+        def count_queries():
+            form = ReservationForm(
+                data={'reservation_date': self.reservation_date.isoformat(), 'reservation_time': '19:00', 'party_size': 2},
+                restaurant=self.restaurant, user=self.users[0],
+            )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(form.is_valid(), form.errors)
+            return len(queries)
+
+        before = count_queries()
+        for _ in range(10):
+            Table.objects.create(restaurant=self.restaurant, capacity=4)
+        self.restaurant.refresh_from_db()
+        self.assertEqual(count_queries(), before)
+
+
+class ConcurrentAllocationTests(AllocationFixtureMixin, TransactionTestCase):
+    """同時に予約が来ても同じテーブルの同じ時間帯が二重に割り当てられないこと"""
+
+    def setUp(self):
+        # スレッドごとに別の接続になるので、メモリ上の SQLite では試せない
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('テスト用 DB がメモリ上の SQLite のため')
+        super().setUp()
+
+    def run_concurrently(self, targets):
+        """targets[i] の予約を同時に送る。成功した Reservation（取れなければ None）のリストを返す"""
+        barrier = threading.Barrier(len(targets))
+        results = [None] * len(targets)
+        errors = []
+
+        def worker(i):
+            user, restaurant, reservation_time = targets[i]
+            try:
+                # フォームの空席チェック（全員がまだ空いていると判断する）
+                candidates = DaySchedule.load(restaurant, self.reservation_date).free_tables(reservation_time, 2)
+                barrier.wait()
+                results[i] = book(user, restaurant, self.reservation_date, reservation_time, candidates=candidates)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(targets))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_same_slot_is_never_double_booked(self):
+        restaurant = self.restaurants[0]
+        results = self.run_concurrently([(user, restaurant, time(19)) for user in self.users])
+
+        booked = [r for r in results if r is not None]
+        # テーブルは3つなので3件だけ取れて、残りは空席なしになる
+        self.assertEqual(len(booked), 3)
+        self.assertEqual(len({r.table_id for r in booked}), 3)
+        self.assertEqual(
+            Reservation.objects.filter(restaurant=restaurant, table__isnull=False).count(), 3,
+        )
+
+    def test_overlapping_times_are_never_double_booked(self):
+        restaurant = self.restaurants[0]
+        # 18:00〜20:30 の15分刻み。どの2件も2時間以内に重なる組み合わせがある
+        times = [time(18 + (i * 15) // 60, (i * 15) % 60) for i in range(self.THREADS)]
+        self.run_concurrently(list(zip(self.users, [restaurant] * self.THREADS, times)))
+
+        for table in restaurant.tables.all():
+            starts = sorted(
+                Reservation.objects.filter(table=table).values_list('reservation_time', flat=True)
+            )
+            for earlier, later in zip(starts, starts[1:]):
+                gap = (later.hour * 60 + later.minute) - (earlier.hour * 60 + earlier.minute)
+                self.assertGreaterEqual(gap, 120)
+
+    def test_different_restaurants_all_succeed(self):
+        results = self.run_concurrently(
+            [(user, restaurant, time(19)) for user, restaurant in zip(self.users, self.restaurants)]
+        )
+        self.assertTrue(all(r is not None for r in results))
+        self.assertEqual(SlotClaim.objects.values('reservation').distinct().count(), self.THREADS)
+
+
+class SlotReleaseTests(AllocationFixtureMixin, TestCase):
+    """キャンセル・日時変更で確保していた枠が空くこと"""
+
+    THREADS = 4
+
+    def test_cancel_releases_slots(self):
+        restaurant = self.restaurants[0]
+        first = [book(user, restaurant, self.reservation_date, time(19)) for user in self.users[:3]]
+        self.assertIsNone(book(self.users[3], restaurant, self.reservation_date, time(19)))
+
+        first[0].status = 'cancelled'
+        first[0].save()
+        self.assertIsNotNone(book(self.users[3], restaurant, self.reservation_date, time(19)))
+
+    def test_changing_time_moves_claims(self):
+        restaurant = self.restaurants[0]
+        reservation = book(self.users[0], restaurant, self.reservation_date, time(19))
+        reservation.reservation_time = time(12)
+        with transaction.atomic():
+            reservation.save()
+            assign_table(reservation)
+
+        slots = set(SlotClaim.objects.filter(reservation=reservation).values_list('slot', flat=True))
+        self.assertEqual(slots, set(range(12 * 4, 14 * 4)))
+
+    def test_occupancy_follows_claims(self):
+        restaurant = self.restaurants[0]
+        booked = [
+            book(user, restaurant, self.reservation_date, t)
+            for user, t in zip(self.users, [time(11), time(13), time(19), time(22, 30)])
+        ]
+        booked[1].status = 'cancelled'
+        booked[1].save()
+        booked[2].delete()
+
+        table = booked[0].table
+        next_date = self.reservation_date + timedelta(days=1)
+        expected = {
+            (table.pk, day): occupancy.slot_mask(
+                SlotClaim.objects.filter(table=table, date=day).values_list('slot', flat=True)
+            )
+            for day in (self.reservation_date, next_date)
+        }
+        self.assertEqual(occupancy.load([table], self.reservation_date, next_date), expected)
+        # 作り直しても同じになる
+        occupancy.rebuild()
+        self.assertEqual(occupancy.load([table], self.reservation_date, next_date), expected)
+        # 22:30〜 は日をまたぐので最後の枠まで埋まり、翌日の 0:30 までも埋まる
+        self.assertTrue(expected[(table.pk, self.reservation_date)] >> (occupancy.SLOTS_PER_DAY - 1) & 1)
+        self.assertEqual(expected[(table.pk, next_date)], 0b11)
+
+
+class SeatingPeriodTests(AllocationFixtureMixin, TestCase):
+    """店舗ごとの利用時間と日をまたぐ予約"""
+
+    THREADS = 2
+
+    def test_period_follows_restaurant_seating_minutes(self):
+        restaurant = self.restaurants[0]
+        restaurant.seating_minutes = 90
+        restaurant.save()
+        reservation = book(self.users[0], restaurant, self.reservation_date, time(19))
+        self.assertEqual(reservation.ends_at - reservation.starts_at, timedelta(minutes=90))
+        # 20:30 からは同じテーブルも空いている
+        schedule = DaySchedule.load(restaurant, self.reservation_date)
+        self.assertTrue(schedule.is_table_free(reservation.table, time(20, 30)))
+        self.assertFalse(schedule.is_table_free(reservation.table, time(20, 15)))
+
+    def test_late_booking_blocks_next_day(self):
+        restaurant = self.restaurants[0]
+        restaurant.open_time = time(0)
+        restaurant.close_time = time(23, 45)
+        restaurant.save()
+        next_date = self.reservation_date + timedelta(days=1)
+        for user in self.users + self.users[:1]:
+            book(user, restaurant, self.reservation_date, time(23))
+
+        # 翌日 0:30 は3卓とも埋まっていて、1:00 からは空く
+        schedule = DaySchedule.load(restaurant, next_date)
+        self.assertEqual(len(schedule.free_tables(time(0, 30), 2)), 0)
+        self.assertEqual(len(schedule.free_tables(time(1), 2)), 3)
+        self.assertFalse(
+            Restaurant.objects.filter(pk=restaurant.pk)
+            .filter(free_table_exists(next_date, time(0, 30), 2)).exists()
+        )
+        self.assertTrue(
+            Restaurant.objects.filter(pk=restaurant.pk)
+            .filter(free_table_exists(next_date, time(1), 2)).exists()
+        )
+
+
+class TableCombinationTests(AllocationFixtureMixin, TestCase):
+    """1卓で座れない人数は、同じ結合グループのテーブルをくっつけて割り当てる"""
+
+    THREADS = 3
+
+    def test_best_combination_prefers_least_waste(self):
+        tables = [Table(pk=i, capacity=c, join_group='A') for i, c in enumerate([2, 4, 6], start=1)]
+        # 4+6=10 より 2+6=8 の方が余りが少ない
+        self.assertEqual([t.capacity for t in best_combination(tables, 7)], [6, 2])
+        # 余りが同じなら卓数が少ない方（2+4 より 6）
+        self.assertEqual([t.capacity for t in best_combination(tables, 6)], [6])
+        # 結合グループなしのテーブルはくっつけない
+        self.assertIsNone(best_combination([Table(pk=9, capacity=4), tables[1]], 8))
+
+    def test_large_party_gets_joined_tables(self):
+        restaurant = self.restaurants[0]
+        restaurant.tables.update(join_group='A')
+        capacity.refresh(restaurant.pk)
+
+        reservation = book(self.users[0], restaurant, self.reservation_date, time(19), party_size=8)
+        self.assertIsNotNone(reservation)
+        self.assertEqual(reservation.joined_tables.count(), 1)
+        self.assertEqual(
+            SlotClaim.objects.filter(reservation=reservation).values('table').distinct().count(), 2,
+        )
+        # 残りは4名席1卓だけ
+        self.assertIsNone(book(self.users[1], restaurant, self.reservation_date, time(19), party_size=8))
+        self.assertIsNotNone(book(self.users[2], restaurant, self.reservation_date, time(19), party_size=4))
+        self.assertFalse(
+            Restaurant.objects.filter(pk=restaurant.pk)
+            .filter(free_table_exists(self.reservation_date, time(19), 2)).exists()
+        )
+
+    def test_search_finds_joinable_tables(self):
+        restaurant = self.restaurants[0]
+        self.assertFalse(
+            Restaurant.objects.filter(pk=restaurant.pk)
+            .filter(free_table_exists(self.reservation_date, time(19), 10)).exists()
+        )
+        restaurant.tables.update(join_group='A')
+        capacity.refresh(restaurant.pk)
+        self.assertTrue(
+            Restaurant.objects.filter(pk=restaurant.pk)
+            .filter(free_table_exists(self.reservation_date, time(19), 10)).exists()
+        )
+
+
+class AlternativeTimeTests(AllocationFixtureMixin, TestCase):
+    """満席のときは読み込み済みの埋まり具合から近い空き時間を探す"""
+
+    THREADS = 3
+
+    def test_nearest_free_times(self):
+        restaurant = self.restaurants[0]
+        for user in self.users:
+            book(user, restaurant, self.reservation_date, time(19))
+
+        schedules = DaySchedule.load_days(restaurant, self.reservation_date, 2)
+        with self.assertNumQueries(0):
+            found = nearest_free_times(schedules, time(19), 2, limit=6)
+        # 19:00〜21:00 は埋まっているので、17:00（19:00 まで）と 21:00 からが一番近い
+        day = self.reservation_date
+        self.assertEqual(found[:5], [
+            (day, time(17)), (day, time(21)), (day, time(16, 45)), (day, time(21, 15)), (day, time(16, 30)),
+        ])
+        # 同じ日で足りなければ翌日の希望の時刻から
+        found = nearest_free_times(schedules, time(19), 2, limit=50)
+        self.assertIn((day + timedelta(days=1), time(19)), found)
+        self.assertEqual(found[-1][0], day + timedelta(days=1))
+
+
+class BranchAvailabilityTests(AllocationFixtureMixin, TestCase):
+    """満席のときの系列店の空席"""
+
+    THREADS = 4
+
+    def test_free_branches(self):
+        restaurant, full, far, near = self.restaurants
+        for user in self.users[:3]:
+            book(user, full, self.reservation_date, time(19))
+        far.city = '豊橋市'
+        far.save()
+
+        with self.assertNumQueries(2):
+            branches = free_branches(restaurant, self.reservation_date, time(19), 2)
+        # 満席の店舗と自分は出ず、同じ市区町村の店舗が先
+        self.assertEqual(branches, [near, far])
+        self.assertEqual(free_branches(restaurant, self.reservation_date, time(19), 2, city='豊橋市'), [far])
+
+
+class SlotHoldTests(AllocationFixtureMixin, TestCase):
+    """仮押さえした枠はほかの人から埋まって見え、予約するときにそのまま使える"""
+
+    THREADS = 4
+
+    def test_holds_block_other_users(self):
+        restaurant = self.restaurants[0]
+        holds = [take_hold(user, restaurant, self.reservation_date, time(19), 2) for user in self.users[:3]]
+        self.assertEqual(len({hold.table_id for hold in holds}), 3)
+        self.assertIsNone(take_hold(self.users[3], restaurant, self.reservation_date, time(19), 2))
+        self.assertIsNone(book(self.users[3], restaurant, self.reservation_date, time(19)))
+
+        # 仮押さえした本人はその席で予約できる
+        reservation = book(self.users[0], restaurant, self.reservation_date, time(19), hold=holds[0])
+        self.assertEqual(reservation.table_id, holds[0].table_id)
+        self.assertFalse(SlotHold.objects.filter(pk=holds[0].pk).exists())
+        self.assertEqual(SlotClaim.objects.filter(reservation=reservation).count(), 8)
+
+    def test_expired_hold_is_free(self):
+        restaurant = self.restaurants[0]
+        for user in self.users[:3]:
+            take_hold(user, restaurant, self.reservation_date, time(19), 2)
+        SlotHold.objects.filter(user=self.users[0]).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        schedule = DaySchedule.load(restaurant, self.reservation_date)
+        self.assertEqual(len(schedule.free_tables(time(19), 2)), 1)
+        self.assertIsNotNone(book(self.users[3], restaurant, self.reservation_date, time(19)))
+        # 予約のときに期限切れの仮押さえは片付けられる
+        self.assertEqual(SlotHold.objects.count(), 2)
+
+    def test_search_sees_holds(self):
+        """店舗検索（free_table_exists）も DaySchedule と同じく期限内の仮押さえを埋まっているとみなす"""
+        restaurant = self.restaurants[0]
+        restaurant.tables.filter(pk__in=restaurant.tables.values('pk')[:2]).update(join_group='A')
+        capacity.refresh(restaurant.pk)
+        restaurant.refresh_from_db()
+
+        def searchable():
+            return Restaurant.objects.filter(
+                free_table_exists(self.reservation_date, time(19), 2), pk=restaurant.pk,
+            ).exists()
+
+        # くっつけたテーブルの仮押さえ（SlotHold.table は1卓だけ）ともう1卓の仮押さえで満席
+        joined = take_hold(self.users[0], restaurant, self.reservation_date, time(19), 8)
+        self.assertEqual(SlotClaim.objects.filter(hold=joined).values('table').distinct().count(), 2)
+        self.assertTrue(searchable())
+        take_hold(self.users[1], restaurant, self.reservation_date, time(19), 2)
+        self.assertFalse(searchable())
+        self.assertFalse(DaySchedule.load(restaurant, self.reservation_date).can_seat(time(19), 2))
+
+        # 期限が切れたら（まだ消されていなくても）空いている
+        SlotHold.objects.filter(pk=joined.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(searchable())
+        self.assertTrue(DaySchedule.load(restaurant, self.reservation_date).can_seat(time(19), 2))
+
+
+    def test_hold_times_are_checked_like_the_form(self):
+        restaurant = self.restaurants[0]
+        for at in [time(3), time(19, 7), time(22, 15)]:
+            with self.assertRaises(ValidationError):
+                take_hold(self.users[0], restaurant, self.reservation_date, at, 2)
+        self.assertFalse(SlotClaim.objects.exists())
+
+        self.client.force_login(self.users[0])
+        url = reverse('reservations:hold_api', args=[restaurant.pk])
+        response = self.client.post(url, {'date': self.reservation_date.isoformat(), 'time': '19:07'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('15分単位', response.json()['error'])
+        response = self.client.post(url, {'date': self.reservation_date.isoformat(), 'time': '19:15'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_hold_while_editing_ignores_own_reservation(self):
+        restaurant = self.restaurants[0]
+        reservations = [book(user, restaurant, self.reservation_date, time(19), party_size=4) for user in self.users[:3]]
+        mine = reservations[0]
+
+        # 満席でも、自分の予約の枠は空いていることにして 30分後にずらせる
+        self.client.force_login(self.users[0])
+        url = reverse('reservations:hold_api', args=[restaurant.pk])
+        params = {'date': self.reservation_date.isoformat(), 'time': '19:30', 'party_size': 4}
+        self.assertEqual(self.client.post(url, params).status_code, 409)
+        response = self.client.post(url, dict(params, reservation=mine.pk))
+        self.assertEqual(response.status_code, 200)
+        # ほかの人の予約 ID を送っても使えない
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.post(url, dict(params, reservation=mine.pk)).status_code, 409)
+
+        hold = SlotHold.objects.get(pk=response.json()['hold'])
+        self.assertEqual(hold.table_id, mine.table_id)
+        with transaction.atomic():
+            mine.reservation_time = time(19, 30)
+            mine.save()
+            self.assertEqual(assign_table(mine, hold=hold), hold.table)
+        self.assertEqual(SlotClaim.objects.filter(reservation=mine).count(), 8)
+        self.assertFalse(SlotClaim.objects.filter(hold__isnull=False).exists())
+        schedule = DaySchedule.load(restaurant, self.reservation_date)
+        self.assertFalse(schedule.is_table_free(mine.table, time(19, 30)))
+        self.assertTrue(schedule.is_table_free(mine.table, time(21, 30)))
+
+
+class CapacitySummaryTests(AllocationFixtureMixin, TestCase):
+    """席の集計は Table の書き込みで更新され、座れない人数はクエリなしで断れる"""
+
+    THREADS = 1
+
+    def test_summary_follows_table_writes(self):
+        restaurant = self.restaurants[0]
+        self.assertEqual(
+            (restaurant.table_count, restaurant.total_seats, restaurant.max_party_size, restaurant.capacity_counts),
+            (3, 12, 4, {'4': 3}),
+        )
+        Table.objects.create(restaurant=restaurant, capacity=6, join_group='A')
+        Table.objects.create(restaurant=restaurant, capacity=2, join_group='A')
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.max_table_capacity, 6)
+        self.assertEqual(restaurant.max_party_size, 8)
+        self.assertEqual(restaurant.capacity_counts, {'2': 1, '4': 3, '6': 1})
+
+        restaurant.tables.filter(capacity=6).delete()
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.max_party_size, 4)
+        self.assertEqual(capacity.recount(), 0)
+
+    def test_impossible_party_needs_no_table_queries(self):
+        restaurant = self.restaurants[0]
+        with self.assertNumQueries(0):
+            calendar = build_calendar(restaurant, self.reservation_date, 3, 5)
+        self.assertFalse(any(available for _, slots in calendar for _, available in slots))
+        with self.assertNumQueries(0):
+            self.assertIsNone(take_hold(self.users[0], restaurant, self.reservation_date, time(19), 5))
+
+
+class AvailabilityCalendarApiTests(AllocationFixtureMixin, TestCase):
+    """空席カレンダーAPIは15分枠ごとに座れるかを返し、予約が入るとキャッシュを使わずに作り直す"""
+
+    THREADS = 3
+
+    def slots(self, day, **params):
+        url = reverse('reservations:availability_api', args=[self.restaurants[0].pk])
+        data = self.client.get(url, dict({'days': 2}, **params)).json()
+        return {slot['time']: slot['available'] for d in data['days'] if d['date'] == day.isoformat()
+                for slot in d['slots']}
+
+    def test_calendar(self):
+        day = timezone.localdate() + timedelta(days=1)
+        slots = self.slots(day, party_size=4)
+        self.assertEqual((min(slots), max(slots)), ('11:00', '22:00'))
+        self.assertTrue(slots['19:00'])
+
+        for user in self.users:
+            self.assertIsNotNone(book(user, self.restaurants[0], day, time(19), party_size=4))
+        slots = self.slots(day, party_size=4)
+        self.assertFalse(slots['18:00'])  # 18時からの120分は 19時の予約とかぶる
+        self.assertFalse(slots['20:45'])
+        self.assertTrue(slots['21:00'])
+        self.assertTrue(slots['17:00'])
+
+        # 席をつないでも座れない人数はすべて ×
+        self.assertFalse(any(self.slots(day, party_size=20).values()))
+
+    def test_held_slots_are_cached_until_the_hold_expires(self):
+        day = timezone.localdate() + timedelta(days=1)
+        for user in self.users:
+            take_hold(user, self.restaurants[0], day, time(12), 4)
+        with mock.patch.object(availability_calendar.cache, 'set', wraps=availability_calendar.cache.set) as cache_set:
+            self.assertFalse(self.slots(day, party_size=4)['12:00'])
+        self.assertLessEqual(cache_set.call_args.args[2], HOLD_MINUTES * 60)
+
+        # 期限切れ（まだ消されていない）になったら、キャッシュが切れた後は空いている
+        SlotHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        version = availability_calendar.get_version(self.restaurants[0].pk)
+        cache.clear()
+        index_versions._checked.clear()
+        self.assertTrue(self.slots(day, party_size=4)['12:00'])
+        # バージョンは DB にあるので、キャッシュが消えても戻らない
+        self.assertEqual(availability_calendar.get_version(self.restaurants[0].pk), version)
+
+    def test_search_uses_slot_grid(self):
+        restaurant = self.restaurants[0]
+        for user in self.users:
+            book(user, restaurant, self.reservation_date, time(21), party_size=4)
+
+        def searchable(at):
+            return Restaurant.objects.filter(free_table_exists(self.reservation_date, at, 2), pk=restaurant.pk).exists()
+
+        # 19:07 は 19:00 の枠（21:00 まで）で判定する
+        self.assertTrue(DaySchedule.load(restaurant, self.reservation_date).can_seat(time(19), 2))
+        self.assertTrue(searchable(time(19, 7)))
+        self.assertFalse(searchable(time(19, 15)))
+
+
+class OwnerReservationListTests(AllocationFixtureMixin, TestCase):
+    """オーナーの予約一覧は自社の店舗だけで、カーソルで全件を1回ずつたどれる"""
+
+    THREADS = 2
+
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.get(email='owner@example.com')
+        self.owner.company = self.restaurants[0].company
+        self.owner.save()
+        self.client.force_login(self.owner)
+
+        other = Company.objects.create(
+            owner=self.users[1], name='他社', representative='r', zipcode='1', address='a', business='b',
+        )
+        self.restaurants[1].company = other
+        self.restaurants[1].save()
+
+        restaurant = self.restaurants[0]
+        self.expected = []
+        for day in range(3):
+            for hour in (18, 19, 20):
+                self.expected.append(Reservation.objects.create(
+                    user=self.users[day % 2], restaurant=restaurant, party_size=2,
+                    reservation_date=date.today() + timedelta(days=day), reservation_time=time(hour),
+                ).pk)
+        # 昨日の予約・他社の予約は（条件を指定しなければ）出ない
+        Reservation.objects.create(
+            user=self.users[0], restaurant=restaurant, party_size=2,
+            reservation_date=date.today() - timedelta(days=1), reservation_time=time(19),
+        )
+        Reservation.objects.create(
+            user=self.users[0], restaurant=self.restaurants[1], party_size=2,
+            reservation_date=date.today(), reservation_time=time(19),
+        )
+
+    @mock.patch.object(OwnerReservationListView, 'paginate_by', 4)
+    def test_cursor_walks_company_reservations_in_order(self):
+        url = reverse('reservations:owner_reservation_list')
+        seen = []
+        cursor = ''
+        for _ in range(10):
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            seen += [reservation.pk for reservation in page]
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_filters(self):
+        url = reverse('reservations:owner_reservation_list')
+        response = self.client.get(url, {'customer': 'user1@', 'date_from': '', 'status': 'pending'})
+        self.assertEqual(
+            [reservation.pk for reservation in response.context['reservations']],
+            [pk for pk in self.expected if Reservation.objects.get(pk=pk).user == self.users[1]],
+        )
+        # 他社の店舗を指定しても他社の予約は見えない（おかしい条件は無視される）
+        response = self.client.get(url, {'restaurant': self.restaurants[1].pk})
+        self.assertEqual([reservation.pk for reservation in response.context['reservations']], self.expected)
+
+    def test_csv_streams_same_rows(self):
+        response = self.client.get(reverse('reservations:owner_reservation_csv'), {'date_to': date.today().isoformat()})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[0], 'ID')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], self.expected[:3])
+
+
+class ReservationAdminTests(AllocationFixtureMixin, TestCase):
+    """管理画面からは枠の確保を通らない変更ができない"""
+
+    THREADS = 2
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser('admin@example.com', 'pass', name='admin')
+        self.client.force_login(admin)
+        self.reservation = book(self.users[0], self.restaurants[0], self.reservation_date, time(19))
+        self.url = reverse('admin:reservations_reservation_change', args=[self.reservation.pk])
+
+    def post(self, **data):
+        return self.client.post(self.url, {'status': self.reservation.status, 'notes': '', **data})
+
+    def test_schedule_fields_are_read_only(self):
+        claims = list(SlotClaim.objects.filter(reservation=self.reservation).values_list('table', 'date', 'slot'))
+        response = self.post(reservation_time='12:00', party_size=4, table=self.restaurants[0].tables.last().pk)
+        self.assertEqual(response.status_code, 302)
+
+        self.reservation.refresh_from_db()
+        self.assertEqual((self.reservation.reservation_time, self.reservation.party_size), (time(19), 2))
+        self.assertEqual(
+            list(SlotClaim.objects.filter(reservation=self.reservation).values_list('table', 'date', 'slot')), claims,
+        )
+
+    def test_status_change_releases_claims_but_cannot_reactivate(self):
+        self.assertEqual(self.post(status='no_show').status_code, 302)
+        self.assertFalse(SlotClaim.objects.filter(reservation=self.reservation).exists())
+
+        response = self.post(status='confirmed')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['adminform'].form.errors)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.status, 'no_show')
+
+        # 一覧からまとめて変えるときも同じ
+        changelist = self.client.post(reverse('admin:reservations_reservation_changelist'), {
+            'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 1,
+            'form-0-id': self.reservation.pk, 'form-0-status': 'confirmed', '_save': '保存',
+        })
+        self.assertEqual(changelist.status_code, 200)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.status, 'no_show')
+
+    def test_cannot_add_from_admin(self):
+        response = self.client.get(reverse('admin:reservations_reservation_add'))
+        self.assertEqual(response.status_code, 403)
+
+
+class ReservationRollupTests(AllocationFixtureMixin, TestCase):
+    """予約を変えるたびに足し引きした集計が、作り直した集計と同じになる"""
+
+    THREADS = 2
+
+    def rollups(self):
+        return sorted(
+            ReservationRollup.objects.exclude(**{field: 0 for field in rollup.FIELDS})
+            .values_list('restaurant_id', 'date', 'hour', *rollup.FIELDS)
+        )
+
+    def test_incremental_matches_rebuild(self):
+        restaurant = self.restaurants[0]
+        restaurant.seating_minutes = 150
+        restaurant.save()
+        day = self.reservation_date
+        made = [
+            Reservation.objects.create(user=self.users[i % 2], restaurant=restaurant, party_size=i + 1,
+                                       reservation_date=day, reservation_time=at)
+            for i, at in enumerate([time(11), time(18, 45), time(19), time(22)])
+        ]
+        # 22時からの150分は翌日の0時台にかかる
+        self.assertEqual(
+            ReservationRollup.objects.get(restaurant=restaurant, date=day + timedelta(days=1), hour=0).seat_minutes,
+            4 * 30,
+        )
+
+        made[0].status = 'cancelled'
+        made[0].save()
+        made[1].status = 'no_show'
+        made[1].save()
+        made[2].reservation_time = time(20, 15)
+        made[2].party_size = 5
+        made[2].save()
+        made[3].delete()
+        Reservation.objects.create(user=self.users[0], restaurant=self.restaurants[1], party_size=2,
+                                   reservation_date=day, reservation_time=time(12))
+
+        incremental = self.rollups()
+        self.assertEqual(rollup.rebuild(batch_size=2), len(incremental))
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_status_change_without_effect_writes_nothing(self):
+        reservation = Reservation.objects.create(user=self.users[0], restaurant=self.restaurants[0], party_size=2,
+                                                 reservation_date=self.reservation_date, reservation_time=time(19))
+        reservation = Reservation.objects.get(pk=reservation.pk)
+        reservation.status = 'confirmed'
+        with CaptureQueriesContext(connection) as queries:
+            reservation.save(update_fields=['status'])
+        self.assertFalse([q for q in queries if 'reservations_reservationrollup' in q['sql']])
+
+    def test_restaurant_with_reservations_can_be_deleted(self):
+        restaurant = self.restaurants[0]
+        Reservation.objects.create(user=self.users[0], restaurant=restaurant, party_size=2,
+                                   reservation_date=self.reservation_date, reservation_time=time(19))
+        restaurant.delete()
+        self.assertFalse(ReservationRollup.objects.filter(restaurant_id=restaurant.pk).exists())
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA foreign_key_check')
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_dashboard_reads_only_rollups(self):
+        restaurant = self.restaurants[0]
+        owner = User.objects.get(email='owner@example.com')
+        owner.company = restaurant.company
+        owner.save()
+        today = timezone.localdate()
+        Reservation.objects.create(user=self.users[0], restaurant=restaurant, party_size=4,
+                                   reservation_date=today, reservation_time=time(19))
+        Reservation.objects.create(user=self.users[1], restaurant=restaurant, party_size=2,
+                                   reservation_date=today, reservation_time=time(19), status='cancelled')
+
+        self.client.force_login(owner)
+        response = self.client.get(reverse('restaurants:owner_dashboard'), {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        stats = {s['restaurant'].pk: s for s in response.context['restaurant_stats']}[restaurant.pk]
+        self.assertEqual(stats['reservation_count'], 2)
+        self.assertEqual(stats['cancel_rate'], 0.5)
+        self.assertEqual(stats['covers'], 4)
+        heatmap = dict(stats['heatmap'])[rollup.WEEKDAY_LABELS[today.weekday()]]
+        # 4名 × 60分 / (4名席×3 × 60分)
+        self.assertAlmostEqual(heatmap[stats['hours'].index(19)], 4 / 12)
+        self.assertAlmostEqual(heatmap[stats['hours'].index(20)], 4 / 12)
+        self.assertEqual(heatmap[stats['hours'].index(21)], 0)
+
+    def test_dashboard_carries_after_midnight_to_previous_day(self):
+        restaurant = self.restaurants[0]
+        restaurant.open_time, restaurant.close_time = time(18), time(2)
+        restaurant.save()
+        end = timezone.localdate()
+        start = end - timedelta(days=6)
+        # 期間の最後の日の 23時から 120分（翌日の 0時台まで）
+        Reservation.objects.create(user=self.users[0], restaurant=restaurant, party_size=4,
+                                   reservation_date=end, reservation_time=time(23))
+        # 期間の最初の日の 1時台は、その前の日（期間外）の営業
+        Reservation.objects.create(user=self.users[1], restaurant=restaurant, party_size=2,
+                                   reservation_date=start, reservation_time=time(1))
+
+        stats = rollup.dashboard([restaurant], start, end)[0]
+        self.assertEqual(stats['hours'], [18, 19, 20, 21, 22, 23, 0, 1, 2])
+        self.assertEqual(stats['reservation_count'], 1)
+        heatmap = dict(stats['heatmap'])[rollup.WEEKDAY_LABELS[end.weekday()]]
+        self.assertAlmostEqual(heatmap[stats['hours'].index(23)], 4 / 12)
+        self.assertAlmostEqual(heatmap[stats['hours'].index(0)], 4 / 12)
+        self.assertEqual(dict(stats['heatmap'])[rollup.WEEKDAY_LABELS[start.weekday()]][stats['hours'].index(1)], 0)
+
+
+class LifecycleTests(AllocationFixtureMixin, TestCase):
+    """利用時間が過ぎた有効な予約だけが、まとめて利用済みになって枠を手放す"""
+
+    THREADS = 1
+
+    def test_complete_past(self):
+        restaurant = self.restaurants[0]
+        yesterday = date.today() - timedelta(days=1)
+        past = [book(self.users[0], restaurant, yesterday, time(hour)) for hour in (12, 15, 18, 19)]
+        past[3].status = 'cancelled'
+        past[3].save()
+        upcoming = book(self.users[0], restaurant, self.reservation_date, time(19))
+        self.assertTrue(SlotClaim.objects.filter(reservation=past[0]).exists())
+
+        self.assertEqual(lifecycle.complete_past(batch_size=2), 3)
+        self.assertEqual(
+            sorted(Reservation.objects.values_list('status', flat=True)),
+            ['cancelled', 'completed', 'completed', 'completed', 'pending'],
+        )
+        self.assertFalse(SlotClaim.objects.filter(reservation__in=past).exists())
+        self.assertTrue(SlotClaim.objects.filter(reservation=upcoming).exists())
+        self.assertFalse(Reservation.objects.get(pk=past[0].pk).is_active)
+        self.assertEqual(lifecycle.complete_past(), 0)
+
+
+class ArchiveTests(AllocationFixtureMixin, TestCase):
+    """古い利用済み・キャンセルの予約だけが移り、集計と予約一覧はそのまま"""
+
+    THREADS = 1
+
+    def setUp(self):
+        super().setUp()
+        restaurant = self.restaurants[0]
+        user = self.users[0]
+        old = date.today() - timedelta(days=400)
+        self.old = []
+        for i, status in enumerate(['completed', 'cancelled', 'no_show', 'pending']):
+            self.old.append(Reservation.objects.create(
+                user=user, restaurant=restaurant, party_size=2, status=status,
+                reservation_date=old + timedelta(days=i), reservation_time=time(19),
+            ))
+        self.recent = Reservation.objects.create(
+            user=user, restaurant=restaurant, party_size=3, status='completed',
+            reservation_date=date.today() - timedelta(days=3), reservation_time=time(12),
+        )
+        self.upcoming = book(user, restaurant, self.reservation_date, time(19))
+
+    def rollups(self):
+        return sorted(ReservationRollup.objects.values_list('restaurant_id', 'date', 'hour', *rollup.FIELDS))
+
+    def test_archive_keeps_rollups(self):
+        before = self.rollups()
+        self.assertEqual(archive.archive(batch_size=2), 3)
+        self.assertEqual(
+            sorted(ArchivedReservation.objects.values_list('id', flat=True)),
+            [reservation.pk for reservation in self.old[:3]],
+        )
+        self.assertEqual(
+            sorted(Reservation.objects.values_list('id', flat=True)),
+            [self.old[3].pk, self.recent.pk, self.upcoming.pk],
+        )
+        self.assertEqual(self.rollups(), before)
+        rollup.rebuild()
+        self.assertEqual(self.rollups(), before)
+        self.assertEqual(archive.archive(), 0)
+
+    def test_history_lists_both_tables(self):
+        archive.archive()
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('reservations:reservation_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [reservation.pk for reservation in response.context['reservations']],
+            [self.upcoming.pk, self.recent.pk] + [reservation.pk for reservation in reversed(self.old)],
+        )
+        self.assertEqual(response.context['paginator'].count, 6)
+        self.assertContains(response, '無断キャンセル')
@@ -8,4 +8,13 @@ urlpatterns = [
     path('create/<int:restaurant_pk>/', views.ReservationCreateView.as_view(), name='reservation_create'),
     path('<int:pk>/edit/', views.ReservationUpdateView.as_view(), name='reservation_edit'),
     path('<int:pk>/cancel/', views.ReservationCancelView.as_view(), name='reservation_cancel'),
+
+    # --- オーナー管理画面：予約管理 ---
+    path('owner/', views.OwnerReservationListView.as_view(), name='owner_reservation_list'),
+    path('owner/export/', views.OwnerReservationCSVView.as_view(), name='owner_reservation_csv'),
+
+    # --- API ---
+    path('api/availability/<int:restaurant_pk>/', views.availability_api, name='availability_api'),
+    path('api/holds/<int:restaurant_pk>/', views.hold_api, name='hold_api'),
+    path('api/branches/<int:restaurant_pk>/', views.branch_availability_api, name='branch_availability_api'),
 ]
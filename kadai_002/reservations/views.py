@@ -3,9 +3,26 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_POST
+from django.utils import timezone
 from .models import Reservation
-from .forms import ReservationForm
+from .forms import OwnerReservationFilterForm, ReservationForm
+from .allocation import NoTableAvailable, assign_table
+from .archive import ReservationHistory
+from .availability import ACTIVE_STATUSES, parse_search_params
+from .availability_calendar import DEFAULT_DAYS, MAX_DAYS, get_calendar
+from .branches import BRANCH_LIMIT, free_branches
+from .holds import HOLD_MINUTES, release_user_holds, take_hold
+from accounts.idempotency import FIELD as IDEMPOTENCY_FIELD, idempotent, new_key
+from accounts.mixins import OwnerRequiredMixin
 from restaurants.models import Restaurant
+from restaurants.pagination import KeysetPaginator
+import csv
+import urllib.parse
 
 
 class ReservationListView(LoginRequiredMixin, ListView):
@@ -16,11 +33,37 @@ class ReservationListView(LoginRequiredMixin, ListView):
     paginate_by = 10
     
     def get_queryset(self):
-        # ログイン中のユーザーの予約のみ
-        return Reservation.objects.filter(user=self.request.user).select_related('restaurant')
+        # ログイン中のユーザーの予約のみ（アーカイブに移した古い予約も合わせて新しい順に）
+        return ReservationHistory(self.request.user)
 
 
-class ReservationCreateView(LoginRequiredMixin, CreateView):
+class TableAssignMixin:
+    """
+    保存と同時にテーブルの枠を確保する（allocation.assign_table）。
+    フォームのチェック後に他の人が同じ席を取っていて、代わりの席もなければフォームに戻す。
+    """
+    success_message = ''
+
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                assign_table(self.object, form.candidate_tables, hold=form.active_hold)
+                # 選び直して使わなかった仮押さえも手放す
+                release_user_holds(self.request.user, self.object.restaurant)
+        except NoTableAvailable:
+            form.add_error(
+                None,
+                '申し訳ございません。ほかのお客様のご予約が先に確定したため、空席がなくなりました。'
+                '別の日時をお選びください。'
+            )
+            return self.form_invalid(form)
+        messages.success(self.request, self.success_message)
+        return redirect(self.get_success_url())
+
+
+@method_decorator(idempotent, name='post')  # ダブルクリック・リトライで予約が2件できないように
+class ReservationCreateView(LoginRequiredMixin, TableAssignMixin, CreateView):
     """予約作成"""
     model = Reservation
     form_class = ReservationForm
@@ -32,32 +75,41 @@ class ReservationCreateView(LoginRequiredMixin, CreateView):
         # 店舗情報を取得
         restaurant_pk = self.kwargs.get('restaurant_pk')
         ctx['restaurant'] = get_object_or_404(Restaurant, pk=restaurant_pk)
+        # エラーで戻ってきたときは同じキーのまま（保存していないので同じキーでやり直せる）
+        ctx['idempotency_key'] = self.request.POST.get(IDEMPOTENCY_FIELD) or new_key()
         return ctx
     
+    def get_initial(self):
+        """?date=..&time=..&party_size=..（系列店の空席から来たときなど）を初期値にする"""
+        initial = super().get_initial()
+        params = parse_search_params(self.request.GET)
+        if params:
+            initial['reservation_date'], initial['reservation_time'], initial['party_size'] = params
+        return initial
+
     def get_form_kwargs(self):
         """フォームに店舗情報を渡す"""
         kwargs = super().get_form_kwargs()
         restaurant_pk = self.kwargs.get('restaurant_pk')
         restaurant = get_object_or_404(Restaurant, pk=restaurant_pk)
         kwargs['restaurant'] = restaurant
+        kwargs['user'] = self.request.user
         return kwargs
     
+    success_message = '予約を作成しました。'
+    
     def form_valid(self, form):
         # ユーザーと店舗を設定
         form.instance.user = self.request.user
         restaurant_pk = self.kwargs.get('restaurant_pk')
         form.instance.restaurant = get_object_or_404(Restaurant, pk=restaurant_pk)
         
-        # フォームのバリデーションで割り当てられた席を設定
-        if hasattr(form, 'assigned_table') and form.assigned_table:
-            form.instance.table = form.assigned_table
-        
-        messages.success(self.request, '予約を作成しました。')
+        # 席はフォームで見つけた空席から、保存と同時に確保する
         return super().form_valid(form)
 
 
 
-class ReservationUpdateView(LoginRequiredMixin, UpdateView):
+class ReservationUpdateView(LoginRequiredMixin, TableAssignMixin, UpdateView):
     """予約編集"""
     model = Reservation
     form_class = ReservationForm
@@ -81,15 +133,10 @@ class ReservationUpdateView(LoginRequiredMixin, UpdateView):
         """フォームに店舗情報を渡す"""
         kwargs = super().get_form_kwargs()
         kwargs['restaurant'] = self.object.restaurant
+        kwargs['user'] = self.request.user
         return kwargs
     
-    def form_valid(self, form):
-        # フォームのバリデーションで割り当てられた席を設定
-        if hasattr(form, 'assigned_table') and form.assigned_table:
-            form.instance.table = form.assigned_table
-        
-        messages.success(self.request, '予約を更新しました。')
-        return super().form_valid(form)
+    success_message = '予約を更新しました。'
 
 
 
@@ -104,3 +151,199 @@ class ReservationCancelView(LoginRequiredMixin, View):
             reservation.save()
             messages.success(request, '予約をキャンセルしました。')
         return redirect('reservations:reservation_list')
+
+
+def _int_param(request, name, default, low, high):
+    try:
+        value = int(request.GET.get(name) or default)
+    except ValueError:
+        value = default
+    return min(max(value, low), high)
+
+
+def availability_api(request, restaurant_pk):
+    """
+    空席カレンダーAPI: 今日から days 日分、15分枠ごとに party_size 名で座れる空席があるか
+    ?days=30&party_size=4
+    """
+    restaurant = get_object_or_404(Restaurant, pk=restaurant_pk)
+    days = _int_param(request, 'days', DEFAULT_DAYS, 1, MAX_DAYS)
+    party_size = _int_param(request, 'party_size', 1, 1, 20)
+
+    now = timezone.localtime()
+    calendar = get_calendar(restaurant, now.date(), days, party_size)
+    return JsonResponse({
+        'restaurant': restaurant.pk,
+        'party_size': party_size,
+        'days': [
+            {
+                'date': day.isoformat(),
+                'slots': [
+                    {
+                        'time': t.strftime('%H:%M'),
+                        # 今日の過ぎた時刻は予約できない（キャッシュには入れず、返すときに判定する）
+                        'available': available and (day > now.date() or t > now.time()),
+                    }
+                    for t, available in slots
+                ],
+            }
+            for day, slots in calendar
+        ],
+    })
+
+
+def branch_availability_api(request, restaurant_pk):
+    """
+    系列店の空席API: 同じ会社の店舗のうち、指定の日時・人数で空席がある店舗（近い候補から順）
+    ?date=2025-12-24&time=19:00&party_size=4（&category=<カテゴリID>&city=名古屋市&limit=10）
+    """
+    restaurant = get_object_or_404(Restaurant, pk=restaurant_pk)
+    params = parse_search_params(request.GET)
+    if params is None:
+        return JsonResponse({'error': 'date（YYYY-MM-DD）と time（HH:MM）を指定してください。'}, status=400)
+    reservation_date, reservation_time, party_size = params
+    category = _int_param(request, 'category', 0, 0, 2 ** 31 - 1) or None
+    limit = _int_param(request, 'limit', BRANCH_LIMIT, 1, 50)
+
+    branches = free_branches(
+        restaurant, reservation_date, reservation_time, party_size,
+        category=category, city=request.GET.get('city', '').strip() or None, limit=limit,
+    )
+    query = f'?date={reservation_date.isoformat()}&time={reservation_time.strftime("%H:%M")}&party_size={party_size}'
+    return JsonResponse({
+        'restaurant': restaurant.pk,
+        'date': reservation_date.isoformat(),
+        'time': reservation_time.strftime('%H:%M'),
+        'party_size': party_size,
+        'branches': [
+            {
+                'id': branch.pk,
+                'name': branch.name,
+                'category': branch.category.name,
+                'city': branch.city,
+                'distance_km': branch.distance_km,
+                'rating_avg': branch.rating_avg,
+                'reserve_url': reverse('reservations:reservation_create', args=[branch.pk]) + query,
+            }
+            for branch in branches
+        ],
+    })
+
+
+@require_POST
+def hold_api(request, restaurant_pk):
+    """
+    仮押さえAPI: 空席カレンダーで時間を選んだときに、その席を HOLD_MINUTES 分押さえる
+    POST date=2025-12-24&time=19:00&party_size=4（予約の編集中は &reservation=<予約ID>）
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'ログインしてください。'}, status=403)
+    restaurant = get_object_or_404(Restaurant, pk=restaurant_pk)
+    params = parse_search_params(request.POST)
+    if params is None:
+        return JsonResponse({'error': 'date（YYYY-MM-DD）と time（HH:MM）を指定してください。'}, status=400)
+    reservation_date, reservation_time, party_size = params
+    if restaurant.seating_period(reservation_date, reservation_time)[0] <= timezone.now():
+        return JsonResponse({'error': '過去の日時は予約できません。'}, status=400)
+    # 予約の編集中なら、その予約が使っている枠は空いていることにする
+    editing = None
+    if request.POST.get('reservation', '').isdigit():
+        editing = Reservation.objects.filter(
+            pk=request.POST['reservation'], user=request.user, restaurant=restaurant, status__in=ACTIVE_STATUSES,
+        ).first()
+
+    try:
+        hold = take_hold(request.user, restaurant, reservation_date, reservation_time, party_size, editing)
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    if hold is None:
+        return JsonResponse({'error': 'この時間はほかのお客様が選択中か、満席になりました。'}, status=409)
+    return JsonResponse({
+        'hold': hold.pk,
+        'expires_at': hold.expires_at.isoformat(),
+        'minutes': HOLD_MINUTES,
+    })
+
+
+class OwnerReservationMixin(LoginRequiredMixin, OwnerRequiredMixin):
+    """
+    オーナー向け: 自社（user.company）の店舗の予約を絞り込みフォームの条件で絞る。
+    日付の指定がなければ今日以降（「今日の予約」がすぐ開けるように）。
+    店舗・日付で絞って日時順に並べるので reservation_rest_date_idx / reservation_rest_status_idx が使える。
+    """
+    ordering = ['reservation_date', 'reservation_time', 'id']
+
+    def get_filter_form(self):
+        company = getattr(self.request.user, 'company', None)
+        restaurants = Restaurant.objects.filter(company=company).order_by('name') if company else Restaurant.objects.none()
+        data = self.request.GET.copy()
+        data.setdefault('date_from', timezone.localdate().isoformat())
+        return OwnerReservationFilterForm(data, restaurants=restaurants)
+
+    def get_filtered_queryset(self, form):
+        # 店舗の JOIN ではなく ID のリストで絞る（インデックスの先頭の restaurant_id で引けるように）
+        restaurant_ids = list(form.fields['restaurant'].queryset.values_list('pk', flat=True))
+        return form.filter(Reservation.objects.filter(restaurant_id__in=restaurant_ids))
+
+
+class OwnerReservationListView(OwnerReservationMixin, ListView):
+    """オーナーの予約一覧（カーソルでページ送り。何ページ目でも OFFSET / COUNT(*) は使わない）"""
+    template_name = 'reservations/owner_reservation_list.html'
+    context_object_name = 'reservations'
+    paginate_by = 50
+
+    def get_queryset(self):
+        self.filter_form = self.get_filter_form()
+        return self.get_filtered_queryset(self.filter_form).select_related('restaurant', 'user', 'table')
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.ordering, page_size)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['filter_form'] = self.filter_form
+        return ctx
+
+
+class _Echo:
+    """csv.writer の書き込み先（書いた1行をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+class OwnerReservationCSVView(OwnerReservationMixin, View):
+    """
+    予約一覧の CSV（一覧と同じ絞り込み）。
+    何十万件でもメモリに載せないように、iterator で少しずつ読みながらストリーミングで返す。
+    """
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        form = self.get_filter_form()
+        rows = (self.get_filtered_queryset(form)
+                .order_by(*self.ordering)
+                .values_list('id', 'restaurant__name', 'reservation_date', 'reservation_time', 'party_size',
+                             'status', 'user__name', 'user__email', 'notes', 'created_at'))
+        status_labels = dict(Reservation.STATUS_CHOICES)
+        writer = csv.writer(_Echo())
+
+        def lines():
+            # UTF-8 BOMを追加（Excelで正しく開くため）
+            yield '\ufeff'
+            yield writer.writerow(['ID', '店舗名', '予約日', '予約時刻', '人数', 'ステータス', '予約者', 'メールアドレス', '備考', '受付日時'])
+            for pk, name, day, at, party, status, user_name, email, notes, created_at in rows.iterator(chunk_size=self.chunk_size):
+                yield writer.writerow([
+                    pk, name, day.isoformat(), at.strftime('%H:%M'), party, status_labels.get(status, status),
+                    user_name, email, notes, timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M'),
+                ])
+
+        response = StreamingHttpResponse(lines(), content_type='text/csv; charset=utf-8')
+        filename_ascii = "reservation_list.csv"
+        filename_utf8 = "予約一覧.csv"
+        response['Content-Disposition'] = 'attachment; filename="{}"; filename*=UTF-8\'\'{}'.format(
+            filename_ascii, urllib.parse.quote(filename_utf8)
+        )
+        return response
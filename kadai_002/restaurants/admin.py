@@ -49,7 +49,7 @@ class RestaurantAdmin(admin.ModelAdmin):
             'fields': ('price_min', 'price_max', 'open_time', 'close_time', 'holiday')
         }),
         ('住所', {
-            'fields': ('zipcode', 'address', 'tel')
+            'fields': ('zipcode', 'address', 'tel', 'latitude', 'longitude')
         }),
         ('その他', {
             'fields': ('created_at', 'updated_at'),
@@ -74,7 +74,8 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 @admin.register(Table)
 class TableAdmin(admin.ModelAdmin):
-    list_display = ('id', 'restaurant', 'capacity', 'created_at')
+    list_display = ('id', 'restaurant', 'capacity', 'join_group', 'created_at')
+    list_editable = ('join_group',)
     list_filter = ('capacity', 'restaurant')
     search_fields = ('restaurant__name',)
     readonly_fields = ('created_at', 'updated_at')
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class RestaurantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restaurants'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # 全文検索インデックスのトリガーはテーブルの再作成の邪魔になるので、migrate の間だけ外す
+        pre_migrate.connect(signals.drop_search_triggers, sender=self)
+        post_migrate.connect(signals.create_search_triggers, sender=self)
@@ -0,0 +1,75 @@
+"""
+店舗ごとの席の集計（テーブル数・席数の合計・一番大きいテーブル・定員ごとのテーブル数・予約できる最大人数）
+
+予約フォーム・空席カレンダー・空席検索で、座れるはずのない人数（テーブルがない店舗や
+一番大きい席より多い人数）を Table / Reservation を見に行かずに断れるように Restaurant に持たせておく。
+Table の追加・変更・削除のたびに signals.py から refresh を呼んで、その店舗の分だけ数え直す
+（1店舗のテーブルは多くても数十なので、差分ではなく毎回数え直す）。
+bulk_create などシグナルが飛ばない書き込みの後は refresh を直接呼ぶか、
+recount_restaurant_stats コマンドで作り直す。
+"""
+from .models import Restaurant, Table
+
+
+CAPACITY_FIELDS = ['table_count', 'total_seats', 'max_table_capacity', 'max_party_size', 'capacity_counts']
+
+
+def summarize(tables):
+    """
+    tables: [(定員, 結合グループ), ...]
+    予約できる最大人数は、1卓の定員と、同じ結合グループのテーブルの定員の合計のうち大きい方
+    """
+    counts = {}
+    groups = {}
+    for capacity, join_group in tables:
+        counts[capacity] = counts.get(capacity, 0) + 1
+        if join_group:
+            groups[join_group] = groups.get(join_group, 0) + capacity
+    max_table = max(counts, default=0)
+    return {
+        'table_count': sum(counts.values()),
+        'total_seats': sum(capacity * n for capacity, n in counts.items()),
+        'max_table_capacity': max_table,
+        'max_party_size': max([max_table, *groups.values()]),
+        # JSON のキーは文字列になるので最初から文字列にしておく（比べるときにずれないように）
+        'capacity_counts': {str(capacity): counts[capacity] for capacity in sorted(counts)},
+    }
+
+
+def refresh(restaurant_id):
+    """1店舗分を数え直して保存する（Restaurant の保存シグナルは飛ばさない）"""
+    tables = Table.objects.filter(restaurant_id=restaurant_id).values_list('capacity', 'join_group')
+    Restaurant.objects.filter(pk=restaurant_id).update(**summarize(tables))
+
+
+def recount(batch_size=1000, dry_run=False):
+    """全店舗の席の集計を作り直す。ずれていた店舗の数を返す"""
+    fixed = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Restaurant.objects.filter(pk__gt=last_id).order_by('pk')
+            .only('pk', *CAPACITY_FIELDS)[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].pk
+
+        tables = {}
+        rows = Table.objects.filter(restaurant__in=batch).values_list('restaurant_id', 'capacity', 'join_group')
+        for restaurant_id, capacity, join_group in rows:
+            tables.setdefault(restaurant_id, []).append((capacity, join_group))
+
+        drifted = []
+        for restaurant in batch:
+            summary = summarize(tables.get(restaurant.pk, []))
+            if all(getattr(restaurant, field) == value for field, value in summary.items()):
+                continue
+            for field, value in summary.items():
+                setattr(restaurant, field, value)
+            drifted.append(restaurant)
+
+        if drifted and not dry_run:
+            Restaurant.objects.bulk_update(drifted, CAPACITY_FIELDS)
+        fixed += len(drifted)
+    return fixed
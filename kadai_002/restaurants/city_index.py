@@ -0,0 +1,104 @@
+"""
+都道府県 → 市区町村リストのインデックス（/api/cities/ 用）
+
+プロセス内のメモリに {都道府県: [市区町村, ...]} を持っておき、
+API はそこから返すだけにする。店舗の保存・削除時に invalidate() でバージョン（index_versions.py、DB に持つ）
+を進め、どのプロセスも次のアクセスで作り直す。
+settings.CITY_INDEX_FILE にデプロイ時に書き出した JSON があれば、起動直後はそれを読む
+（export_city_index コマンド）。ファイルには書き出したときのバージョンを入れておき、
+今のバージョンと同じとき（書き出した後に店舗が変わっていないとき）だけ使う。
+"""
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+
+from . import index_versions
+from .models import Restaurant
+
+
+VERSION_NAME = 'city_index'
+
+_lock = threading.Lock()
+_state = {
+    'cities': None,     # {都道府県: [市区町村, ...]}
+    'etags': {},        # {都道府県: ETag}
+    'version': None,    # 作ったときのバージョン
+}
+
+
+def build_from_db():
+    """DB から作る（都道府県ごとに重複なし・昇順）"""
+    cities = {}
+    rows = (Restaurant.objects
+            .exclude(city='')
+            .values_list('prefecture', 'city')
+            .distinct()
+            .order_by('prefecture', 'city'))
+    for prefecture, city in rows:
+        cities.setdefault(prefecture, []).append(city)
+    return cities
+
+
+def _load_file(version):
+    """書き出したファイルの内容。ないとき・古いとき（バージョンが違うとき）は None"""
+    path = getattr(settings, 'CITY_INDEX_FILE', None)
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or data.get('version') != version:
+        return None
+    return data.get('cities')
+
+
+def _etag(cities):
+    raw = json.dumps(cities, ensure_ascii=False)
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+def get_city_map():
+    version = index_versions.get(VERSION_NAME)
+    if _state['cities'] is not None and _state['version'] == version:
+        return _state['cities']
+
+    with _lock:
+        if _state['cities'] is None or _state['version'] != version:
+            # 書き出した後に店舗が変わっていなければデプロイ時の JSON を使う
+            cities = _load_file(version)
+            if cities is None:
+                cities = build_from_db()
+            _state['cities'] = cities
+            _state['etags'] = {pref: _etag(values) for pref, values in cities.items()}
+            _state['version'] = version
+    return _state['cities']
+
+
+def get_cities(prefecture):
+    return get_city_map().get(prefecture, [])
+
+
+def get_etag(prefecture):
+    get_city_map()
+    return _state['etags'].get(prefecture, _etag([]))
+
+
+def invalidate():
+    """店舗が変わったら呼ぶ。どのプロセスも次のアクセスで作り直す"""
+    _state['cities'] = None
+    index_versions.bump(VERSION_NAME)
+
+
+def export(path):
+    """
+    DB から作った内容を今のバージョンと一緒に JSON に書き出す。書き出した都道府県の数を返す。
+    バージョンを先に読むので、作っている間に店舗が変わってもファイルが新しいと思われることはない。
+    """
+    version = index_versions.get(VERSION_NAME)
+    cities = build_from_db()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'cities': cities}, f, ensure_ascii=False)
+    return len(cities)
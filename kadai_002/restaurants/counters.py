@@ -0,0 +1,99 @@
+"""
+Restaurant に持たせている集計値（お気に入り数・レビュー数・評価）の更新
+
+一覧や詳細で毎回 COUNT / AVG を取らないように、Favorite / Review の
+追加・削除のたびに F 式で差分だけ足し引きする（signals.py から呼ばれる）。
+ずれた場合は recount_restaurant_stats コマンドで作り直す。
+"""
+from django.db import transaction
+from django.db.models import Avg, Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Favorite, Restaurant
+
+
+def _rating_avg_expression():
+    return Case(
+        When(review_count=0, then=Value(0.0)),
+        default=Cast(F('rating_sum'), FloatField()) / F('review_count'),
+        output_field=FloatField(),
+    )
+
+
+def adjust_favorite_count(restaurant_id, delta):
+    Restaurant.objects.filter(pk=restaurant_id).update(
+        favorite_count=F('favorite_count') + delta
+    )
+
+
+def adjust_review_stats(restaurant_id, count_delta, rating_delta):
+    """レビュー数と評価の合計を足し引きして、平均を付け直す"""
+    with transaction.atomic():
+        qs = Restaurant.objects.filter(pk=restaurant_id)
+        qs.update(
+            review_count=F('review_count') + count_delta,
+            rating_sum=F('rating_sum') + rating_delta,
+        )
+        qs.update(rating_avg=_rating_avg_expression())
+
+
+def compute_stats(restaurant_ids):
+    """店舗ごとの正しい集計値を {id: (favorite_count, review_count, rating_sum, rating_avg)} で返す"""
+    from reviews.models import Review
+
+    favorites = dict(
+        Favorite.objects.filter(restaurant_id__in=restaurant_ids)
+        .values('restaurant_id').annotate(n=Count('id'))
+        .values_list('restaurant_id', 'n')
+    )
+    reviews = {
+        row['restaurant_id']: row
+        for row in Review.objects.filter(restaurant_id__in=restaurant_ids)
+        .values('restaurant_id').annotate(n=Count('id'), total=Sum('rating'), avg=Avg('rating'))
+    }
+
+    stats = {}
+    for pk in restaurant_ids:
+        review = reviews.get(pk, {})
+        stats[pk] = (
+            favorites.get(pk, 0),
+            review.get('n', 0),
+            review.get('total') or 0,
+            float(review.get('avg') or 0),
+        )
+    return stats
+
+
+STAT_FIELDS = ['favorite_count', 'review_count', 'rating_sum', 'rating_avg']
+
+
+def recount(batch_size=1000, dry_run=False):
+    """
+    全店舗の集計値を作り直す。ずれていた店舗の数を返す。
+    batch_size 件ずつ集計して、値が違う店舗だけ bulk_update する。
+    """
+    fixed = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Restaurant.objects.filter(pk__gt=last_id).order_by('pk')
+            .only('pk', *STAT_FIELDS)[:batch_size]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].pk
+
+        stats = compute_stats([r.pk for r in batch])
+        drifted = []
+        for restaurant in batch:
+            current = tuple(getattr(restaurant, f) for f in STAT_FIELDS)
+            if current == stats[restaurant.pk]:
+                continue
+            for field, value in zip(STAT_FIELDS, stats[restaurant.pk]):
+                setattr(restaurant, field, value)
+            drifted.append(restaurant)
+
+        if drifted and not dry_run:
+            Restaurant.objects.bulk_update(drifted, STAT_FIELDS)
+        fixed += len(drifted)
+    return fixed
@@ -0,0 +1,94 @@
+"""
+店舗検索の件数集計（ファセット）
+
+絞り込み後の結果に対して、カテゴリ・都道府県・市区町村・価格帯ごとの件数を
+GROUP BY 1回で数える。値ごとに COUNT を投げることはしない。
+結果は検索結果キャッシュ（search_cache.py）と同じバージョンでキャッシュする。
+"""
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from . import search_cache
+
+
+# 価格帯（price_min で判定）: (キー, 表示名, 下限, 上限)
+PRICE_BUCKETS = [
+    ('0-1000', '〜¥1,000', None, 1000),
+    ('1000-3000', '¥1,000〜¥3,000', 1000, 3000),
+    ('3000-5000', '¥3,000〜¥5,000', 3000, 5000),
+    ('5000-10000', '¥5,000〜¥10,000', 5000, 10000),
+    ('10000-', '¥10,000〜', 10000, None),
+]
+
+
+def price_filter(key):
+    """?price=1000-3000 のようなキーを Q にする。知らないキーなら None"""
+    for bucket_key, _, low, high in PRICE_BUCKETS:
+        if bucket_key != key:
+            continue
+        q = Q()
+        if low is not None:
+            q &= Q(price_min__gte=low)
+        if high is not None:
+            q &= Q(price_min__lt=high)
+        return q
+    return None
+
+
+def _price_bucket_expression():
+    whens = []
+    for key, _, low, high in PRICE_BUCKETS:
+        condition = Q()
+        if low is not None:
+            condition &= Q(price_min__gte=low)
+        if high is not None:
+            condition &= Q(price_min__lt=high)
+        whens.append(When(condition, then=Value(key)))
+    return Case(*whens, default=Value(''), output_field=CharField())
+
+
+def compute_facets(queryset):
+    """
+    1回の GROUP BY（カテゴリ × 都道府県 × 市区町村 × 価格帯）で数えて、
+    Python 側で軸ごとに足し合わせる。
+    """
+    rows = (queryset
+            .order_by()
+            .annotate(price_bucket=_price_bucket_expression())
+            .values('category__name', 'prefecture', 'city', 'price_bucket')
+            .annotate(n=Count('id')))
+
+    categories, prefectures, cities, prices = {}, {}, {}, {}
+    for row in rows:
+        n = row['n']
+        categories[row['category__name']] = categories.get(row['category__name'], 0) + n
+        prefectures[row['prefecture']] = prefectures.get(row['prefecture'], 0) + n
+        if row['city']:
+            cities[row['city']] = cities.get(row['city'], 0) + n
+        prices[row['price_bucket']] = prices.get(row['price_bucket'], 0) + n
+
+    def by_count(counts):
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    return {
+        'category': by_count(categories),
+        'prefecture': by_count(prefectures),
+        'city': by_count(cities),
+        'price': [
+            (key, label, prices[key])
+            for key, label, _, _ in PRICE_BUCKETS if prices.get(key)
+        ],
+    }
+
+
+def get_facets(params, queryset):
+    """検索条件ごとにキャッシュした件数集計を返す"""
+    if queryset.query.is_empty():
+        return None
+
+    key = search_cache.make_key(params, ['facets'])
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, search_cache.CACHE_TIMEOUT)
+    return facets
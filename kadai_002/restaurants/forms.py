@@ -50,8 +50,9 @@ class OwnerRestaurantForm(forms.ModelForm):
         fields = [
             "name", "category", "image", "description",
             "price_min", "price_max",
-            "open_time", "close_time", "holiday",
+            "open_time", "close_time", "seating_minutes", "holiday",
             "zipcode", "address", "tel",
+            "latitude", "longitude",
         ]
         # ▼▼▼ ここでデザイン（Bootstrap）を当てる ▼▼▼
         widgets = {
@@ -63,10 +64,13 @@ class OwnerRestaurantForm(forms.ModelForm):
             "price_max": forms.NumberInput(attrs={'class': 'form-control', 'step': '100'}),
             "open_time": forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}),
             "close_time": forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}),
+            "seating_minutes": forms.NumberInput(attrs={'class': 'form-control', 'step': '15'}),
             "holiday": forms.TextInput(attrs={'class': 'form-control', 'placeholder': '例: 月曜日'}),
             "zipcode": forms.TextInput(attrs={'class': 'form-control', 'placeholder': '123-4567'}),
             "address": forms.TextInput(attrs={'class': 'form-control'}),
             "tel": forms.TextInput(attrs={'class': 'form-control'}),
+            "latitude": forms.NumberInput(attrs={'class': 'form-control', 'step': 'any', 'placeholder': '例: 35.170915'}),
+            "longitude": forms.NumberInput(attrs={'class': 'form-control', 'step': 'any', 'placeholder': '例: 136.881537'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,32 @@
+"""
+FTS5 の仮想テーブルを ORM から JOIN して使うための部品（models.RestaurantSearchIndex などと search.py 用）
+
+FTS5 のテーブルにはテーブルと同じ名前の隠しカラムがあり、MATCH や bm25() にはそれを渡す。
+JOIN したときの別名（T3 など）は Django が決めるので、SQL に直接書かず Col から組み立てる。
+"""
+from django.db import models
+from django.db.models import FloatField, Func, Lookup, Value
+
+
+class MatchField(models.TextField):
+    """FTS5 の隠しカラム（db_column にテーブル名を指定する）"""
+
+
+@MatchField.register_lookup
+class Match(Lookup):
+    """document__match='"すし"' → "別名"."テーブル名" MATCH %s"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class Bm25(Func):
+    """bm25(隠しカラム, 重み...)。同じ別名に MATCH の条件があるクエリでだけ使える（値が小さいほど関連が高い）"""
+    function = 'bm25'
+    output_field = FloatField()
+
+    def __init__(self, document, weights=()):
+        super().__init__(document, *[Value(float(weight)) for weight in weights])
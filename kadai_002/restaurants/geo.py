@@ -0,0 +1,163 @@
+"""
+現在地からの距離検索
+
+Restaurant.geohash（緯度経度を geohash にした文字列、インデックス付き）で
+半径を覆うセルだけに範囲検索で絞り込み、残った候補だけ
+haversine で正確な距離を計算して近い順に並べる。
+"""
+import math
+
+from django.db.models import Q
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Restaurant.geohash に保存する桁数（約 1.2m 四方）
+GEOHASH_PRECISION = 9
+
+# 半径を覆うセルの数の上限（これ以下で一番細かい桁数を選ぶ）
+MAX_CELLS = 16
+
+DEFAULT_RADIUS_KM = 3
+MAX_RADIUS_KM = 50
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """precision 桁のセルの (緯度方向, 経度方向) の大きさ（度）"""
+    bits = precision * 5
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(最小緯度, 最大緯度, 最小経度, 最大経度)"""
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    d_lng = min(math.degrees(radius_km / EARTH_RADIUS_KM / cos_lat), 180.0)
+    return (
+        max(latitude - d_lat, -90.0), min(latitude + d_lat, 90.0),
+        max(longitude - d_lng, -180.0), min(longitude + d_lng, 180.0),
+    )
+
+
+def _cells(box, precision):
+    min_lat, max_lat, min_lng, max_lng = box
+    cell_lat, cell_lng = cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lng = min_lng
+        while True:
+            cells.add(encode(lat, lng, precision))
+            if lng >= max_lng:
+                break
+            lng = min(lng + cell_lng, max_lng)
+        if lat >= max_lat:
+            break
+        lat = min(lat + cell_lat, max_lat)
+    return cells
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """半径の外接矩形を覆う geohash セル（MAX_CELLS 個以下になる一番細かい桁数）"""
+    box = bounding_box(latitude, longitude, radius_km)
+    best = {''}
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        cell_lat, cell_lng = cell_size(precision)
+        estimate = ((box[1] - box[0]) / cell_lat + 2) * ((box[3] - box[2]) / cell_lng + 2)
+        if estimate > MAX_CELLS * 4:
+            break
+        cells = _cells(box, precision)
+        if len(cells) > MAX_CELLS:
+            break
+        best = cells
+    return best
+
+
+def nearby_filter(latitude, longitude, radius_km):
+    """
+    おおまかな絞り込み用の Q。geohash のインデックスを範囲検索で使い、
+    外接矩形でさらに削る（正確な距離は distance_keys で計算する）。
+    """
+    q = Q()
+    for cell in covering_cells(latitude, longitude, radius_km):
+        if cell:
+            # 'z' の次の文字 '{' までの範囲 = そのセルで始まる geohash
+            q |= Q(geohash__gte=cell, geohash__lt=cell + '{')
+    min_lat, max_lat, min_lng, max_lng = bounding_box(latitude, longitude, radius_km)
+    return q & Q(
+        latitude__gte=min_lat, latitude__lte=max_lat,
+        longitude__gte=min_lng, longitude__lte=max_lng,
+    )
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def distance_keys(queryset, latitude, longitude, radius_km, limit=None):
+    """
+    候補の緯度経度だけを取って距離を計算し、
+    半径内の店舗を近い順に [距離(km), id] のリストで返す。
+    """
+    keys = []
+    for pk, lat, lng in queryset.order_by().values_list('id', 'latitude', 'longitude'):
+        distance = haversine_km(latitude, longitude, lat, lng)
+        if distance <= radius_km:
+            keys.append([round(distance, 3), pk])
+    keys.sort()
+    return keys[:limit] if limit else keys
+
+
+def parse_location(params):
+    """?lat=..&lng=..&radius=.. を (緯度, 経度, 半径km) にする。不正なら None"""
+    try:
+        latitude = float(params.get('lat', ''))
+        longitude = float(params.get('lng', ''))
+    except ValueError:
+        return None
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    try:
+        radius = float(params.get('radius') or DEFAULT_RADIUS_KM)
+    except ValueError:
+        radius = DEFAULT_RADIUS_KM
+    if not math.isfinite(radius):
+        # nan は min/max の比較をすり抜けて covering_cells が終わらなくなる
+        return None
+    radius = min(max(radius, 0.1), MAX_RADIUS_KM)
+    return latitude, longitude, radius
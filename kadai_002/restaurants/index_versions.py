@@ -0,0 +1,41 @@
+"""
+プロセスのメモリに持つインデックス（city_index / suggest_index）やキャッシュ（search_cache / 空席カレンダー）のバージョン
+
+インデックスを変えたプロセスが bump() で1つ進め、ほかのプロセスは get() の値が
+自分の作ったときの値と違えば作り直す（キャッシュはキーにバージョンを入れて古いものを使わない）。値は DB（IndexVersion）に持つので、
+LocMemCache のようにプロセスごとに別の値になったり、再起動で 0 に戻ったりしない。
+
+API のたびに DB を読まないように、読んだ値は CHECK_SECONDS 秒だけプロセス内で使い回す
+（ほかのプロセスの変更が見えるまで最大 CHECK_SECONDS 秒かかる）。
+"""
+import time
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import IndexVersion
+
+
+CHECK_SECONDS = 2
+
+_checked = {}  # {名前: (読んだ時刻, バージョン)}
+
+
+def get(name):
+    now = time.monotonic()
+    checked = _checked.get(name)
+    if checked is not None and now - checked[0] < CHECK_SECONDS:
+        return checked[1]
+    version = IndexVersion.objects.filter(name=name).values_list('version', flat=True).first() or 0
+    _checked[name] = (now, version)
+    return version
+
+
+def bump(name):
+    """1つ進めて新しいバージョンを返す"""
+    with transaction.atomic():
+        IndexVersion.objects.get_or_create(name=name)
+        IndexVersion.objects.filter(name=name).update(version=F('version') + 1)
+        version = IndexVersion.objects.filter(name=name).values_list('version', flat=True).get()
+    _checked[name] = (time.monotonic(), version)
+    return version
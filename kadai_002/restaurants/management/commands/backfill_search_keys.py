@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from restaurants.search import refresh_search_keys
+
+
+class Command(BaseCommand):
+    help = '店舗・カテゴリの検索用キー（正規化した文字列）を作り直し、全文検索インデックスも作り直します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='1回に処理する件数（デフォルト: 1000）',
+        )
+
+    def handle(self, *args, **options):
+        restaurants, categories = refresh_search_keys(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: 店舗 {restaurants}件・カテゴリ {categories}件の検索用キーを更新しました。')
+        )
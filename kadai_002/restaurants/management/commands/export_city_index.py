@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from restaurants import city_index
+
+
+class Command(BaseCommand):
+    help = '都道府県ごとの市区町村リストを JSON ファイルに書き出します（デプロイ時に実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.CITY_INDEX_FILE,
+            help='出力先のパス（デフォルト: settings.CITY_INDEX_FILE）',
+        )
+
+    def handle(self, *args, **options):
+        count = city_index.export(options['output'])
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {count}都道府県分の市区町村を {options["output"]} に書き出しました。')
+        )
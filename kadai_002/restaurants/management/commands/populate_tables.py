@@ -1,5 +1,6 @@
 import random
 from django.core.management.base import BaseCommand
+from restaurants import capacity
 from restaurants.models import Restaurant, Table
 
 
@@ -69,8 +70,9 @@ class Command(BaseCommand):
                     Table(restaurant=restaurant, capacity=8)
                 )
             
-            # 一括作成
+            # 一括作成（シグナルが飛ばないので席の集計は自分で更新する）
             Table.objects.bulk_create(tables_to_create)
+            capacity.refresh(restaurant.pk)
             
             total_created = len(tables_to_create)
             total_tables_created += total_created
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from restaurants import search
+
+
+class Command(BaseCommand):
+    help = '店舗検索用の全文検索インデックス（FTS5）を全件作り直します'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(
+                self.style.WARNING('このデータベースでは全文検索インデックスを使用しません。')
+            )
+            return
+
+        count = search.rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {count}件の店舗を検索インデックスに登録しました。')
+        )
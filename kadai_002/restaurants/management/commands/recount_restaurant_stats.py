@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from restaurants import capacity
+from restaurants.counters import recount
+
+
+class Command(BaseCommand):
+    help = '店舗のお気に入り数・レビュー数・平均評価・席の集計を集計し直し、ずれていれば修正します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='1回に集計する店舗数（デフォルト: 1000）',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='修正はせず、ずれている店舗の数だけ表示する',
+        )
+
+    def handle(self, *args, **options):
+        fixed = recount(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        fixed += capacity.recount(batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(f'集計値がずれている店舗: {fixed}件（dry-run のため未修正）')
+            )
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f'完了: {fixed}件の店舗の集計値を修正しました。')
+        )
@@ -0,0 +1,90 @@
+from django.db import migrations
+
+
+# 店舗検索用の全文検索インデックス（SQLite FTS5 + trigram）
+# rowid = restaurants_restaurant.id として 1店舗1行で持つ。
+# 同期はトリガーで行うので bulk_create / update() でもずれない。
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_restaurant_fts USING fts5(
+        name, description, category_name, prefecture, city,
+        tokenize = 'trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS restaurants_restaurant_fts_ai
+    AFTER INSERT ON restaurants_restaurant BEGIN
+        INSERT INTO restaurants_restaurant_fts(rowid, name, description, category_name, prefecture, city)
+        VALUES (
+            new.id, new.name, new.description,
+            (SELECT name FROM restaurants_category WHERE id = new.category_id),
+            new.prefecture, new.city
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS restaurants_restaurant_fts_au
+    AFTER UPDATE ON restaurants_restaurant BEGIN
+        DELETE FROM restaurants_restaurant_fts WHERE rowid = old.id;
+        INSERT INTO restaurants_restaurant_fts(rowid, name, description, category_name, prefecture, city)
+        VALUES (
+            new.id, new.name, new.description,
+            (SELECT name FROM restaurants_category WHERE id = new.category_id),
+            new.prefecture, new.city
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS restaurants_restaurant_fts_ad
+    AFTER DELETE ON restaurants_restaurant BEGIN
+        DELETE FROM restaurants_restaurant_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS restaurants_category_fts_au
+    AFTER UPDATE OF name ON restaurants_category BEGIN
+        UPDATE restaurants_restaurant_fts SET category_name = new.name
+        WHERE rowid IN (SELECT id FROM restaurants_restaurant WHERE category_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO restaurants_restaurant_fts(rowid, name, description, category_name, prefecture, city)
+    SELECT r.id, r.name, r.description, c.name, r.prefecture, r.city
+    FROM restaurants_restaurant r
+    LEFT JOIN restaurants_category c ON c.id = r.category_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS restaurants_category_fts_au",
+    "DROP TRIGGER IF EXISTS restaurants_restaurant_fts_ad",
+    "DROP TRIGGER IF EXISTS restaurants_restaurant_fts_au",
+    "DROP TRIGGER IF EXISTS restaurants_restaurant_fts_ai",
+    "DROP TABLE IF EXISTS restaurants_restaurant_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 は SQLite 専用。他のDBでは検索側が icontains にフォールバックする
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0004_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
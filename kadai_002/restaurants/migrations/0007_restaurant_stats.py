@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def drop_search_triggers(apps, schema_editor):
+    # 0005 のトリガーがあると SQLite のテーブル再作成（AddField など）が失敗するため消しておく
+    # （今のトリガーは search.create_triggers で migrate の後に作り直している）
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in [
+        'restaurants_category_fts_au',
+        'restaurants_restaurant_fts_ad',
+        'restaurants_restaurant_fts_au',
+        'restaurants_restaurant_fts_ai',
+    ]:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def fill_stats(apps, schema_editor):
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    Favorite = apps.get_model('restaurants', 'Favorite')
+    Review = apps.get_model('reviews', 'Review')
+
+    def aggregate(model, expression):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(restaurant=OuterRef('pk'))
+                .values('restaurant').annotate(v=expression).values('v')[:1]
+            ),
+            Value(0),
+        )
+
+    Restaurant.objects.update(
+        favorite_count=aggregate(Favorite, Count('id')),
+        review_count=aggregate(Review, Count('id')),
+        rating_sum=aggregate(Review, Sum('rating')),
+    )
+    for restaurant in Restaurant.objects.filter(review_count__gt=0):
+        restaurant.rating_avg = restaurant.rating_sum / restaurant.review_count
+        restaurant.save(update_fields=['rating_avg'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0006_restaurant_sort_indexes'),
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='restaurant',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='お気に入り数'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='平均評価'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='評価の合計'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='レビュー数'),
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:44
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+# 以下はこのマイグレーションを書いた時点の text.py と search.rebuild_index のコピー
+# （あとで正規化のルールやインデックスの列を変えても、このマイグレーションの結果は変わらないように）
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+_KATAKANA_TO_HIRAGANA.update({0x30FD: 0x309D, 0x30FE: 0x309E})
+
+SEARCH_KEY_FIELDS = ('name', 'description', 'prefecture', 'city')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    text = text.translate(_KATAKANA_TO_HIRAGANA).lower()
+    return ' '.join(text.split())
+
+
+def make_search_key(values):
+    return '\n'.join(normalize(value) for value in values)
+
+
+def rebuild_index(schema_editor, Restaurant):
+    rows = []
+    for pk, search_key, category_key in Restaurant.objects.values_list('pk', 'search_key', 'category__search_key'):
+        name, description, prefecture, city = (search_key.split('\n') + [''] * 4)[:4]
+        rows.append((pk, name, description, category_key or '', prefecture, city))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DELETE FROM restaurants_restaurant_fts')
+        cursor.executemany(
+            'INSERT INTO restaurants_restaurant_fts(rowid, name, description, category_name, prefecture, city) '
+            'VALUES (%s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def fill_search_keys(apps, schema_editor):
+    Category = apps.get_model('restaurants', 'Category')
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+
+    categories = list(Category.objects.only('pk', 'name'))
+    for category in categories:
+        category.search_key = normalize(category.name)
+    Category.objects.bulk_update(categories, ['search_key'], batch_size=1000)
+
+    restaurants = list(Restaurant.objects.only('pk', *SEARCH_KEY_FIELDS))
+    for restaurant in restaurants:
+        restaurant.search_key = make_search_key(getattr(restaurant, f) for f in SEARCH_KEY_FIELDS)
+    Restaurant.objects.bulk_update(restaurants, ['search_key'], batch_size=1000)
+
+    # 全文検索インデックスも正規化した値で作り直す
+    if schema_editor.connection.vendor == 'sqlite':
+        rebuild_index(schema_editor, Restaurant)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0008_restaurant_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='search_key',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0009_search_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='seating_minutes',
+            field=models.PositiveSmallIntegerField(default=120, help_text='予約1件で席を使う時間。この時間が過ぎるまで同じ席に次の予約は入りません', validators=[django.core.validators.MinValueValidator(15), django.core.validators.MaxValueValidator(360)], verbose_name='1回の利用時間（分）'),
+        ),
+    ]
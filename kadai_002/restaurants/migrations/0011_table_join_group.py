@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0010_restaurant_seating_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='join_group',
+            field=models.CharField(blank=True, help_text='同じグループ名のテーブルはくっつけて大人数の予約に使えます（空欄ならくっつけない）', max_length=20, verbose_name='結合グループ'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:09
+
+from django.db import migrations, models
+
+
+# 以下はこのマイグレーションを書いた時点の capacity.py のコピー
+# （あとで集計のルールを変えても、このマイグレーションの結果は変わらないように）
+CAPACITY_FIELDS = ['table_count', 'total_seats', 'max_table_capacity', 'max_party_size', 'capacity_counts']
+
+
+def summarize(tables):
+    """tables: [(定員, 結合グループ), ...]"""
+    counts = {}
+    groups = {}
+    for capacity, join_group in tables:
+        counts[capacity] = counts.get(capacity, 0) + 1
+        if join_group:
+            groups[join_group] = groups.get(join_group, 0) + capacity
+    max_table = max(counts, default=0)
+    return {
+        'table_count': sum(counts.values()),
+        'total_seats': sum(capacity * n for capacity, n in counts.items()),
+        'max_table_capacity': max_table,
+        'max_party_size': max([max_table, *groups.values()]),
+        'capacity_counts': {str(capacity): counts[capacity] for capacity in sorted(counts)},
+    }
+
+
+def fill_capacity_summary(apps, schema_editor):
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    Table = apps.get_model('restaurants', 'Table')
+    tables = {}
+    for restaurant_id, capacity, join_group in Table.objects.values_list('restaurant_id', 'capacity', 'join_group'):
+        tables.setdefault(restaurant_id, []).append((capacity, join_group))
+    restaurants = list(Restaurant.objects.only('pk'))
+    for restaurant in restaurants:
+        for field, value in summarize(tables.get(restaurant.pk, [])).items():
+            setattr(restaurant, field, value)
+    Restaurant.objects.bulk_update(restaurants, CAPACITY_FIELDS, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0011_table_join_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='capacity_counts',
+            field=models.JSONField(default=dict, editable=False, verbose_name='定員ごとのテーブル数'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='max_party_size',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='一番大きいテーブルの定員か、くっつけられるテーブルの定員の合計の大きい方', verbose_name='予約できる最大人数'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='max_table_capacity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='一番大きいテーブルの定員'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='table_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='テーブル数'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='total_seats',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='席数の合計'),
+        ),
+        migrations.RunPython(fill_capacity_summary, migrations.RunPython.noop),
+    ]
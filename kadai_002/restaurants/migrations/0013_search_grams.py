@@ -0,0 +1,86 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+# 1〜2文字の検索語用の全文検索インデックス（search.GRAM_TABLE）
+# トークンは16進数の英数字だけなので ascii トークナイザで足りる。
+# 1文字の語の前方一致用に、1バイト文字（2桁）と3バイト文字（6桁: ひらがな・漢字など）の prefix インデックスを持つ
+CREATE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_restaurant_grams USING fts5(
+        name, description, category_name, prefecture, city,
+        tokenize = 'ascii', prefix = '2 6'
+    )
+"""
+
+DROP_SQL = "DROP TABLE IF EXISTS restaurants_restaurant_grams"
+
+INSERT_SQL = """
+    INSERT INTO restaurants_restaurant_grams(rowid, name, description, category_name, prefecture, city)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+# 以下はこのマイグレーションを書いた時点の text.make_search_grams（あとで text.py を変えても変わらないようにコピー）
+def make_search_grams(search_key):
+    return '\n'.join(_grams(line) for line in (search_key or '').split('\n'))
+
+
+def _grams(value):
+    tokens = []
+    for word in value.split():
+        tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+        tokens.append(word[-1])
+    return ' '.join(dict.fromkeys(token.encode().hex() for token in tokens))
+
+
+def fill_search_grams(apps, schema_editor):
+    Category = apps.get_model('restaurants', 'Category')
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    for model in (Category, Restaurant):
+        objects = list(model.objects.only('pk', 'search_key'))
+        for obj in objects:
+            obj.search_grams = make_search_grams(obj.search_key)
+        model.objects.bulk_update(objects, ['search_grams'], batch_size=1000)
+
+
+def create_gram_index(apps, schema_editor):
+    # FTS5 は SQLite 専用（0005 と同じ）
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    rows = []
+    for pk, grams, category_grams in Restaurant.objects.values_list('pk', 'search_grams', 'category__search_grams'):
+        name, description, prefecture, city = (grams.split('\n') + [''] * 4)[:4]
+        rows.append((pk, name, description, category_grams or '', prefecture, city))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_SQL)
+        cursor.executemany(INSERT_SQL, rows)
+
+
+def drop_gram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0012_restaurant_capacity_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='search_grams',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='search_grams',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_search_grams, migrations.RunPython.noop),
+        migrations.RunPython(create_gram_index, drop_gram_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:32
+
+import django.db.models.deletion
+import restaurants.fts
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0013_search_grams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantGramIndex',
+            fields=[
+                ('restaurant', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='gram_index', serialize=False, to='restaurants.restaurant')),
+                ('document', restaurants.fts.MatchField(db_column='restaurants_restaurant_grams')),
+            ],
+            options={
+                'db_table': 'restaurants_restaurant_grams',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RestaurantSearchIndex',
+            fields=[
+                ('restaurant', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='restaurants.restaurant')),
+                ('document', restaurants.fts.MatchField(db_column='restaurants_restaurant_fts')),
+            ],
+            options={
+                'db_table': 'restaurants_restaurant_fts',
+                'managed': False,
+            },
+        ),
+    ]
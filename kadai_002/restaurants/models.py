@@ -1,5 +1,13 @@
+from datetime import datetime, timedelta
+
 from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+from .fts import MatchField
+from .geo import encode
+from .text import SEARCH_KEY_FIELDS, make_search_grams, make_search_key, normalize
 
 
 class Company(models.Model):
@@ -34,6 +42,10 @@ class Category(models.Model):
 
     name = models.CharField("カテゴリ名", max_length=50)
     is_active = models.BooleanField("有効フラグ", default=True)
+    # 検索用にカテゴリ名を正規化した値（text.normalize、保存時に自動で入れる）
+    search_key = models.CharField(max_length=100, blank=True, db_index=True, editable=False)
+    # 1〜2文字の検索語用（text.make_search_grams）
+    search_grams = models.TextField(blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -41,6 +53,21 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.search_key = normalize(self.name)
+        self.search_grams = make_search_grams(self.search_key)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'search_key', 'search_grams'}
+        super().save(*args, **kwargs)
+
+# Restaurant の集計値（counters.py / capacity.py が F 式・update() で書く）。save() では書かない
+DERIVED_FIELDS = frozenset([
+    'favorite_count', 'review_count', 'rating_sum', 'rating_avg',
+    'table_count', 'total_seats', 'max_table_capacity', 'max_party_size', 'capacity_counts',
+])
+
+
 class Restaurant(models.Model):
     company = models.ForeignKey(
         Company,
@@ -73,12 +100,125 @@ class Restaurant(models.Model):
     address = models.CharField(max_length=200)
     tel = models.CharField(max_length=20)
     holiday = models.CharField(max_length=50, blank=True)  # 定休日
+
+    # 1回の予約で席を使う時間（予約の終了時刻 = 予約時刻 + これ）
+    seating_minutes = models.PositiveSmallIntegerField(
+        '1回の利用時間（分）', default=120,
+        validators=[MinValueValidator(15), MaxValueValidator(360)],
+        help_text='予約1件で席を使う時間。この時間が過ぎるまで同じ席に次の予約は入りません',
+    )
+
+    # 位置情報（距離検索用）。geohash は保存時に緯度経度から自動で入れる
+    latitude = models.FloatField('緯度', null=True, blank=True)
+    longitude = models.FloatField('経度', null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
+
+    # 検索用に 店舗名・説明・都道府県・市区町村 を正規化して改行でつないだ値（保存時に自動で入れる）
+    # 全文検索インデックス（search.py）はこの値から作る
+    search_key = models.TextField(blank=True, editable=False)
+    # 1〜2文字の検索語用（text.make_search_grams）
+    search_grams = models.TextField(blank=True, editable=False)
+
+    # 集計値（Favorite / Review の追加・削除時に counters.py で更新する）
+    favorite_count = models.PositiveIntegerField('お気に入り数', default=0, editable=False)
+    review_count = models.PositiveIntegerField('レビュー数', default=0, editable=False)
+    rating_sum = models.PositiveIntegerField('評価の合計', default=0, editable=False)
+    rating_avg = models.FloatField('平均評価', default=0, editable=False)
+
+    # 席の集計（Table の追加・変更・削除時に capacity.py で更新する）
+    table_count = models.PositiveIntegerField('テーブル数', default=0, editable=False)
+    total_seats = models.PositiveIntegerField('席数の合計', default=0, editable=False)
+    max_table_capacity = models.PositiveIntegerField('一番大きいテーブルの定員', default=0, editable=False)
+    max_party_size = models.PositiveIntegerField(
+        '予約できる最大人数', default=0, editable=False,
+        help_text='一番大きいテーブルの定員か、くっつけられるテーブルの定員の合計の大きい方',
+    )
+    capacity_counts = models.JSONField('定員ごとのテーブル数', default=dict, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 一覧の並び替え（カーソルページネーション）用
+            models.Index(fields=['price_min', 'id'], name='restaurant_price_min_idx'),
+            models.Index(fields=['-price_max', '-id'], name='restaurant_price_max_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @property
+    def seating_duration(self):
+        return timedelta(minutes=self.seating_minutes)
+
+    def seating_period(self, reservation_date, reservation_time):
+        """その日時に予約したときに席を使う時間帯 (開始, 終了)。終了は日をまたぐこともある"""
+        starts_at = timezone.make_aware(
+            datetime.combine(reservation_date, reservation_time), timezone.get_default_timezone(),
+        )
+        return starts_at, starts_at + self.seating_duration
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        self.search_key = make_search_key(getattr(self, f) for f in SEARCH_KEY_FIELDS)
+        self.search_grams = make_search_grams(self.search_key)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # フォーム・管理画面からの保存で、読み込んだ時点の集計値を書き戻さない
+            update_fields = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in DERIVED_FIELDS
+            ]
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if {'latitude', 'longitude'} & update_fields:
+                update_fields.add('geohash')
+            if set(SEARCH_KEY_FIELDS) & update_fields:
+                update_fields |= {'search_key', 'search_grams'}
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
+
+class RestaurantSearchIndex(models.Model):
+    """
+    全文検索インデックス（FTS5 の restaurants_restaurant_fts、search.py）を JOIN するためのモデル。
+    テーブルは migrations/0005 で作り、トリガーで同期する（Django からは書かない）。
+    """
+    restaurant = models.OneToOneField(
+        Restaurant,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='search_index',
+    )
+    document = MatchField(db_column='restaurants_restaurant_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'restaurants_restaurant_fts'
+
+
+class RestaurantGramIndex(models.Model):
+    """1〜2文字の検索語用のインデックス（restaurants_restaurant_grams、migrations/0013）を JOIN するためのモデル"""
+    restaurant = models.OneToOneField(
+        Restaurant,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='gram_index',
+    )
+    document = MatchField(db_column='restaurants_restaurant_grams')
+
+    class Meta:
+        managed = False
+        db_table = 'restaurants_restaurant_grams'
+
 
 class Table(models.Model):
     """テーブル（座席）モデル"""
@@ -92,6 +232,12 @@ class Table(models.Model):
         verbose_name='定員数',
         help_text='この席の定員数（2名、4名、8名など）'
     )
+    join_group = models.CharField(
+        max_length=20,
+        blank=True,
+        verbose_name='結合グループ',
+        help_text='同じグループ名のテーブルはくっつけて大人数の予約に使えます（空欄ならくっつけない）'
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日時')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日時')
     
@@ -132,4 +278,14 @@ class Favorite(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.user.email} ❤️ {self.restaurant.name}"
\ No newline at end of file
+        return f"{self.user.email} ❤️ {self.restaurant.name}"
+
+
+class IndexVersion(models.Model):
+    """
+    プロセスのメモリに持つインデックス（city_index / suggest_index）やキャッシュのバージョン（index_versions.py）。
+    キャッシュではなく DB に持つので、プロセスが複数あっても、再起動しても同じ値が見える。
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
@@ -0,0 +1,180 @@
+"""
+カーソル（キーセット）方式のページネーション
+
+OFFSET や COUNT(*) を使わず、前ページ最後の行の並び替えキーより
+「後ろ」の行だけを取りに行く。何ページ目でもかかる時間は変わらない。
+"""
+import base64
+import binascii
+import bisect
+import json
+from functools import total_ordering
+
+from django.db.models import Q
+
+
+def _parse_ordering(ordering):
+    """['-price_max', '-id'] → [('price_max', True), ('id', True)]（True は降順）"""
+    return [(f.lstrip('-'), f.startswith('-')) for f in ordering]
+
+
+def encode_cursor(values, direction):
+    # 日付・時刻のキーは ISO 形式の文字列にする（filter にそのまま渡せる）
+    raw = json.dumps({'k': values, 'd': direction}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """壊れたカーソルは None（= 1ページ目）として扱う"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data['k'], data['d']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+
+
+class KeysetPage:
+    """テンプレートに渡す1ページ分の結果"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    ordering の最後のキーは一意（id）であること。
+    例: KeysetPaginator(qs, ['price_min', 'id'], per_page=20).page(cursor)
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.fields = _parse_ordering(self.ordering)
+        self.per_page = per_page
+
+    def _after(self, values, reverse=False):
+        """並び順で values より後ろ（reverse=True なら前）の行を表す Q"""
+        q = Q()
+        equal = Q()
+        for (field, desc), value in zip(self.fields, values):
+            lookup = 'lt' if desc != reverse else 'gt'
+            q |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return q
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field, _ in self.fields]
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor)
+        if decoded and len(decoded[0]) != len(self.fields):
+            decoded = None
+
+        qs = self.queryset
+        backwards = False
+        if decoded:
+            values, direction = decoded
+            backwards = direction == 'p'
+            qs = qs.filter(self._after(values, reverse=backwards))
+
+        if backwards:
+            qs = qs.order_by(*[('' if desc else '-') + field for field, desc in self.fields])
+        else:
+            qs = qs.order_by(*self.ordering)
+
+        # 1件多く取って次があるかを判定する（COUNT は使わない）
+        rows = list(qs[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, decoded is not None
+
+        next_cursor = encode_cursor(self._key(rows[-1]), 'n') if rows and has_next else None
+        previous_cursor = encode_cursor(self._key(rows[0]), 'p') if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+
+@total_ordering
+class _Descending:
+    """降順のキーを昇順の比較にするための入れ物"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+
+class KeyListPaginator:
+    """
+    並び替えキーのリスト（キャッシュ済みの検索結果、ordering の順に並んでいること）をページ送りする。
+    カーソルの形式は KeysetPaginator と同じなので、途中でキャッシュが
+    切れて DB から取る方に切り替わっても続きのページが出せる。
+    カーソルの位置はキーの値で bisect して探す（リストが作り直されてカーソルの行がなくなっていても、
+    KeysetPaginator と同じくその値より後ろから続ける）。
+    fetch(ids) は ids の順で店舗を返す関数。
+    例: KeyListPaginator([[1500, 3], [1500, 8]], ['price_min', 'id'], 20, fetch).page(cursor)
+    """
+
+    def __init__(self, keys, ordering, per_page, fetch):
+        self.keys = keys
+        self.descending = [desc for _, desc in _parse_ordering(ordering)]
+        self.per_page = per_page
+        self.fetch = fetch
+
+    def _sort_key(self, values):
+        return tuple(_Descending(v) if desc else v for v, desc in zip(values, self.descending))
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor)
+        if decoded and len(decoded[0]) != len(self.descending):
+            decoded = None
+
+        if decoded is None:
+            start, end = 0, self.per_page
+        elif decoded[1] == 'p':
+            # カーソルの値より前
+            end = bisect.bisect_left(self.keys, self._sort_key(decoded[0]), key=self._sort_key)
+            start = max(0, end - self.per_page)
+        else:
+            # カーソルの値より後ろ
+            start = bisect.bisect_right(self.keys, self._sort_key(decoded[0]), key=self._sort_key)
+            end = start + self.per_page
+
+        keys = self.keys[start:end]
+        rows = self.fetch([key[-1] for key in keys])
+        has_next = end < len(self.keys)
+        has_previous = start > 0
+
+        next_cursor = encode_cursor(keys[-1], 'n') if keys and has_next else None
+        previous_cursor = encode_cursor(keys[0], 'p') if keys and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
@@ -0,0 +1,310 @@
+"""
+店舗の全文検索
+
+SQLite では FTS5（trigram トークナイザ）の restaurants_restaurant_fts を使う。
+trigram なので日本語でも分かち書きなしで部分一致検索ができる。
+インデックスは migrations/0005_restaurant_search_index.py で作成し、
+Restaurant / Category のトリガー（create_triggers）で同期する。トリガーなので
+bulk_create / update() / 管理画面からの変更でもずれない。
+
+トリガーがあると SQLite のテーブル再作成（AddField などのマイグレーション）が失敗するので、
+migrate の前に消して後で作り直す（apps.py で pre_migrate / post_migrate につないでいる）。
+
+インデックスに入れるのは正規化済みの Restaurant.search_key / Category.search_key
+（text.py）で、検索語も同じように正規化してから探す。
+
+trigram は3文字未満の語を MATCH できないので、1〜2文字の語は Restaurant.search_grams /
+Category.search_grams（text.make_search_grams）を入れた restaurants_restaurant_grams で探す
+（migrations/0013_search_grams.py で作成。同期は同じトリガー）。
+"""
+from django.db import connection
+from django.db.models import Q
+
+from .fts import Bm25
+from .models import Category, Restaurant
+from .text import SEARCH_KEY_FIELDS, gram_token, make_search_grams, make_search_key, normalize, split_search_key
+
+
+FTS_TABLE = 'restaurants_restaurant_fts'
+GRAM_TABLE = 'restaurants_restaurant_grams'
+
+# FTS のカラム → ORM のフィールド（FTS が使えない DB でのフォールバック用）
+# 店舗側のカラムは search_key にまとめて入っているので、フォールバックではカラムを区別しない
+FTS_COLUMNS = {
+    'name': 'search_key',
+    'description': 'search_key',
+    'category_name': 'category__search_key',
+    'prefecture': 'search_key',
+    'city': 'search_key',
+}
+
+# bm25 の重み（FTS_COLUMNS と同じ順番）。店舗名の一致を一番強くする
+RANK_WEIGHTS = (10.0, 1.0, 5.0, 2.0, 2.0)
+
+# trigram は3文字未満の語を MATCH できないので、その語だけ GRAM_TABLE で探す
+TRIGRAM_MIN_LENGTH = 3
+
+
+def is_available():
+    """FTS インデックスが使えるか（SQLite のときだけ作られる）"""
+    return connection.vendor == 'sqlite'
+
+
+def split_terms(text):
+    """検索語を正規化して、空白（全角スペースも）区切りのリストにする"""
+    return normalize(text).split()
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match_query(text, columns=None):
+    """
+    MATCH 用のクエリ文字列を作る。3文字以上の語だけが対象。
+    語は AND 条件、columns を渡すとそのカラムだけを探す。
+    """
+    terms = [t for t in split_terms(text) if len(t) >= TRIGRAM_MIN_LENGTH]
+    if not terms:
+        return ''
+    prefix = ''
+    if columns:
+        prefix = '{%s} : ' % ' '.join(columns)
+    return ' AND '.join(prefix + _quote(t) for t in terms)
+
+
+def build_gram_query(text, columns=None):
+    """
+    GRAM_TABLE 用の MATCH クエリ文字列を作る。3文字未満の語だけが対象。
+    2文字の語はトークンと完全一致、1文字の語はその文字から始まるトークン（前方一致）。
+    """
+    terms = [t for t in split_terms(text) if len(t) < TRIGRAM_MIN_LENGTH]
+    if not terms:
+        return ''
+    prefix = ''
+    if columns:
+        prefix = '{%s} : ' % ' '.join(columns)
+    return ' AND '.join(
+        prefix + _quote(gram_token(t)) + ('*' if len(t) == 1 else '')
+        for t in terms
+    )
+
+
+def search_filter(text, columns=None):
+    """
+    検索語に一致する店舗に絞り込む Q を返す。
+    FTS テーブルは Restaurant に rowid で JOIN して MATCH する（models.RestaurantSearchIndex / RestaurantGramIndex）。
+    何回 filter しても同じ JOIN に MATCH の条件が足されていく。
+    使い方: qs.filter(search_filter('名古屋 寿司'))
+    """
+    if not split_terms(text):
+        return Q()
+
+    if not is_available():
+        q = Q()
+        for term in split_terms(text):
+            term_q = Q()
+            for field in {FTS_COLUMNS[column] for column in (columns or FTS_COLUMNS)}:
+                term_q |= Q(**{f'{field}__contains': term})
+            q &= term_q
+        return q
+
+    q = Q()
+    match = build_match_query(text, columns)
+    if match:
+        q &= Q(search_index__document__match=match)
+    grams = build_gram_query(text, columns)
+    if grams:
+        q &= Q(gram_index__document__match=grams)
+    return q
+
+
+def rank_expression(text):
+    """
+    関連度（bm25、値が小さいほど関連が高い）を返す式。
+    search_filter(text) で絞り込んだクエリセットに annotate する（同じ JOIN の MATCH の結果を使うので、
+    店舗ごとに検索し直さない）。MATCH できる（3文字以上の）語がない場合は None。
+    """
+    if not build_match_query(text) or not is_available():
+        return None
+    return Bm25('search_index__document', RANK_WEIGHTS)
+
+
+# (FTS テーブル, 店舗の列, カテゴリの列)。どちらも店舗の列は1行に1フィールド（SEARCH_KEY_FIELDS の順）
+INDEXES = [
+    (FTS_TABLE, 'search_key', 'search_key'),
+    (GRAM_TABLE, 'search_grams', 'search_grams'),
+]
+
+
+def _insert_sql(table):
+    return (
+        f'INSERT INTO {table}(rowid, name, description, category_name, prefecture, city) '
+        'VALUES (%s, %s, %s, %s, %s, %s)'
+    )
+
+
+def _index_rows(restaurants, column, category_column):
+    """店舗のクエリセットから FTS に入れる行を作る（column を分けるだけ）"""
+    for pk, value, category_value in restaurants.values_list('pk', column, f'category__{category_column}'):
+        key = split_search_key(value)
+        yield pk, key['name'], key['description'], category_value or '', key['prefecture'], key['city']
+
+
+# トリガーの名前（migrate の前後で消して作り直す）
+TRIGGER_NAMES = [
+    'restaurants_restaurant_fts_ai',
+    'restaurants_restaurant_fts_au',
+    'restaurants_restaurant_fts_ad',
+    'restaurants_category_fts_au',
+]
+
+
+def _split_lines(column, count):
+    """
+    改行区切りの column の先頭から count 行を取り出す SQL の式のリスト（split_search_key と同じ結果）。
+    トリガーの中では WITH が使えないので substr / instr を重ねて作る。
+    """
+    rest = f"({column} || char(10))"
+    lines = []
+    for _ in range(count):
+        lines.append(f"substr({rest}, 1, instr({rest}, char(10)) - 1)")
+        rest = f"substr({rest}, instr({rest}, char(10)) + 1)"
+    return lines
+
+
+def _insert_row_sql(row):
+    """row（new など）の店舗の行を両方の FTS テーブルに入れる SQL"""
+    statements = []
+    for table, column, category_column in INDEXES:
+        name, description, prefecture, city = _split_lines(f'{row}.{column}', len(SEARCH_KEY_FIELDS))
+        statements.append(
+            f'INSERT INTO {table}(rowid, name, description, category_name, prefecture, city) '
+            f'VALUES ({row}.id, {name}, {description}, '
+            f'(SELECT {category_column} FROM restaurants_category WHERE id = {row}.category_id), '
+            f'{prefecture}, {city});'
+        )
+    return '\n'.join(statements)
+
+
+def _delete_row_sql(row):
+    return '\n'.join(f'DELETE FROM {table} WHERE rowid = {row}.id;' for table, _, _ in INDEXES)
+
+
+def _trigger_sql():
+    category_updates = '\n'.join(
+        f'UPDATE {table} SET category_name = new.{category_column} '
+        'WHERE rowid IN (SELECT id FROM restaurants_restaurant WHERE category_id = new.id);'
+        for table, _, category_column in INDEXES
+    )
+    return [
+        f"""
+        CREATE TRIGGER restaurants_restaurant_fts_ai
+        AFTER INSERT ON restaurants_restaurant BEGIN
+            {_insert_row_sql('new')}
+        END
+        """,
+        # お気に入り数などの集計値の更新では動かないように、検索に使う列だけを見る
+        f"""
+        CREATE TRIGGER restaurants_restaurant_fts_au
+        AFTER UPDATE OF search_key, search_grams, category_id ON restaurants_restaurant BEGIN
+            {_delete_row_sql('old')}
+            {_insert_row_sql('new')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER restaurants_restaurant_fts_ad
+        AFTER DELETE ON restaurants_restaurant BEGIN
+            {_delete_row_sql('old')}
+        END
+        """,
+        f"""
+        CREATE TRIGGER restaurants_category_fts_au
+        AFTER UPDATE OF search_key, search_grams ON restaurants_category BEGIN
+            {category_updates}
+        END
+        """,
+    ]
+
+
+def drop_triggers(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGER_NAMES:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def create_triggers(connection):
+    """
+    同期用のトリガーを作り直す。FTS テーブルや search_key / search_grams の列がまだない
+    （途中のマイグレーションまでしか当てていない）ときは何もしない。
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        if not {FTS_TABLE, GRAM_TABLE, 'restaurants_restaurant', 'restaurants_category'} <= tables:
+            return
+        for table in ('restaurants_restaurant', 'restaurants_category'):
+            columns = {c.name for c in connection.introspection.get_table_description(cursor, table)}
+            if not {'search_key', 'search_grams'} <= columns:
+                return
+    drop_triggers(connection)
+    with connection.cursor() as cursor:
+        for sql in _trigger_sql():
+            cursor.execute(sql)
+
+
+def rebuild_index():
+    """
+    インデックスを全件作り直す。作成した件数を返す。
+    ふだんはトリガーで同期しているので、インデックスを壊したとき・トリガーがなかった間の変更を入れるとき用。
+    """
+    if not is_available():
+        return 0
+    restaurants = Restaurant.objects.all()
+    count = 0
+    with connection.cursor() as cursor:
+        for table, column, category_column in INDEXES:
+            rows = list(_index_rows(restaurants, column, category_column))
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.executemany(_insert_sql(table), rows)
+            count = len(rows)
+    return count
+
+
+def refresh_search_keys(batch_size=1000):
+    """
+    全店舗・全カテゴリの search_key / search_grams を作り直し、値が変わった行だけ bulk_update して
+    インデックスも作り直す。更新した (店舗数, カテゴリ数) を返す。
+    正規化のルール（text.py）を変えたときや、update() / bulk_create で入れたデータ用。
+    """
+    def refresh(queryset, fields, make_key):
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(
+                queryset.filter(pk__gt=last_id).order_by('pk')
+                .only('pk', 'search_key', 'search_grams', *fields)[:batch_size]
+            )
+            if not batch:
+                return updated
+            last_id = batch[-1].pk
+            changed = []
+            for obj in batch:
+                key = make_key(obj)
+                grams = make_search_grams(key)
+                if (obj.search_key, obj.search_grams) != (key, grams):
+                    obj.search_key, obj.search_grams = key, grams
+                    changed.append(obj)
+            queryset.model.objects.bulk_update(changed, ['search_key', 'search_grams'])
+            updated += len(changed)
+
+    restaurants = refresh(
+        Restaurant.objects.all(), SEARCH_KEY_FIELDS,
+        lambda r: make_search_key(getattr(r, f) for f in SEARCH_KEY_FIELDS),
+    )
+    categories = refresh(Category.objects.all(), ['name'], lambda c: normalize(c.name))
+    rebuild_index()
+    return restaurants, categories
@@ -0,0 +1,112 @@
+"""
+店舗検索結果のキャッシュ
+
+検索条件（正規化した GET パラメータ + 並び順）ごとに、ヒットした店舗の
+並び替えキー（最後が id）の順序付きリストをキャッシュする。
+Restaurant / Category / Favorite が変わるとバージョンを上げて、
+古いキャッシュはまとめて使われなくなる（signals.py から bump_version を呼ぶ）。
+バージョンは LocMemCache ではなく DB（index_versions.py）に持つ。キャッシュに置くと
+エントリの追い出しで 1 に戻って古い結果が使われたり、ほかのプロセスに届かなかったりするため。
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from . import index_versions
+from .models import Restaurant
+from .text import normalize
+
+
+VERSION_NAME = 'restaurant_search'
+
+# キャッシュの有効期限（秒）。bulk_create など signal が飛ばない更新への保険
+CACHE_TIMEOUT = 300
+
+# これより多くヒットする検索はキャッシュせず、毎回カーソルで DB から取る
+MAX_CACHED_RESULTS = 5000
+TOO_MANY = 'too_many'
+
+# キャッシュキーに含める検索パラメータ
+SEARCH_PARAMS = (
+    'keyword', 'category', 'category_keyword', 'category_name', 'prefecture', 'city', 'price',
+    'lat', 'lng', 'radius',
+)
+
+# 全文検索に渡す（検索前に正規化される）パラメータ。表記ゆれが違っても同じキーになる
+NORMALIZED_PARAMS = ('keyword', 'category_keyword', 'city')
+
+
+def get_version():
+    return index_versions.get(VERSION_NAME)
+
+
+def bump_version():
+    """検索結果のキャッシュをすべて無効にする"""
+    index_versions.bump(VERSION_NAME)
+
+
+def normalize_params(params):
+    """空白のゆれをなくし、空のパラメータを除いた (名前, 値) のリスト"""
+    normalized = []
+    for name in SEARCH_PARAMS:
+        value = params.get(name) or ''
+        value = normalize(value) if name in NORMALIZED_PARAMS else ' '.join(value.split())
+        if value:
+            normalized.append((name, value))
+    return normalized
+
+
+def make_key(params, ordering):
+    raw = json.dumps([normalize_params(params), list(ordering)], ensure_ascii=False)
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'restaurant_search:{get_version()}:result:{digest}'
+
+
+def get_result_keys(params, ordering, queryset, compute=None):
+    """
+    検索結果の並び替えキーのリスト（例: [[1500, 3], [1500, 8], ...]）を返す。
+    ヒット件数が MAX_CACHED_RESULTS を超える場合は None。
+    DB の列で並べられない場合（距離順など）は compute() でキーのリストを作る。
+    """
+    if queryset.query.is_empty():
+        return []
+
+    key = make_key(params, ordering)
+    keys = cache.get(key)
+    if keys is None:
+        if compute is not None:
+            rows = compute()
+        else:
+            fields = [f.lstrip('-') for f in ordering]
+            rows = [list(row) for row in queryset.values_list(*fields)[:MAX_CACHED_RESULTS + 1]]
+        keys = rows if len(rows) <= MAX_CACHED_RESULTS else TOO_MANY
+        cache.set(key, keys, CACHE_TIMEOUT)
+
+    if keys == TOO_MANY:
+        return None
+    return keys
+
+
+def get_restaurants(ids):
+    """
+    店舗を ids の順で返す。キャッシュにない店舗だけ DB から取る。
+    （キャッシュはユーザーに依存しない値だけ。お気に入り済みフラグは後から付ける）
+    """
+    version = get_version()
+    cache_keys = {f'restaurant_search:{version}:row:{pk}': pk for pk in ids}
+    found = cache.get_many(cache_keys.keys())
+    restaurants = {cache_keys[k]: obj for k, obj in found.items()}
+
+    missing = [pk for pk in ids if pk not in restaurants]
+    if missing:
+        fetched = (Restaurant.objects
+                   .select_related('category', 'company')
+                   .in_bulk(missing))
+        restaurants.update(fetched)
+        cache.set_many(
+            {f'restaurant_search:{version}:row:{pk}': obj for pk, obj in fetched.items()},
+            CACHE_TIMEOUT,
+        )
+
+    return [restaurants[pk] for pk in ids if pk in restaurants]
@@ -0,0 +1,78 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import capacity, city_index, search, search_cache, suggest_index
+from .counters import adjust_favorite_count
+from .models import Category, Favorite, Restaurant, Table
+
+
+# --- 全文検索インデックスのトリガー（apps.py で migrate の前後につなぐ） ---
+
+def drop_search_triggers(using, **kwargs):
+    search.drop_triggers(connections[using])
+
+
+def create_search_triggers(using, **kwargs):
+    search.create_triggers(connections[using])
+
+
+# --- 検索結果キャッシュの無効化 ---
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def invalidate_search_cache(sender, **kwargs):
+    search_cache.bump_version()
+
+
+# --- お気に入り数の集計 ---
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(sender, instance, created, **kwargs):
+    if created:
+        adjust_favorite_count(instance.restaurant_id, 1)
+        suggest_index.add_popularity(instance.restaurant_id, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(sender, instance, **kwargs):
+    adjust_favorite_count(instance.restaurant_id, -1)
+    suggest_index.add_popularity(instance.restaurant_id, -1)
+
+
+# --- 席の集計 ---
+
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+def table_changed(sender, instance, **kwargs):
+    capacity.refresh(instance.restaurant_id)
+
+
+# --- 市区町村インデックス（/api/cities/）の作り直し ---
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_city_index(sender, **kwargs):
+    city_index.invalidate()
+
+
+# --- 入力候補インデックス（/api/suggest/）の更新 ---
+
+@receiver(post_save, sender=Restaurant)
+def update_suggest_index(sender, instance, **kwargs):
+    suggest_index.update_restaurant(instance.pk)
+
+
+@receiver(post_delete, sender=Restaurant)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    suggest_index.remove_restaurant(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_suggest_index(sender, **kwargs):
+    suggest_index.invalidate()
@@ -0,0 +1,228 @@
+"""
+検索ボックスの入力候補（/api/suggest/ 用）
+
+店舗名・カテゴリ名・市区町村名を検索用に正規化した値（text.normalize）の昇順に並べたリストをメモリに持ち、
+入力された文字で始まる範囲を bisect で探して人気順に上位 K 件を返す。
+キーを打つたびに DB にはアクセスしない。
+
+- 店舗名は空白で区切った単語ごとにも登録する（「海鮮」で「回転寿司 海鮮丸」が出る）
+- 人気: 店舗はお気に入り数 + レビュー数、カテゴリ・市区町村は店舗数
+- 店舗の保存・削除時は signals.py から update_restaurant / remove_restaurant で
+  そのプロセスのインデックスだけ差分更新し、他のプロセスにはバージョン（index_versions.py、DB に持つ）で
+  作り直しを知らせる
+- 最初の入力で DB 全体を読まないように、起動時（base/wsgi.py・asgi.py）に warm_up() で作っておく
+"""
+import bisect
+import heapq
+import threading
+
+from django.db import DatabaseError
+
+from . import index_versions
+from .models import Restaurant
+from .text import normalize
+
+
+VERSION_NAME = 'suggest_index'
+
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 10
+
+# 覚えておく検索結果の数の上限（超えたら捨ててやり直す）
+MAX_CACHED_RESULTS = 1000
+
+KIND_RESTAURANT = 'restaurant'
+KIND_CATEGORY = 'category'
+KIND_CITY = 'city'
+
+_lock = threading.RLock()
+_state = {
+    'keys': None,          # [(検索用キー, 種類, id or 名前), ...] 昇順
+    'restaurants': {},     # {店舗id: (店舗名, カテゴリ名, 市区町村, 人気)}
+    'category_counts': {}, # {カテゴリ名: 店舗数}
+    'city_counts': {},     # {市区町村: 店舗数}
+    'results': {},         # {(キー, 件数): 結果} 短い入力ほど範囲が広いので結果も覚えておく
+    'version': None,
+}
+
+
+def _name_keys(name):
+    """店舗名そのものと、空白で区切った2語目以降の単語"""
+    key = normalize(name)
+    keys = {key} if key else set()
+    keys.update(word for word in key.split()[1:] if word)
+    return keys
+
+
+def _bump_version():
+    """
+    他のプロセスに作り直しを知らせる。自分は差分更新済みなので新しいバージョンを覚えるが、
+    その前にほかのプロセスの変更があった（1つ前のバージョンではなかった）ときは作り直す
+    """
+    version = index_versions.bump(VERSION_NAME)
+    if _state['version'] == version - 1:
+        _state['version'] = version
+    else:
+        _state['keys'] = None
+
+
+def _insert(entry):
+    _state['results'] = {}
+    keys = _state['keys']
+    i = bisect.bisect_left(keys, entry)
+    if i == len(keys) or keys[i] != entry:
+        keys.insert(i, entry)
+
+
+def _delete(entry):
+    _state['results'] = {}
+    keys = _state['keys']
+    i = bisect.bisect_left(keys, entry)
+    if i < len(keys) and keys[i] == entry:
+        del keys[i]
+
+
+def _count(kind, counts, name, delta):
+    """カテゴリ・市区町村の店舗数を増減し、0 件になったら候補から外す"""
+    if not name:
+        return
+    n = counts.get(name, 0) + delta
+    entry = (normalize(name), kind, name)
+    if n > 0:
+        counts[name] = n
+        _insert(entry)
+    else:
+        counts.pop(name, None)
+        _delete(entry)
+
+
+def _add(pk, name, category_name, city, popularity):
+    _state['restaurants'][pk] = (name, category_name, city, popularity)
+    for key in _name_keys(name):
+        _insert((key, KIND_RESTAURANT, pk))
+    _count(KIND_CATEGORY, _state['category_counts'], category_name, 1)
+    _count(KIND_CITY, _state['city_counts'], city, 1)
+
+
+def _remove(pk):
+    old = _state['restaurants'].pop(pk, None)
+    if old is None:
+        return
+    name, category_name, city, _ = old
+    for key in _name_keys(name):
+        _delete((key, KIND_RESTAURANT, pk))
+    _count(KIND_CATEGORY, _state['category_counts'], category_name, -1)
+    _count(KIND_CITY, _state['city_counts'], city, -1)
+
+
+def _rows(queryset):
+    return queryset.values_list('pk', 'name', 'category__name', 'city', 'favorite_count', 'review_count')
+
+
+def build():
+    """DB から全部作り直す"""
+    with _lock:
+        version = index_versions.get(VERSION_NAME)
+        _state['keys'] = []
+        _state['restaurants'] = {}
+        _state['category_counts'] = {}
+        _state['city_counts'] = {}
+        _state['results'] = {}
+        for pk, name, category_name, city, favorites, reviews in _rows(Restaurant.objects.all()):
+            _add(pk, name, category_name, city, favorites + reviews)
+        _state['version'] = version
+
+
+def _ensure_built():
+    if _state['keys'] is None or _state['version'] != index_versions.get(VERSION_NAME):
+        build()
+
+
+def warm_up():
+    """起動時に作っておく（DB がまだ使えないとき（マイグレーション前など）は最初の入力のときに作る）"""
+    try:
+        build()
+    except DatabaseError:
+        _state['keys'] = None
+
+
+def update_restaurant(pk):
+    """店舗を保存したら呼ぶ（そのプロセスのインデックスを差分更新する）"""
+    with _lock:
+        if _state['keys'] is not None:
+            _remove(pk)
+            for row_pk, name, category_name, city, favorites, reviews in _rows(Restaurant.objects.filter(pk=pk)):
+                _add(row_pk, name, category_name, city, favorites + reviews)
+        _bump_version()
+
+
+def remove_restaurant(pk):
+    """店舗を削除したら呼ぶ"""
+    with _lock:
+        if _state['keys'] is not None:
+            _remove(pk)
+        _bump_version()
+
+
+def add_popularity(pk, delta):
+    """お気に入り・レビューの増減を人気に反映する（このプロセスだけ。作り直すと DB の値に揃う）"""
+    with _lock:
+        record = _state['restaurants'].get(pk)
+        if record is not None:
+            name, category_name, city, popularity = record
+            _state['restaurants'][pk] = (name, category_name, city, max(popularity + delta, 0))
+            _state['results'] = {}
+
+
+def invalidate():
+    """カテゴリ名の変更など、まとめて変わったときに呼ぶ。どのプロセスも次のアクセスで作り直す"""
+    _state['keys'] = None
+    index_versions.bump(VERSION_NAME)
+
+
+def _score(entry):
+    _, kind, ident = entry
+    if kind == KIND_RESTAURANT:
+        return _state['restaurants'][ident][3]
+    if kind == KIND_CATEGORY:
+        return _state['category_counts'].get(ident, 0)
+    return _state['city_counts'].get(ident, 0)
+
+
+def suggest(prefix, limit=DEFAULT_LIMIT):
+    """
+    prefix で始まる候補を種類ごとに人気順で limit 件ずつ返す。
+    {'restaurants': [(id, 店舗名), ...], 'categories': [名前, ...], 'cities': [名前, ...]}
+    """
+    result = {'restaurants': [], 'categories': [], 'cities': []}
+    prefix = normalize(prefix)
+    if not prefix:
+        return result
+
+    with _lock:
+        _ensure_built()
+        cached = _state['results'].get((prefix, limit))
+        if cached is not None:
+            return cached
+        keys = _state['keys']
+        start = bisect.bisect_left(keys, (prefix,))
+        # prefix で始まるキーの範囲の終わり（'\U0010ffff' はどの文字よりも後ろ）
+        end = bisect.bisect_left(keys, (prefix + '\U0010ffff',), start)
+
+        matched = {KIND_RESTAURANT: {}, KIND_CATEGORY: {}, KIND_CITY: {}}
+        for entry in keys[start:end]:
+            _, kind, ident = entry
+            # 店舗名と単語の両方でヒットしても1件にする
+            matched[kind][ident] = _score(entry)
+
+        def top(scores):
+            return heapq.nsmallest(limit, scores, key=lambda ident: (-scores[ident], ident))
+
+        restaurants = _state['restaurants']
+        result['restaurants'] = [(pk, restaurants[pk][0]) for pk in top(matched[KIND_RESTAURANT])]
+        result['categories'] = top(matched[KIND_CATEGORY])
+        result['cities'] = top(matched[KIND_CITY])
+        if len(_state['results']) >= MAX_CACHED_RESULTS:
+            _state['results'] = {}
+        _state['results'][(prefix, limit)] = result
+    return result
@@ -1,3 +1,598 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import User
+from reservations.allocation import assign_table
+from reservations.models import Reservation
+from reviews.models import Review
+from . import city_index, counters, index_versions, search_cache, suggest_index
+from .facets import compute_facets, get_facets
+from .geo import distance_keys, haversine_km, nearby_filter, parse_location
+from .models import Category, Company, Favorite, IndexVersion, Restaurant, Table
+from .pagination import KeyListPaginator, decode_cursor
+from .search import FTS_TABLE, rank_expression, search_filter
+from .text import normalize, split_search_key
+from .views import RestaurantListView
+
+
+class RestaurantFixtureMixin:
+    """会社1つ・カテゴリ2つと、店舗を作るヘルパー"""
+
+    def setUp(self):
+        # テストごとに DB のバージョンは巻き戻るので、前のテストのキャッシュが同じバージョンで残らないようにする
+        cache.clear()
+        index_versions._checked.clear()
+        owner = User.objects.create_user('owner@example.com', None, name='owner', is_owner_member=True)
+        self.company = Company.objects.create(
+            owner=owner, name='テスト', representative='r', zipcode='1', address='a', business='b',
+        )
+        self.washoku = Category.objects.create(company=self.company, name='和食')
+        self.cafe = Category.objects.create(company=self.company, name='カフェ')
+
+    def make_restaurant(self, name, category=None, **fields):
+        defaults = dict(
+            company=self.company, category=category or self.washoku, name=name, price_min=1000, price_max=2000,
+            open_time=time(11), close_time=time(22), zipcode='1', address='a', tel='1',
+        )
+        defaults.update(fields)
+        return Restaurant.objects.create(**defaults)
+
+    def search(self, text, columns=None):
+        return set(Restaurant.objects.filter(search_filter(text, columns)).values_list('name', flat=True))
+
+
+class SearchIndexSyncTests(RestaurantFixtureMixin, TestCase):
+    """全文検索インデックスはトリガーで同期するので、save() を通らない変更でもずれない"""
+
+    def index_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, name, description, category_name, prefecture, city FROM {FTS_TABLE} ORDER BY rowid'
+            )
+            return cursor.fetchall()
+
+    def expected_rows(self):
+        rows = []
+        for pk, search_key, category_key in (Restaurant.objects.order_by('pk')
+                                             .values_list('pk', 'search_key', 'category__search_key')):
+            key = split_search_key(search_key)
+            rows.append((pk, key['name'], key['description'], category_key, key['prefecture'], key['city']))
+        return rows
+
+    def test_index_follows_update_and_delete(self):
+        sushi = self.make_restaurant('すし太郎', description='新鮮な魚', city='豊橋市')
+        self.make_restaurant('喫茶みどり', category=self.cafe)
+        self.assertEqual(self.index_rows(), self.expected_rows())
+
+        # update() で search_key だけ書き換えても、カテゴリ名を変えても反映される
+        Restaurant.objects.filter(pk=sushi.pk).update(search_key='すしまる\n\n愛知県\n豊橋市')
+        Category.objects.filter(pk=self.cafe.pk).update(search_key='きっさてん')
+        self.assertEqual(self.index_rows(), self.expected_rows())
+        self.assertEqual(self.search('すしまる'), {'すし太郎'})
+        self.assertEqual(self.search('きっさてん', columns=['category_name']), {'喫茶みどり'})
+
+        Restaurant.objects.filter(pk=sushi.pk).delete()
+        self.assertEqual(self.index_rows(), self.expected_rows())
+        self.assertEqual(self.search('すしまる'), set())
+
+
+class ShortTermSearchTests(RestaurantFixtureMixin, TestCase):
+    """1〜2文字の語も（LIKE の全件走査ではなく）インデックスで部分一致する"""
+
+    def setUp(self):
+        super().setUp()
+        self.make_restaurant('すし太郎', description='新鮮な魚', city='豊橋市')
+        self.make_restaurant('焼肉 一', city='名古屋市')
+        self.make_restaurant('ｶﾌｪ&ﾊﾞｰ', category=self.cafe, city='岡崎市')
+
+    def test_short_terms(self):
+        self.assertEqual(self.search('す'), {'すし太郎'})
+        self.assertEqual(self.search('し太'), {'すし太郎'})
+        self.assertEqual(self.search('郎'), {'すし太郎'})      # 語の最後の文字
+        self.assertEqual(self.search('一'), {'焼肉 一'})        # 1文字の語
+        self.assertEqual(self.search('&'), {'ｶﾌｪ&ﾊﾞｰ'})       # 記号も1文字として探せる
+        self.assertEqual(self.search('バー'), {'ｶﾌｪ&ﾊﾞｰ'})     # 正規化してから探す
+        self.assertEqual(self.search('市'), {'すし太郎', '焼肉 一', 'ｶﾌｪ&ﾊﾞｰ'})
+        self.assertEqual(self.search('魚 郎'), {'すし太郎'})
+        self.assertEqual(self.search('魚 肉'), set())
+
+    def test_columns_and_long_terms(self):
+        self.assertEqual(self.search('か', columns=['category_name']), {'ｶﾌｪ&ﾊﾞｰ'})
+        self.assertEqual(self.search('か'), {'ｶﾌｪ&ﾊﾞｰ'})
+        self.assertEqual(self.search('名古屋', columns=['city']), {'焼肉 一'})
+        # 3文字以上の語（trigram）と短い語の両方に当たるものだけ
+        self.assertEqual(self.search('すし太 橋'), {'すし太郎'})
+        self.assertEqual(self.search('すし太 崎'), set())
+
+    def test_short_terms_follow_updates(self):
+        Category.objects.filter(pk=self.washoku.pk).update(name='寿司')
+        Category.objects.get(pk=self.washoku.pk).save()
+        self.assertEqual(self.search('寿', columns=['category_name']), {'すし太郎', '焼肉 一'})
+
+
+class SearchRankTests(RestaurantFixtureMixin, TestCase):
+    """関連度は FTS テーブルを1回 JOIN した bm25 で、店舗名の一致が説明の一致より上に来る"""
+
+    def setUp(self):
+        super().setUp()
+        self.in_description = self.make_restaurant('喫茶みどり', description='すし太郎の姉妹店')
+        self.in_name = self.make_restaurant('すし太郎')
+        self.other = self.make_restaurant('焼肉一番')
+
+    def test_rank_orders_name_matches_first(self):
+        qs = Restaurant.objects.filter(search_filter('すし太郎'))
+        ranked = qs.annotate(search_rank=rank_expression('すし太郎')).order_by('search_rank', '-id')
+        self.assertEqual([r.pk for r in ranked], [self.in_name.pk, self.in_description.pk])
+
+        sql = str(ranked.query)
+        self.assertEqual(sql.count(f'JOIN "{FTS_TABLE}"'), 1)
+        self.assertNotIn('SELECT bm25', sql)  # 店舗ごとの相関サブクエリではない
+        # 短い語だけなら関連度はない
+        self.assertIsNone(rank_expression('すし'))
+
+    @mock.patch('restaurants.search_cache.MAX_CACHED_RESULTS', 0)
+    @mock.patch.object(RestaurantListView, 'paginate_by', 1)
+    def test_relevance_pages_with_cursor(self):
+        # 結果をキャッシュしない（KeysetPaginator が bm25 の値で続きを取る）ときも、カテゴリでも絞り込んでも順番どおり
+        url = reverse('restaurants:restaurant_list')
+        params = {'keyword': 'すし太郎', 'category_keyword': '和食'}
+        seen = []
+        for _ in range(5):
+            page = self.client.get(url, params).context['page_obj']
+            seen += [r.pk for r in page]
+            if not page.next_cursor:
+                break
+            params['cursor'] = page.next_cursor
+        self.assertEqual(seen, [self.in_name.pk, self.in_description.pk])
+
+
+class RestaurantStatsTests(RestaurantFixtureMixin, TestCase):
+    """集計値は F 式で足し引きし、フォームなどからの保存で古い値に戻らない"""
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(f'user{i}@example.com', None, name=f'user{i}') for i in range(3)]
+
+    def test_full_save_keeps_counters(self):
+        restaurant = self.make_restaurant('すし太郎')
+        stale = Restaurant.objects.get(pk=restaurant.pk)  # 編集画面を開いた時点の値
+        for user in self.users:
+            Favorite.objects.create(user=user, restaurant=restaurant)
+        Review.objects.create(user=self.users[0], restaurant=restaurant, rating=4, comment='c')
+        Table.objects.create(restaurant=restaurant, capacity=6)
+
+        stale.name = 'すし次郎'
+        stale.save()
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.name, 'すし次郎')
+        self.assertEqual(
+            (restaurant.favorite_count, restaurant.review_count, restaurant.rating_sum, restaurant.rating_avg),
+            (3, 1, 4, 4.0),
+        )
+        self.assertEqual((restaurant.table_count, restaurant.max_party_size), (1, 6))
+
+    def test_counters_follow_writes(self):
+        restaurant = self.make_restaurant('すし太郎')
+        favorites = [Favorite.objects.create(user=user, restaurant=restaurant) for user in self.users]
+        favorites[0].delete()
+        reviews = [Review.objects.create(user=user, restaurant=restaurant, rating=rating, comment='c')
+                   for user, rating in zip(self.users, [5, 4, 1])]
+        reviews[0].rating = 3
+        reviews[0].save()
+        reviews[2].delete()
+
+        restaurant.refresh_from_db()
+        self.assertEqual(
+            (restaurant.favorite_count, restaurant.review_count, restaurant.rating_sum, restaurant.rating_avg),
+            (2, 2, 7, 3.5),
+        )
+        self.assertEqual(counters.recount(), 0)  # 作り直しても同じ値
+
+        # 詳細ページは保存済みの値を出すだけ（COUNT / AVG を取らない）
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('restaurants:restaurant_detail', args=[restaurant.pk]))
+        self.assertEqual((response.context['review_count'], response.context['favorite_count']), (2, 2))
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] or 'AVG(' in q['sql']])
+
+    def test_review_moved_to_another_restaurant(self):
+        first, second = self.make_restaurant('店舗1'), self.make_restaurant('店舗2')
+        review = Review.objects.create(user=self.users[0], restaurant=first, rating=5, comment='c')
+        Review.objects.create(user=self.users[1], restaurant=first, rating=3, comment='c')
+
+        review.restaurant = second
+        review.rating = 2
+        review.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.review_count, first.rating_sum, first.rating_avg), (1, 3, 3.0))
+        self.assertEqual((second.review_count, second.rating_sum, second.rating_avg), (1, 2, 2.0))
+
+
+class CityIndexTests(RestaurantFixtureMixin, TestCase):
+    """市区町村インデックスのバージョンは DB にあり、書き出したファイルは古くなったら使わない"""
+
+    def setUp(self):
+        super().setUp()
+        self.make_restaurant('店舗1', prefecture='愛知県', city='名古屋市')
+        self.make_restaurant('店舗2', prefecture='愛知県', city='豊橋市')
+        self.make_restaurant('店舗3', prefecture='岐阜県', city='岐阜市')
+        self.restart()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cities.json')
+        settings = override_settings(CITY_INDEX_FILE=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def restart(self):
+        """プロセスの再起動（メモリ上のインデックスとバージョンを忘れる）"""
+        city_index._state.update(cities=None, etags={}, version=None)
+        index_versions._checked.clear()
+
+    def test_exported_file_is_used_until_restaurants_change(self):
+        self.assertEqual(city_index.export(self.path), 2)
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['version'], index_versions.get(city_index.VERSION_NAME))
+
+        self.restart()
+        with mock.patch.object(city_index, 'build_from_db') as build:
+            self.assertEqual(city_index.get_cities('愛知県'), ['名古屋市', '豊橋市'])
+        build.assert_not_called()
+
+        # 店舗が変わった後は、再起動してもファイルではなく DB から作る
+        self.make_restaurant('店舗4', prefecture='愛知県', city='岡崎市')
+        self.restart()
+        self.assertEqual(city_index.get_cities('愛知県'), ['名古屋市', '岡崎市', '豊橋市'])
+
+    def test_api_answers_from_memory_with_etag(self):
+        url = reverse('restaurants:get_cities')
+        self.client.get(url, {'prefecture': '愛知県'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'prefecture': '愛知県'})
+        self.assertEqual(response.json(), {'cities': ['名古屋市', '豊橋市']})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, {'prefecture': '愛知県'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, {'prefecture': '沖縄県'}).json(), {'cities': []})
+
+        # 店舗が増えたら ETag も変わる
+        self.make_restaurant('店舗4', prefecture='愛知県', city='岡崎市')
+        response = self.client.get(url, {'prefecture': '愛知県'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'cities': ['名古屋市', '岡崎市', '豊橋市']})
+
+    def test_other_process_sees_change(self):
+        etag = city_index.get_etag('岐阜県')
+        self.assertEqual(city_index.get_cities('岐阜県'), ['岐阜市'])
+        # ほかのプロセスで店舗が増えた（このプロセスのメモリは古いまま）
+        with mock.patch.object(city_index, 'invalidate'):
+            self.make_restaurant('店舗4', prefecture='岐阜県', city='大垣市')
+        index_versions.bump(city_index.VERSION_NAME)
+        index_versions._checked.clear()  # CHECK_SECONDS が過ぎた
+        self.assertEqual(city_index.get_cities('岐阜県'), ['大垣市', '岐阜市'])
+        self.assertNotEqual(city_index.get_etag('岐阜県'), etag)
+
+
+class SuggestIndexTests(RestaurantFixtureMixin, TestCase):
+    """入力候補は起動時に作っておき、ほかのプロセスの変更は DB のバージョンで気づく"""
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(f'user{i}@example.com', None, name=f'user{i}') for i in range(2)]
+        self.sushi = self.make_restaurant('すし 海鮮丸', city='名古屋市')
+        self.popular = self.make_restaurant('すし太郎', city='名古屋市')
+        for user in self.users:
+            Favorite.objects.create(user=user, restaurant=self.popular)
+        suggest_index._state.update(keys=None, version=None)
+        index_versions._checked.clear()
+
+    def test_warm_up_and_prefix(self):
+        suggest_index.warm_up()
+        self.assertIsNotNone(suggest_index._state['keys'])
+        with self.assertNumQueries(0):
+            result = suggest_index.suggest('ス')
+        self.assertEqual(result['restaurants'], [(self.popular.pk, 'すし太郎'), (self.sushi.pk, 'すし 海鮮丸')])
+        self.assertEqual(suggest_index.suggest('海鮮')['restaurants'], [(self.sushi.pk, 'すし 海鮮丸')])
+        self.assertEqual(suggest_index.suggest('名古')['cities'], ['名古屋市'])
+        self.assertEqual(suggest_index.suggest('和')['categories'], ['和食'])
+
+    def test_api(self):
+        suggest_index.warm_up()
+        url = reverse('restaurants:suggest')
+        with self.assertNumQueries(0):
+            data = self.client.get(url, {'q': 'ｽｼ', 'limit': '1'}).json()
+        self.assertEqual(data['restaurants'], [
+            {'name': 'すし太郎', 'url': reverse('restaurants:restaurant_detail', args=[self.popular.pk])},
+        ])
+        data = self.client.get(url, {'q': '名古', 'limit': 'x'}).json()
+        self.assertEqual([c['name'] for c in data['cities']], ['名古屋市'])
+        self.assertIn('city=', data['cities'][0]['url'])
+        self.assertEqual(self.client.get(url, {'q': ''}).json(), {'restaurants': [], 'categories': [], 'cities': []})
+
+        # 消した店舗は出なくなる
+        self.popular.delete()
+        self.assertEqual([r['name'] for r in self.client.get(url, {'q': 'すし'}).json()['restaurants']], ['すし 海鮮丸'])
+
+    def test_changes_from_other_processes(self):
+        suggest_index.warm_up()
+        # このプロセスでの変更は差分更新（作り直さない）
+        self.make_restaurant('すし三郎')
+        with mock.patch.object(suggest_index, 'build') as build:
+            self.assertEqual(len(suggest_index.suggest('すし', limit=10)['restaurants']), 3)
+        build.assert_not_called()
+
+        # ほかのプロセスで変わった後にこのプロセスでも変えたら、差分更新ではなく作り直す
+        with mock.patch.object(suggest_index, 'update_restaurant'):
+            self.make_restaurant('すし四郎')
+        index_versions.bump(suggest_index.VERSION_NAME)
+        self.make_restaurant('すし五郎')
+        self.assertEqual(len(suggest_index.suggest('すし', limit=10)['restaurants']), 5)
+
+
+class KeyListPaginatorTests(TestCase):
+    def paginator(self, keys, ordering):
+        return KeyListPaginator(keys, ordering, 2, lambda ids: list(ids))
+
+    def test_pages(self):
+        keys = [[3000, 9], [2000, 7], [2000, 4], [1000, 8], [1000, 2]]
+        paginator = self.paginator(keys, ['-price_max', '-id'])
+        first = paginator.page()
+        self.assertEqual(first.object_list, [9, 7])
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(second.object_list, [4, 8])
+        third = paginator.page(second.next_cursor)
+        self.assertEqual((third.object_list, third.has_next()), ([2], False))
+        self.assertEqual(paginator.page(third.previous_cursor).object_list, [4, 8])
+        self.assertEqual(paginator.page(second.previous_cursor).object_list, [9, 7])
+
+    def test_cursor_row_removed(self):
+        keys = [[1000, 2], [1000, 5], [1500, 3], [2000, 1]]
+        cursor = self.paginator(keys, ['price_min', 'id']).page().next_cursor
+        self.assertEqual(decode_cursor(cursor)[0], [1000, 5])
+        # 作り直したリストにカーソルの店舗がなくても、その値より後ろから続ける
+        rebuilt = [[1000, 2], [1200, 6], [1500, 3], [2000, 1]]
+        self.assertEqual(self.paginator(rebuilt, ['price_min', 'id']).page(cursor).object_list, [6, 3])
+
+
+class RestaurantListPagingTests(RestaurantFixtureMixin, TestCase):
+    """一覧はカーソルでページ送りし、同じ価格の店舗が続いても取りこぼさない（キャッシュあり・なしで同じ）"""
+
+    def setUp(self):
+        super().setUp()
+        for i, price in enumerate([1000, 1000, 2000, 1000, 3000]):
+            self.make_restaurant(f'店舗{i}', price_min=price, price_max=price + 1000, prefecture='愛知県')
+        self.expected = list(Restaurant.objects.order_by('price_min', 'id').values_list('pk', flat=True))
+        self.url = reverse('restaurants:restaurant_list')
+
+    def walk(self, cursor_name='next_cursor', cursor=''):
+        pages = []
+        while True:
+            page = self.client.get(self.url, {'prefecture': '愛知県', 'sort': 'price_low', 'cursor': cursor}).context['page_obj']
+            pages.append([r.pk for r in page])
+            cursor = getattr(page, cursor_name)
+            if not cursor:
+                return pages, page
+
+    @mock.patch.object(RestaurantListView, 'paginate_by', 2)
+    def test_cursor_pages(self):
+        for cached_results in [search_cache.MAX_CACHED_RESULTS, 0]:
+            with self.subTest(cached_results=cached_results), \
+                    mock.patch('restaurants.search_cache.MAX_CACHED_RESULTS', cached_results), \
+                    CaptureQueriesContext(connection) as queries:
+                cache.clear()
+                pages, last = self.walk()
+                self.assertEqual(pages, [self.expected[0:2], self.expected[2:4], self.expected[4:]])
+                # 最後のページから前へ戻る
+                back, _ = self.walk('previous_cursor', last.previous_cursor)
+                self.assertEqual(back, [self.expected[2:4], self.expected[0:2]])
+                self.assertFalse([q for q in queries if 'OFFSET' in q['sql']])
+
+    @mock.patch.object(RestaurantListView, 'paginate_by', 2)
+    def test_cursor_carries_over_between_cache_and_database(self):
+        first = self.client.get(self.url, {'prefecture': '愛知県', 'sort': 'price_low'}).context['page_obj']
+        with mock.patch('restaurants.search_cache.MAX_CACHED_RESULTS', 0):
+            cache.clear()
+            pages, _ = self.walk(cursor=first.next_cursor)
+        self.assertEqual(pages, [self.expected[2:4], self.expected[4:]])
+
+        # 壊れたカーソルは1ページ目
+        page = self.client.get(self.url, {'prefecture': '愛知県', 'sort': 'price_low', 'cursor': '%%%'}).context['page_obj']
+        self.assertEqual([r.pk for r in page], self.expected[0:2])
+
+
+class SearchCacheTests(RestaurantFixtureMixin, TestCase):
+    """検索結果のキャッシュは店舗・カテゴリ・お気に入りが変わると使われなくなる"""
+
+    def result_keys(self):
+        queryset = Restaurant.objects.filter(search_filter('すし')).order_by('price_min', 'id')
+        return search_cache.get_result_keys({'keyword': 'すし'}, ['price_min', 'id'], queryset)
+
+    def test_invalidated_by_saves(self):
+        first = self.make_restaurant('すし太郎', price_min=3000)
+        self.assertEqual(self.result_keys(), [[3000, first.pk]])
+
+        # signal が飛ばない更新はキャッシュのまま
+        Restaurant.objects.filter(pk=first.pk).update(price_min=2500)
+        self.assertEqual(self.result_keys(), [[3000, first.pk]])
+
+        second = self.make_restaurant('すし次郎', price_min=1000)
+        self.assertEqual(self.result_keys(), [[1000, second.pk], [2500, first.pk]])
+
+        version = search_cache.get_version()
+        Category.objects.get(pk=self.cafe.pk).save()
+        user = User.objects.create_user('user@example.com', None, name='user')
+        Favorite.objects.create(user=user, restaurant=first)
+        self.assertEqual(search_cache.get_version(), version + 2)
+
+    def test_version_survives_cache_eviction(self):
+        self.make_restaurant('すし太郎')
+        version = search_cache.get_version()
+        cache.clear()  # LocMemCache の追い出し
+        index_versions._checked.clear()  # ほかのプロセス
+        self.assertEqual(search_cache.get_version(), version)
+        self.assertEqual(IndexVersion.objects.get(name=search_cache.VERSION_NAME).version, version)
+
+    @mock.patch('restaurants.search_cache.MAX_CACHED_RESULTS', 1)
+    def test_too_many_results_are_not_cached(self):
+        self.make_restaurant('すし太郎')
+        self.make_restaurant('すし次郎')
+        self.assertIsNone(self.result_keys())
+
+
+class FacetTests(RestaurantFixtureMixin, TestCase):
+    def test_counts(self):
+        self.make_restaurant('すし太郎', price_min=800, prefecture='愛知県', city='名古屋市')
+        self.make_restaurant('焼肉一番', price_min=1200, prefecture='愛知県', city='名古屋市')
+        self.make_restaurant('喫茶みどり', category=self.cafe, price_min=1500, prefecture='岐阜県', city='')
+
+        facets = compute_facets(Restaurant.objects.all())
+        self.assertEqual(facets['category'], [('和食', 2), ('カフェ', 1)])
+        self.assertEqual(facets['prefecture'], [('愛知県', 2), ('岐阜県', 1)])
+        self.assertEqual(facets['city'], [('名古屋市', 2)])
+        self.assertEqual([(key, n) for key, _, n in facets['price']], [('0-1000', 1), ('1000-3000', 2)])
+
+        response = self.client.get(reverse('restaurants:restaurant_list'), {'price': '1000-3000'})
+        self.assertEqual({r.name for r in response.context['restaurants']}, {'焼肉一番', '喫茶みどり'})
+        self.assertEqual(response.context['facets']['category'], [('カフェ', 1), ('和食', 1)])
+
+    def test_one_group_by_and_cached(self):
+        self.make_restaurant('すし太郎', prefecture='愛知県')
+        params = {'prefecture': '愛知県'}
+        with CaptureQueriesContext(connection) as queries:
+            facets = get_facets(params, Restaurant.objects.filter(prefecture='愛知県'))
+        self.assertEqual(facets['prefecture'], [('愛知県', 1)])
+        self.assertEqual(len([q for q in queries if 'GROUP BY' in q['sql']]), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_facets(params, Restaurant.objects.filter(prefecture='愛知県')), facets)
+
+        # 店舗が変われば数え直す
+        self.make_restaurant('焼肉一番', prefecture='愛知県')
+        self.assertEqual(get_facets(params, Restaurant.objects.filter(prefecture='愛知県'))['prefecture'], [('愛知県', 2)])
+
+
+class NearbySearchTests(RestaurantFixtureMixin, TestCase):
+    """現在地検索は半径内の店舗だけを近い順に出す"""
+
+    def setUp(self):
+        super().setUp()
+        self.station = self.make_restaurant('名駅店', latitude=35.1709, longitude=136.8815)
+        self.sakae = self.make_restaurant('栄店', latitude=35.1681, longitude=136.9089)
+        self.make_restaurant('豊橋店', latitude=34.7629, longitude=137.3820)
+        self.make_restaurant('位置なし')
+
+    @mock.patch.object(RestaurantListView, 'paginate_by', 1)
+    def test_nearest_first(self):
+        url = reverse('restaurants:restaurant_list')
+        params = {'lat': '35.1705', 'lng': '136.8820', 'radius': '3'}
+        response = self.client.get(url, params)
+        first = response.context['restaurants'][0]
+        self.assertEqual(first.pk, self.station.pk)
+        self.assertLess(first.distance, 0.1)
+        params['cursor'] = response.context['page_obj'].next_cursor
+        response = self.client.get(url, params)
+        self.assertEqual([r.pk for r in response.context['restaurants']], [self.sakae.pk])
+        self.assertFalse(response.context['page_obj'].has_next())
+
+        response = self.client.get(url, dict(params, radius='1', cursor=''))
+        self.assertEqual(response.context['facets']['category'], [('和食', 1)])
+
+
+    def test_invalid_location(self):
+        self.assertEqual(parse_location({'lat': '35', 'lng': '136', 'radius': '100'}), (35.0, 136.0, 50))
+        for params in [{'lat': '35', 'lng': '136', 'radius': 'nan'}, {'lat': 'nan', 'lng': '136'},
+                       {'lat': '35', 'lng': 'inf'}, {'lat': '35', 'lng': '136', 'radius': '-inf'}, {'lat': '91', 'lng': '0'}]:
+            self.assertIsNone(parse_location(params), params)
+        response = self.client.get(reverse('restaurants:restaurant_list'), {'lat': '35', 'lng': '136', 'radius': 'nan'})
+        self.assertIsNone(response.context['location'])
+
+    def test_grid_filter_keeps_everything_in_radius(self):
+        # 中心のまわりに格子状に置いた店舗で、全件の距離計算と同じ結果になる
+        Restaurant.objects.all().delete()
+        center = (35.1709, 136.8815)
+        for i in range(-6, 7):
+            for j in range(-6, 7):
+                self.make_restaurant(f'{i},{j}', latitude=center[0] + i * 0.005, longitude=center[1] + j * 0.006)
+        for radius in [0.3, 1, 2.5]:
+            candidates = Restaurant.objects.filter(nearby_filter(*center, radius))
+            expected = sorted(
+                [round(haversine_km(*center, r.latitude, r.longitude), 3), r.pk]
+                for r in Restaurant.objects.all()
+                if haversine_km(*center, r.latitude, r.longitude) <= radius
+            )
+            self.assertEqual(distance_keys(candidates, *center, radius), expected)
+            self.assertLess(candidates.count(), Restaurant.objects.count())
+
+
+class AvailabilityFilterTests(RestaurantFixtureMixin, TestCase):
+    """一覧の空席検索は、その日時・人数で座れるテーブルがある店舗だけを出す"""
+
+    def setUp(self):
+        super().setUp()
+        self.large = self.make_restaurant('4名席の店')
+        Table.objects.create(restaurant=self.large, capacity=4)
+        self.small = self.make_restaurant('2名席の店')
+        Table.objects.create(restaurant=self.small, capacity=2)
+        self.make_restaurant('テーブルなし')
+        self.day = date.today() + timedelta(days=7)
+
+    def names(self, **params):
+        params.setdefault('date', self.day.isoformat())
+        response = self.client.get(reverse('restaurants:restaurant_list'), params)
+        return {r.name for r in response.context['restaurants']}
+
+    def test_filter(self):
+        self.assertEqual(self.names(time='19:00', party_size='2'), {'4名席の店', '2名席の店'})
+        self.assertEqual(self.names(time='19:00', party_size='3'), {'4名席の店'})
+        self.assertEqual(self.names(time='23:00', party_size='2'), set())  # 営業時間外
+        self.assertEqual(self.names(time='19:00', date=(date.today() - timedelta(days=1)).isoformat()), set())
+
+        user = User.objects.create_user('user@example.com', None, name='user')
+        reservation = Reservation.objects.create(user=user, restaurant=self.small, party_size=2,
+                                                 reservation_date=self.day, reservation_time=time(19))
+        assign_table(reservation)
+        self.assertEqual(self.names(time='19:30', party_size='2'), {'4名席の店'})
+        self.assertEqual(self.names(time='21:00', party_size='2'), {'4名席の店', '2名席の店'})
+
+    def test_query_count_does_not_grow_with_restaurants(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.names(time='19:00', party_size='2')
+            return len(queries)
+
+        before = count_queries()
+        for i in range(5):
+            Table.objects.create(restaurant=self.make_restaurant(f'追加{i}'), capacity=4)
+        self.assertEqual(count_queries(), before)
+
+
+class NormalizeTests(RestaurantFixtureMixin, TestCase):
+    """半角カナ・全角英数字・カタカナ/ひらがな・大文字小文字のゆれを保存時と検索時の両方でなくす"""
+
+    def test_normalize(self):
+        self.assertEqual(normalize('ｽｼ　ＢＡＲ'), 'すし bar')
+        self.assertEqual(normalize('カフェ\n ヾ'), 'かふぇ ゞ')
+        self.assertEqual(normalize(None), '')
+        # 表記ゆれが違っても検索結果のキャッシュキーは同じ
+        self.assertEqual(search_cache.make_key({'keyword': 'ｽｼ'}, ['-id']),
+                         search_cache.make_key({'keyword': ' すし ', 'page': '2'}, ['-id']))
+
+    def test_saved_keys_and_search(self):
+        restaurant = self.make_restaurant('ｽｼ　ＢＡＲ', city='名古屋市')
+        self.assertEqual(split_search_key(restaurant.search_key)['name'], 'すし bar')
+        self.assertEqual(self.search('スシ'), {'ｽｼ　ＢＡＲ'})
+        self.assertEqual(self.search('bar'), {'ｽｼ　ＢＡＲ'})
+
+        # update_fields で名前だけ保存しても search_key は付いてくる
+        restaurant.name = 'カフェ'
+        restaurant.save(update_fields=['name'])
+        self.assertEqual(split_search_key(Restaurant.objects.get(pk=restaurant.pk).search_key)['name'], 'かふぇ')
+        self.assertEqual(self.search('ｶﾌｪ', columns=['name']), {'カフェ'})
+        self.assertEqual(Category.objects.get(pk=self.cafe.pk).search_key, 'かふぇ')
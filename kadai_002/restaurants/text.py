@@ -0,0 +1,63 @@
+"""
+検索用の文字列の正規化
+
+半角カナ・全角英数字・ひらがな/カタカナ・大文字小文字のゆれをなくす。
+店舗・カテゴリの保存時に search_key に入れておき、検索語も同じ関数で変換して比べる
+（検索のたびに店舗側の文字列を変換することはしない）。
+"""
+import unicodedata
+
+
+# カタカナ（ァ〜ヶ, ヽヾ）→ ひらがな（ぁ〜ゖ, ゝゞ）はコードポイントが 0x60 ずれているだけ
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+_KATAKANA_TO_HIRAGANA.update({0x30FD: 0x309D, 0x30FE: 0x309E})
+
+
+def normalize(text):
+    """
+    NFKC（半角カナ→全角、全角英数字→半角）→ カタカナをひらがなに → 小文字、
+    空白・改行は半角スペース1つにまとめる。
+    例: 'ｽｼ　ＢＡＲ' → 'すし bar'
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    text = text.translate(_KATAKANA_TO_HIRAGANA).lower()
+    return ' '.join(text.split())
+
+
+# Restaurant.search_key に入れるフィールド（1行に1フィールド、この順番）
+SEARCH_KEY_FIELDS = ('name', 'description', 'prefecture', 'city')
+
+
+def make_search_key(values):
+    """各フィールドを正規化して改行でつなぐ"""
+    return '\n'.join(normalize(value) for value in values)
+
+
+def split_search_key(search_key):
+    """make_search_key の逆。{フィールド名: 正規化した値}"""
+    lines = (search_key or '').split('\n')
+    lines += [''] * (len(SEARCH_KEY_FIELDS) - len(lines))
+    return dict(zip(SEARCH_KEY_FIELDS, lines))
+
+
+def make_search_grams(search_key):
+    """
+    1〜2文字の検索語用のトークン（search.py の GRAM_TABLE に入れる）。search_key と同じく1行に1フィールド。
+    語ごとに2文字ずつ（すし太郎 → すし・し太・太郎）と最後の1文字（郎）を、UTF-8 の16進数にして空白でつなぐ。
+    2文字の語はトークンと完全一致、1文字の語は前方一致で探せる（UTF-8 はある文字が別の文字の先頭と一致しないので、
+    16進数の前方一致でもその文字から始まるトークンだけに当たる）。
+    16進数にするのは、FTS5 のトークナイザに記号で区切られたり、まとめられたりしないようにするため。
+    """
+    return '\n'.join(_grams(line) for line in (search_key or '').split('\n'))
+
+
+def _grams(value):
+    tokens = []
+    for word in value.split():
+        tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+        tokens.append(word[-1])
+    return ' '.join(dict.fromkeys(gram_token(token) for token in tokens))
+
+
+def gram_token(text):
+    return text.encode().hex()
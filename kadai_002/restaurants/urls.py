@@ -15,6 +15,7 @@ urlpatterns = [
     
     # --- API ---
     path('api/cities/', views.get_cities_by_prefecture, name='get_cities'),
+    path('api/suggest/', views.suggest, name='suggest'),
 
     # --- オーナー管理画面：ダッシュボード ---
     path("owner/dashboard/", views.OwnerDashboardView.as_view(), name="owner_dashboard"),
@@ -5,16 +5,27 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse, reverse_lazy
-from django.db.models import Avg, Count, Exists, OuterRef, Q
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.contrib import messages
 from .models import Restaurant, Category, Favorite, Company
 from .forms import CompanyForm, CategoryForm, OwnerRestaurantForm, OwnerMemberCreateForm
-from accounts.mixins import PaidMemberRequiredMixin
+from .search import search_filter, rank_expression
+from .pagination import KeysetPaginator, KeyListPaginator
+from . import search_cache, city_index, suggest_index
+from .facets import PRICE_BUCKETS, compute_facets, get_facets, price_filter
+from .geo import distance_keys, nearby_filter, parse_location
+from accounts.idempotency import idempotent, new_key
+from accounts.mixins import OwnerRequiredMixin, PaidMemberRequiredMixin
+from reservations import rollup
+from reservations.availability import free_table_exists, parse_search_params, slot_start
 import csv
 import urllib.parse
+from datetime import timedelta
 from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
 
 User = get_user_model()
@@ -39,6 +50,69 @@ class RestaurantListView(ListView):
     template_name = 'restaurants/restaurant_list.html'
     context_object_name = 'restaurants'
     ordering = ['-id']  # 新しい順に表示
+    paginate_by = 20
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        OFFSET ではなくカーソル（?cursor=...）でページ送りする。
+        並び順の最後は必ず id なので、同じ価格の店舗が続いても取りこぼさない。
+        """
+        ordering = getattr(self, 'sort_ordering', None) or self.ordering
+
+        if getattr(self, 'location', None):
+            return self.paginate_by_distance(queryset, page_size)
+
+        # 同じ検索条件の結果はキャッシュ済みの並び順リストから出す
+        # （空席検索は予約のたびに結果が変わるのでキャッシュしない）
+        keys = None
+        if not getattr(self, 'availability', None):
+            keys = search_cache.get_result_keys(self.request.GET, ordering, queryset)
+        if keys is not None:
+            paginator = KeyListPaginator(keys, ordering, page_size, search_cache.get_restaurants)
+        else:
+            paginator = KeysetPaginator(queryset, ordering, page_size)
+        page = paginator.page(self.request.GET.get('cursor'))
+
+        self.mark_favorites(page.object_list)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def paginate_by_distance(self, queryset, page_size):
+        """
+        現在地検索: geohash で絞った候補だけ距離を計算して近い順に並べる。
+        半径内の近い順 MAX_CACHED_RESULTS 件までを対象にする。
+        """
+        latitude, longitude, radius = self.location
+        compute = lambda: distance_keys(
+            queryset, latitude, longitude, radius, limit=search_cache.MAX_CACHED_RESULTS
+        )
+        if getattr(self, 'availability', None):
+            keys = compute()
+        else:
+            keys = search_cache.get_result_keys(self.request.GET, ['distance'], queryset, compute=compute)
+        paginator = KeyListPaginator(keys, ['distance', 'id'], page_size, search_cache.get_restaurants)
+        page = paginator.page(self.request.GET.get('cursor'))
+
+        distances = {pk: distance for distance, pk in keys}
+        for restaurant in page.object_list:
+            restaurant.distance = distances.get(restaurant.pk)
+        # 件数集計も半径内の店舗だけで数える
+        self.filtered_queryset = self.filtered_queryset.filter(pk__in=list(distances))
+
+        self.mark_favorites(page.object_list)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def mark_favorites(self, restaurants):
+        """表示するページの店舗にだけ「自分がお気に入り済みか」フラグを付ける"""
+        favorited_ids = set()
+        if self.request.user.is_authenticated and restaurants:
+            favorited_ids = set(
+                Favorite.objects.filter(
+                    user=self.request.user,
+                    restaurant_id__in=[r.pk for r in restaurants],
+                ).values_list('restaurant_id', flat=True)
+            )
+        for restaurant in restaurants:
+            restaurant.is_favorited = restaurant.pk in favorited_ids
 
     def get_queryset(self):
         # 関連も一緒に取ってくる
@@ -48,12 +122,17 @@ class RestaurantListView(ListView):
         # 検索パラメータの取得
         keyword = self.request.GET.get('keyword')
         category_name = self.request.GET.get('category_name')
+        category_keyword = self.request.GET.get('category_keyword')
         prefecture = self.request.GET.get('prefecture')
         city = self.request.GET.get('city')
         category_id = self.request.GET.get('category')
+        price = self.request.GET.get('price')
+        self.location = parse_location(self.request.GET)
+        self.availability = parse_search_params(self.request.GET)
         
         # 何も検索していない場合は空のクエリセットを返す
-        if not any([keyword, category_name, prefecture, city, category_id]):
+        if not any([keyword, category_name, category_keyword, prefecture, city, category_id, price, self.location, self.availability]):
+            self.filtered_queryset = qs.none()
             return qs.none()
 
         # ?category=1 みたいな値を取得して絞り込み
@@ -61,11 +140,8 @@ class RestaurantListView(ListView):
             qs = qs.filter(category_id=category_id)
 
         # --- カテゴリ名で検索 (?category_keyword=和食) ---
-        category_keyword = self.request.GET.get('category_keyword')
         if category_keyword:
-            qs = qs.filter(
-                category__name__icontains=category_keyword
-            )
+            qs = qs.filter(search_filter(category_keyword, columns=['category_name']))
         
         # --- 名前で検索（修正案で出たやつ） ---
         category_name = self.request.GET.get('category_name')
@@ -80,40 +156,60 @@ class RestaurantListView(ListView):
         # --- 市区町村で絞り込み ---
         city = self.request.GET.get('city')
         if city:
-            qs = qs.filter(city__icontains=city)
+            qs = qs.filter(search_filter(city, columns=['city']))
 
-        # --- 店舗名で検索 ---
+        # --- キーワード検索（店舗名・説明・カテゴリ・住所を全文検索） ---
         keyword = self.request.GET.get('keyword')
+        search_rank = None
         if keyword:
-            qs = qs.filter(name__icontains=keyword)
+            qs = qs.filter(search_filter(keyword))
+            search_rank = rank_expression(keyword)
+
+        # --- 価格帯で絞り込み（?price=1000-3000） ---
+        price_q = price_filter(price) if price else None
+        if price_q is not None:
+            qs = qs.filter(price_q)
+
+        # --- 現在地から半径 N km（?lat=..&lng=..&radius=..） ---
+        if self.location:
+            qs = qs.filter(nearby_filter(*self.location))
+
+        # --- 空席で絞り込み（?date=..&time=..&party_size=..） ---
+        if self.availability:
+            reservation_date, reservation_time, party_size = self.availability
+            reservation_time = slot_start(reservation_time)  # 予約と同じ15分枠で判定する
+            if reservation_date < timezone.localdate():
+                qs = qs.none()
+            else:
+                qs = qs.filter(
+                    free_table_exists(reservation_date, reservation_time, party_size),
+                    open_time__lte=reservation_time,
+                    close_time__gte=reservation_time,
+                )
 
-        # いつでもお気に入り件数を付ける
-        qs = qs.annotate(
-            favorite_count=Count('favorites', distinct=True)
-        )
+        # 件数集計（ファセット）は並び替え前の絞り込み結果から数える
+        self.filtered_queryset = qs
 
-        # ログイン済みなら「自分がお気に入り済みか」フラグも付ける
-        if self.request.user.is_authenticated:
-            qs = qs.annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(
-                        user=self.request.user,
-                        restaurant=OuterRef('pk')
-                    )
-                )
-            )
+        # お気に入り件数は Restaurant.favorite_count に保存済み（集計不要）
+        # 「自分がお気に入り済みか」はページ送りの後で mark_favorites が付ける
 
         # --- 並び替え機能 ---
-        sort_by = self.request.GET.get('sort', 'default')
-        if sort_by == 'price_low':
+        # キーワード検索のときは関連度順がデフォルト
+        sort_by = self.request.GET.get('sort') or ('relevance' if search_rank is not None else 'default')
+        if sort_by == 'relevance' and search_rank is not None:
+            # 関連度が高い順（bm25 は小さいほど関連が高い）
+            qs = qs.annotate(search_rank=search_rank)
+            self.sort_ordering = ['search_rank', '-id']
+        elif sort_by == 'price_low':
             # 価格が安い順
-            qs = qs.order_by('price_min', 'id')
+            self.sort_ordering = ['price_min', 'id']
         elif sort_by == 'price_high':
             # 価格が高い順
-            qs = qs.order_by('-price_max', '-id')
+            self.sort_ordering = ['-price_max', '-id']
         else:
             # デフォルト：新しい順
-            qs = qs.order_by('-id')
+            self.sort_ordering = ['-id']
+        qs = qs.order_by(*self.sort_ordering)
 
         return qs
     
@@ -138,9 +234,34 @@ class RestaurantListView(ListView):
         ctx["categories"] = Category.objects.all() # ID検索用（念のため残す）
         ctx["current_category_id"] = self.request.GET.get("category")
         ctx["keyword"] = self.request.GET.get("keyword", "")
-        ctx["sort"] = self.request.GET.get("sort", "default")
+        ctx["sort"] = self.request.GET.get("sort") or ("relevance" if ctx["keyword"] else "default")
+        if self.location:
+            ctx["sort"] = "distance"  # 現在地検索は常に近い順
         ctx["prefecture"] = self.request.GET.get("prefecture", "")
         ctx["city"] = self.request.GET.get("city", "")
+        ctx["price"] = self.request.GET.get("price", "")
+        ctx["location"] = self.location
+        ctx["availability"] = self.availability
+        ctx["date"] = self.request.GET.get("date", "")
+        ctx["time"] = self.request.GET.get("time", "")
+        ctx["party_size_choices"] = range(1, 21)
+        ctx["radius_choices"] = [1, 3, 5, 10]
+
+        # カテゴリ・都道府県・市区町村・価格帯ごとの件数（「和食 (42)」表示用）
+        if self.availability:
+            facets = compute_facets(self.filtered_queryset) if not self.filtered_queryset.query.is_empty() else None
+        else:
+            facets = get_facets(self.request.GET, self.filtered_queryset)
+        ctx["facets"] = facets
+        if facets:
+            category_counts = dict(facets["category"])
+            prefecture_counts = dict(facets["prefecture"])
+            ctx["category_options"] = [(name, category_counts.get(name, 0)) for name in ctx["category_names"]]
+            ctx["prefecture_options"] = [(pref, prefecture_counts.get(pref, 0)) for pref in ctx["prefectures"]]
+        else:
+            ctx["category_options"] = [(name, None) for name in ctx["category_names"]]
+            ctx["prefecture_options"] = [(pref, None) for pref in ctx["prefectures"]]
+        ctx["price_buckets"] = PRICE_BUCKETS
         return ctx
 
 
@@ -153,17 +274,18 @@ class RestaurantDetailView(DetailView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         r = self.object
-        agg = r.reviews.aggregate(avg=Avg('rating'), cnt=Count('id'))
-        ctx['avg_rating'] = agg['avg'] or 0
-        ctx['review_count'] = agg['cnt'] or 0
+        # 評価・件数は Restaurant に保存済みの集計値を使う
+        ctx['avg_rating'] = r.rating_avg
+        ctx['review_count'] = r.review_count
         ctx['recent_reviews'] = r.reviews.select_related('user')[:3]
         
         # お気に入り件数を追加
-        ctx['favorite_count'] = r.favorites.count()
+        ctx['favorite_count'] = r.favorite_count
         
         if self.request.user.is_authenticated:
             ctx['my_review'] = r.reviews.filter(user=self.request.user).first()
             ctx["is_favorited"] = Favorite.objects.filter(user=self.request.user, restaurant=r).exists()
+            ctx["idempotency_key"] = new_key()
         else:
             ctx["is_favorited"] = False
         return ctx
@@ -176,13 +298,11 @@ class MyFavoriteListView(PaidMemberRequiredMixin, LoginRequiredMixin, ListView):
     def get_queryset(self):
         return (Restaurant.objects
                 .filter(favorites__user=self.request.user)
-                .select_related("category", "company")
-                .annotate(avg_rating=Avg("reviews__rating"),
-                          review_count=Count("reviews"),
-                          favorite_count=Count("favorites")))
+                .select_related("category", "company"))
     
 
 @login_required
+@idempotent  # リトライで2回届いてもお気に入りが元に戻らないように
 def favorite_toggle(request, restaurant_pk):
     # 有料会員チェック
     if not request.user.is_paid_member:
@@ -211,8 +331,9 @@ def favorite_toggle(request, restaurant_pk):
     else:
         is_favorited = True
 
-    # お気に入り件数を取得
-    favorite_count = restaurant.favorites.count()
+    # お気に入り件数を取得（シグナルで更新済みの値を読み直すだけ）
+    restaurant.refresh_from_db(fields=['favorite_count'])
+    favorite_count = restaurant.favorite_count
 
     # Ajaxリクエストの場合はJSONレスポンスを返す
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
@@ -234,16 +355,6 @@ def favorite_toggle(request, restaurant_pk):
 
 
 
-class OwnerRequiredMixin(UserPassesTestMixin):
-    def test_func(self):
-        user = self.request.user
-        return user.is_authenticated and getattr(user, "is_owner_member", False)
-
-    def handle_no_permission(self):
-        from django.contrib.auth.views import redirect_to_login
-        return redirect_to_login(self.request.get_full_path())    
-
-
 class OwnerRestaurantListView(LoginRequiredMixin, OwnerRequiredMixin, ListView):
     model = Restaurant
     template_name = "restaurants/owner_restaurant_list.html"
@@ -291,9 +402,27 @@ class OwnerRestaurantListView(LoginRequiredMixin, OwnerRequiredMixin, ListView):
 # オーナーダッシュボードのビュー
 class OwnerDashboardView(OwnerRequiredMixin, TemplateView):
     template_name = "restaurants/owner_dashboard.html"
+    default_days = 28
+    max_days = 365
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
+        # 自社の店舗の、直近 days 日（今日まで）の曜日×時間の席の埋まり具合など。
+        # 予約のテーブルは見ずに、日ごとの集計（ReservationRollup）だけから出す
+        try:
+            days = int(self.request.GET.get('days') or self.default_days)
+        except ValueError:
+            days = self.default_days
+        days = min(max(days, 1), self.max_days)
+        end = timezone.localdate()
+        start = end - timedelta(days=days - 1)
+
+        company = getattr(self.request.user, "company", None)
+        restaurants = Restaurant.objects.filter(company=company).order_by('name') if company else []
+        ctx['days'] = days
+        ctx['period_start'] = start
+        ctx['period_end'] = end
+        ctx['restaurant_stats'] = rollup.dashboard(restaurants, start, end)
         return ctx
     
 
@@ -644,10 +773,44 @@ class OwnerMemberCreateView(LoginRequiredMixin, OwnerRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+def _cities_etag(request):
+    return city_index.get_etag(request.GET.get('prefecture', ''))
+
+
+@condition(etag_func=_cities_etag)
 def get_cities_by_prefecture(request):
-    """都道府県に対応する市区町村リストを返すAPI"""
+    """都道府県に対応する市区町村リストを返すAPI（メモリ上のインデックスから返す）"""
     prefecture = request.GET.get('prefecture', '')
-    if prefecture:
-        cities = Restaurant.objects.filter(prefecture=prefecture).values_list('city', flat=True).distinct().order_by('city')
-        return JsonResponse({'cities': list(cities)})
-    return JsonResponse({'cities': []})
\ No newline at end of file
+    cities = city_index.get_cities(prefecture) if prefecture else []
+    response = JsonResponse({'cities': cities})
+    # 1分はブラウザのキャッシュを使い、その後は ETag で再検証させる
+    patch_cache_control(response, public=True, max_age=60)
+    return response
+
+
+def suggest(request):
+    """検索ボックスの入力候補を返すAPI（メモリ上のインデックスから返す）"""
+    try:
+        limit = int(request.GET.get('limit') or suggest_index.DEFAULT_LIMIT)
+    except ValueError:
+        limit = suggest_index.DEFAULT_LIMIT
+    limit = min(max(limit, 1), suggest_index.MAX_LIMIT)
+
+    result = suggest_index.suggest(request.GET.get('q', ''), limit)
+    list_url = reverse('restaurants:restaurant_list')
+    response = JsonResponse({
+        'restaurants': [
+            {'name': name, 'url': reverse('restaurants:restaurant_detail', args=[pk])}
+            for pk, name in result['restaurants']
+        ],
+        'categories': [
+            {'name': name, 'url': list_url + '?' + urllib.parse.urlencode({'category_name': name})}
+            for name in result['categories']
+        ],
+        'cities': [
+            {'name': name, 'url': list_url + '?' + urllib.parse.urlencode({'city': name})}
+            for name in result['cities']
+        ],
+    })
+    patch_cache_control(response, public=True, max_age=60)
+    return response
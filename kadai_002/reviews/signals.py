@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from restaurants import suggest_index
+from restaurants.counters import adjust_review_stats
+from .models import Review
+
+
+@receiver(pre_save, sender=Review)
+def remember_old_rating(sender, instance, **kwargs):
+    # 編集時は評価の差分だけ足し引きしたいので、保存前の店舗と評価を覚えておく
+    instance._old_values = None
+    if instance.pk:
+        instance._old_values = (
+            Review.objects.filter(pk=instance.pk).values_list('restaurant_id', 'rating').first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    old_values = getattr(instance, '_old_values', None)
+    if created or old_values is None:
+        adjust_review_stats(instance.restaurant_id, 1, instance.rating)
+        suggest_index.add_popularity(instance.restaurant_id, 1)
+        return
+    old_restaurant_id, old_rating = old_values
+    if old_restaurant_id != instance.restaurant_id:
+        # 別の店舗に付け替えたときは、前の店舗から引いて新しい店舗に足す
+        adjust_review_stats(old_restaurant_id, -1, -old_rating)
+        suggest_index.add_popularity(old_restaurant_id, -1)
+        adjust_review_stats(instance.restaurant_id, 1, instance.rating)
+        suggest_index.add_popularity(instance.restaurant_id, 1)
+    elif old_rating != instance.rating:
+        adjust_review_stats(instance.restaurant_id, 0, instance.rating - old_rating)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    adjust_review_stats(instance.restaurant_id, -1, -instance.rating)
+    suggest_index.add_popularity(instance.restaurant_id, -1)